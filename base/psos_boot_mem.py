@@ -0,0 +1,97 @@
+'''
+    Boot memory footprint.
+
+    Used by psos_main when config.json has "boot_mem": true.
+    Heap use is measured after each service's module is imported,
+    after its ModuleService is created and after its run() task
+    is created, giving the memory cost of each step. The run step
+    is marked before the task first runs, so no other service's
+    allocations are charged to it. What run() allocates once it
+    runs is not part of the table.
+
+    After the last step for a service the free memory is recorded.
+    Once every service is started, done() records the largest
+    free block and the fragmentation (percent of free memory not
+    in the largest block). Finding the largest block takes a
+    number of test allocations, so it is only done then.
+
+    report() returns:
+      {"dev":"e02", "total":111168, "free":24000,
+       "block":12000, "frag":50,
+       "svcs":[[name, module, import, init, run, free], ...]}
+    host/check_boot_mem.py compares a report with a memory budget.
+'''
+
+import gc
+
+IMPORT = 2
+INIT   = 3
+RUN    = 4
+
+# largest block that can be allocated
+def max_free_block():
+    lo = 0
+    hi = gc.mem_free()
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        try:
+            b = bytearray(mid)
+            b = None
+            lo = mid
+        except MemoryError:
+            hi = mid - 1
+    return lo
+
+class BootMem:
+
+    def __init__(self):
+        self.rows = []
+        self._idx = {}
+        gc.collect()
+        self._free = gc.mem_free()
+        self.blk  = 0
+        self.frag = 0
+
+    # record the memory used since the last mark
+    def mark(self,name,module,step):
+        gc.collect()
+        free = gc.mem_free()
+
+        if name in self._idx:
+            row = self.rows[self._idx[name]]
+        else:
+            row = [name,module,0,0,0,0]
+            self._idx[name] = len(self.rows)
+            self.rows.append(row)
+
+        row[step] += self._free - free
+        self._free = free
+
+        if step == RUN:
+            row[5] = free
+
+    # record the largest free block once every service is started
+    def done(self):
+        gc.collect()
+        self._free = gc.mem_free()
+        self.blk = max_free_block()
+        gc.collect()
+        self.frag = 100 - self.blk*100//self._free if self._free > 0 else 0
+
+    def table(self):
+        lines = ["{:12} {:>7} {:>7} {:>7} {:>7} {:>7}".format(
+                 "service","import","init","run","total","free")]
+        for r in self.rows:
+            lines.append("{:12} {:7} {:7} {:7} {:7} {:7}".format(
+                         r[0],r[2],r[3],r[4],r[2]+r[3]+r[4],r[5]))
+        lines.append("free {} largest block {} frag {}%".format(
+                     self._free,self.blk,self.frag))
+        return lines
+
+    def report(self,dev):
+        return {"dev"  : dev,
+                "total": gc.mem_free() + gc.mem_alloc(),
+                "free" : self._free,
+                "block": self.blk,
+                "frag" : self.frag,
+                "svcs" : self.rows }
@@ -0,0 +1,64 @@
+'''
+    Duplicate message cache.
+
+    Detects the same topic and payload received more than once
+    within a time window. Used by svc_mqtt to drop duplicate messages
+    received due to the RPi400 Mosquitto MQTT broker bridge with HiveMQ.
+
+    The last "size" messages are kept in a ring of slots, with a
+    dict from (topic, payload) to slot so each check is a single
+    lookup and memory use does not grow with the message rate.
+    A new message replaces the oldest one in the ring, so a
+    duplicate is caught as long as fewer than size messages are
+    received between it and the original. The slots keep a reference
+    to the topic and payload, so size is also the memory cap.
+
+    Time is divided into buckets of window_ms/buckets milliseconds.
+    Each slot records the bucket it was written in and is treated
+    as expired once it is "buckets" buckets old.
+
+    self.dups counts suppressed duplicates.
+'''
+
+import time
+
+class DedupCache:
+
+    def __init__(self, window_ms=3000, size=64, buckets=4):
+        self.size = size
+        self._buckets   = buckets
+        self._bucket_ms = max(window_ms // buckets, 1)
+
+        self._slot = {}
+        self._key  = [None] * size
+        self._bkt  = [0] * size
+        self._next = 0
+
+        self.dups = 0
+
+    # return True if topic and msg were seen within the window,
+    # otherwise remember them and return False
+    def is_dup(self,topic,msg):
+        k = (topic,msg)
+        b = time.ticks_ms() // self._bucket_ms
+
+        i = self._slot.get(k)
+        if i != None:
+            if 0 <= b - self._bkt[i] < self._buckets:
+                self.dups += 1
+                return True
+            # expired, it is remembered again below
+            self._key[i] = None
+            del self._slot[k]
+
+        # the oldest message makes way
+        i = self._next
+        old = self._key[i]
+        if old != None:
+            del self._slot[old]
+
+        self._key[i] = k
+        self._bkt[i] = b
+        self._slot[k] = i
+        self._next = (i + 1) % self.size
+        return False
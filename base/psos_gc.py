@@ -0,0 +1,144 @@
+'''
+    Garbage collection scheduler.
+
+    Services call maybe_collect() where they used to call
+    gc.collect(). It is a cheap hint; whether a collection
+    is run depends on the policy:
+
+      "always"    - collect on every hint (the original behavior)
+      "threshold" - collect when free memory is below min_free.
+                    Free memory is checked at most every check_ms.
+                    If alloc_kb is set, gc.threshold() is also set so
+                    MicroPython collects after alloc_kb of allocations.
+      "idle"      - "threshold", plus svc_gc collects when the event
+                    loop is idle and at least idle_kb has been
+                    allocated since the last collection.
+
+    The policy is "always", so nodes collect as they did before,
+    until svc_gc configures it from psos_parms.json, e.g.
+        {"name": "gc", "module": "svc_gc", "policy": "idle"}
+    svc_gc selects "threshold" if no policy is given.
+
+    collect() always collects and is timed. stats() returns the
+    number of collections, the pause times, and the collections
+    per minute. Other collections (gc.threshold, out of memory
+    or a direct gc.collect()) can't be timed. They are counted
+    as "auto" when svc_gc sees the heap shrink.
+'''
+
+import gc
+import time
+
+POLICY_ALWAYS    = "always"
+POLICY_THRESHOLD = "threshold"
+POLICY_IDLE      = "idle"
+
+class GcScheduler:
+
+    def __init__(self):
+        self.policy    = POLICY_ALWAYS
+        self.min_free  = 16*1024
+        self.check_ms  = 1000
+        self.idle_kb   = 8
+
+        self._last_check = time.ticks_ms()
+        self._alloc      = 0   # gc.mem_alloc() after the last collection
+        self._seen       = 0   # gc.mem_alloc() when last checked
+
+        self.reset_stats()
+
+    def configure(self,policy=POLICY_THRESHOLD,min_free=16*1024,
+                  check_ms=1000,alloc_kb=0,idle_kb=8):
+        self.policy   = policy
+        self.min_free = min_free
+        self.check_ms = check_ms
+        self.idle_kb  = idle_kb
+
+        if alloc_kb > 0:
+            try:
+                gc.threshold(alloc_kb*1024)
+            except AttributeError:
+                pass
+
+    def reset_stats(self):
+        self.collects  = 0
+        self.auto      = 0
+        self.hints     = 0
+        self.pause_us  = 0
+        self.pause_max = 0
+        self._start    = time.ticks_ms()
+
+    # collect now and record the pause
+    def collect(self):
+        t = time.ticks_us()
+        gc.collect()
+        t = time.ticks_diff(time.ticks_us(),t)
+
+        self.collects += 1
+        self.pause_us += t
+        if t > self.pause_max:
+            self.pause_max = t
+        self._alloc = gc.mem_alloc()
+        self._seen  = self._alloc
+
+    # a good time to collect, if the policy wants to.
+    # Returns True if a collection was run.
+    def maybe_collect(self):
+        self.hints += 1
+
+        if self.policy == POLICY_ALWAYS:
+            self.collect()
+            return True
+
+        now = time.ticks_ms()
+        if time.ticks_diff(now,self._last_check) < self.check_ms:
+            return False
+        self._last_check = now
+
+        if gc.mem_free() < self.min_free:
+            self.collect()
+            return True
+        return False
+
+    # called periodically by svc_gc.
+    # idle is True if the event loop has nothing else to do.
+    def idle_collect(self,idle):
+        alloc = gc.mem_alloc()
+
+        # heap only shrinks by collecting, so MicroPython
+        # collected since the last check
+        if alloc < self._seen:
+            self.auto += 1
+            self._alloc = alloc
+        self._seen = alloc
+
+        if (idle and self.policy == POLICY_IDLE and
+            alloc - self._alloc >= self.idle_kb*1024):
+            self.collect()
+            return True
+        return False
+
+    def stats(self):
+        mins = time.ticks_diff(time.ticks_ms(),self._start) / 60000
+        n = self.collects
+        return {
+            "policy"    : self.policy,
+            "collects"  : n,
+            "auto"      : self.auto,
+            "hints"     : self.hints,
+            "per_min"   : round(n/mins,1) if mins > 0 else 0,
+            "pause_avg" : self.pause_us//n if n > 0 else 0,
+            "pause_max" : self.pause_max,
+            "mem_free"  : gc.mem_free()
+            }
+
+_sched = GcScheduler()
+
+def get_scheduler():
+    return _sched
+
+def maybe_collect():
+    return _sched.maybe_collect()
+
+def collect():
+    _sched.collect()
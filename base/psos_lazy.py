@@ -0,0 +1,217 @@
+'''
+    Lazy services.
+
+    A service with "lazy": true in psos_parms.json is not imported
+    or created at boot. psos_main creates a LazyService for it
+    instead, which costs a few hundred bytes rather than the
+    module and its ModuleService.
+
+    The service is loaded (module imported, ModuleService created
+    and its run() task started) on the first of:
+      - get_svc() for its name, see psos_parms.py
+      - a message on one of its wake topics
+
+    The wake topics are the "wake" parm (a topic or list of topics)
+    or, if not given, the service's own subscription parms: every
+    parm whose name starts with "sub". The message that woke the
+    service is delivered to the subscriptions the service makes
+    when it starts, so it is not lost.
+
+    With "idle_s" set, a loaded service that has had no message on
+    its wake topics for idle_s seconds is unloaded: its run() task
+    is cancelled, its subscriptions removed and its module deleted
+    from sys.modules so the memory can be collected. It will be
+    loaded again when needed. Only run() is cancelled, tasks the
+    service started itself keep running and keep it in memory.
+    Only use idle_s for services that do all their work in run()
+    and that other services don't keep a reference to, e.g.
+        {"name": "mem_use", "module": "svc_mem_use", "lazy": true,
+         "idle_s": 300, "subscr_upd": "{dev}/mem/upd", "pub_upd": "{dev}/mem"}
+'''
+
+import sys
+import gc
+import time
+import uasyncio
+import queue
+
+from psos_parms import PsosParms
+from psos_topic_tree import TopicTree
+from psos_subscription import Subscription, Q_DROP_OLDEST
+
+# passed to the service as its mqtt service.
+# Records the service's subscriptions so they can be
+# removed when it is unloaded, everything else goes
+# to the real mqtt service.
+class _MqttRecorder:
+
+    def __init__(self,mqtt):
+        self._mqtt   = mqtt
+        self.queues  = []
+        self.tree    = TopicTree()
+
+    async def subscribe(self,topic_filter,queue,qos=0,max_q=0,policy=Q_DROP_OLDEST):
+        if not queue in self.queues:
+            self.queues.append(queue)
+        self.tree.add(Subscription(topic_filter,queue,qos,max_q,policy))
+        await self._mqtt.subscribe(topic_filter,queue,qos,max_q,policy)
+
+    async def unsubscribe(self,queue):
+        self.tree.remove_queue(queue)
+        if queue in self.queues:
+            self.queues.remove(queue)
+        await self._mqtt.unsubscribe(queue)
+
+    def __getattr__(self,name):
+        return getattr(self._mqtt,name)
+
+# service parms that hand out the recorder as the mqtt service
+class _LazyParms(PsosParms):
+
+    def __init__(self,parms,defaults,config,lazy):
+        super().__init__(parms,defaults,config)
+        self._lazy = lazy
+
+    def get_svc(self,svc_name):
+        if svc_name == "mqtt":
+            return self._lazy.get_recorder()
+        return super().get_svc(svc_name)
+
+class LazyService:
+
+    def __init__(self,svc_parms,defaults,config):
+        self._parms    = PsosParms(svc_parms,defaults,config)
+        self._svc_parms = svc_parms
+        self._defaults = defaults
+        self._config   = config
+        self.name      = svc_parms["name"]
+        self.module    = svc_parms["module"]
+        self.idle_ms   = self._parms.get_parm("idle_s",0)*1000
+        self.svc       = None
+        self.loads     = 0
+        self._task     = None
+        self._rec      = None
+        self._q        = None
+        self._used     = time.ticks_ms()
+
+    def get_recorder(self):
+        if self._rec == None:
+            self._rec = _MqttRecorder(self._defaults["services"]["mqtt"])
+        return self._rec
+
+    # import the module, create the service and start it
+    def load(self):
+        self._used = time.ticks_ms()
+        if self.svc != None:
+            return self.svc
+
+        print("lazy: load",self.name)
+        module = __import__(self.module)
+        parms  = _LazyParms(self._svc_parms,self._defaults,self._config,self)
+        self.svc = module.ModuleService(parms)
+        self._defaults["services"][self.name] = self.svc
+        self.loads += 1
+
+        # time it between yields if svc_prof is running
+        coro = self.svc.run()
+        prof = sys.modules.get("psos_prof")
+        if prof != None and prof.profiler != None:
+            coro = prof.profiler.wrap(self.name,coro)
+        self._task = uasyncio.create_task(coro)
+
+        # wake run() if it is waiting for a message
+        if self._q != None:
+            self._q.put_nowait(None)
+        return self.svc
+
+    # stop the service and free its module
+    async def unload(self):
+        if self.svc == None:
+            return
+
+        print("lazy: unload",self.name)
+        del self._defaults["services"][self.name]
+        self._task.cancel()
+        self._task = None
+
+        rec = self._rec
+        if rec != None:
+            for q in rec.queues[:]:
+                await rec.unsubscribe(q)
+
+        self.svc = None
+        if self.module in sys.modules:
+            del sys.modules[self.module]
+        gc.collect()
+
+    # topics that load the service
+    def wake_topics(self):
+        wake = self._parms.get_parm("wake",None)
+        if wake == None:
+            wake = []
+            for key in self._svc_parms:
+                if key.startswith("sub"):
+                    wake.append(self._parms.get_parm(key))
+        elif type(wake) == str:
+            wake = [wake]
+
+        topics = []
+        for w in wake:
+            if type(w) == dict:
+                w = list(w.values())
+            elif type(w) != list:
+                w = [w]
+            for t in w:
+                if type(t) == str and not t in topics:
+                    topics.append(t)
+        return topics
+
+    # deliver the message that woke the service to its
+    # own subscriptions once it has subscribed
+    async def _redeliver(self,msg):
+        rec = self.get_recorder()
+        for i in range(100):
+            if len(rec.queues) > 0:
+                break
+            await uasyncio.sleep_ms(10)
+
+        topic = msg[1]
+        rec.tree.put_match(topic.split('/'),topic,msg[2])
+
+    async def run(self):
+        mqtt   = self._defaults["services"]["mqtt"]
+        topics = self.wake_topics()
+
+        # only the latest message is needed to wake the service
+        q = queue.Queue()
+        self._q = q
+        for t in topics:
+            await mqtt.subscribe(t,q,0,1,Q_DROP_OLDEST)
+
+        ticks_ms   = time.ticks_ms
+        ticks_diff = time.ticks_diff
+        poll_ms    = min(self.idle_ms,1000)
+
+        while True:
+            if self.svc == None:
+                if len(topics) == 0:
+                    # only loaded by get_svc()
+                    await uasyncio.sleep_ms(1000)
+                    continue
+                msg = await q.get()
+                if msg != None and self.svc == None:
+                    self.load()
+                    await self._redeliver(msg)
+
+            elif self.idle_ms <= 0:
+                # never unloaded, just keep the wake queue empty
+                await q.get()
+
+            else:
+                await uasyncio.sleep_ms(poll_ms)
+                if not q.empty():
+                    while not q.empty():
+                        if q.get_nowait() != None:
+                            self._used = ticks_ms()
+                elif ticks_diff(ticks_ms(),self._used) >= self.idle_ms:
+                    await self.unload()
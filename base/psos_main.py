@@ -20,7 +20,8 @@
 
 import uasyncio
 import gc
-from psos_parms import PsosParms
+import psos_gc
+from psos_parms import PsosParms, defaults_changed
 
 # additional imports to load them now instead of later
 import machine
@@ -31,6 +32,22 @@ import secrets
 import micropython
 
 
+# print the boot memory table and publish it to {dev}/boot_mem
+# once the services have had time to connect
+async def report_boot_mem(boot_mem,services,defaults):
+    for line in boot_mem.table():
+        print(line)
+        
+    await uasyncio.sleep(10)
+    dev = defaults.get("dev","?")
+    
+    if "log" in services:
+        for line in boot_mem.table():
+            await services["log"].log_msg("boot_mem",line)
+    
+    if "mqtt" in services:
+        await services["mqtt"].publish(dev+"/boot_mem",boot_mem.report(dev),True)
+
 async def main(parms,config):
     
     # should memory map be printed?
@@ -38,6 +55,15 @@ async def main(parms,config):
     if "pmap" in config:
         pmap = config["pmap"]
         
+    # format templated parms once at startup?
+    compile_parms = config.get("compile_parms",False)
+    
+    # measure memory used by each service?
+    boot_mem = None
+    if config.get("boot_mem",False):
+        import psos_boot_mem
+        boot_mem = psos_boot_mem.BootMem()
+        
     # globally accessible default parameters
     defaults = {}
     if "defaults" in parms:
@@ -54,6 +80,10 @@ async def main(parms,config):
     defaults["config"]   = config
     defaults["started"]  = False
     
+    # services loaded when first used, see psos_lazy.py
+    lazy = {}
+    defaults["lazy"] = lazy
+    
     u = os.uname()
     defaults["sysname"]  = u.sysname
     defaults["has_wifi"] = True
@@ -73,6 +103,13 @@ async def main(parms,config):
             svc = svc.format(**defaults)
         svc = psos_util.load_parms(config,svc)
     
+    # time each service between yields if svc_prof is running
+    prof = None
+    for svc_parms in svc:
+        if svc_parms["module"] == "svc_prof":
+            import psos_prof
+            prof = psos_prof
+    
     lcd_name = None
     lcd_svc  = None
     if "lcd" in defaults:
@@ -83,15 +120,28 @@ async def main(parms,config):
 
         # create module specific parms object
         psos_parms = PsosParms(svc_parms,defaults,config)
+        if compile_parms:
+            psos_parms.compile()
         
         # create a new instance of a service
         # and store as a service under specified name
         name = svc_parms["name"]
         module_name = svc_parms["module"]
         
+        if svc_parms.get("lazy",False):
+            import psos_lazy
+            print("... ",name,"(lazy)")
+            lazy[name] = psos_lazy.LazyService(svc_parms,defaults,config)
+            continue
+        
         print("... ",name)
         module = __import__(module_name)
+        if boot_mem != None:
+            boot_mem.mark(name,module_name,psos_boot_mem.IMPORT)
+            
         services[name] =  module.ModuleService(psos_parms)
+        if boot_mem != None:
+            boot_mem.mark(name,module_name,psos_boot_mem.INIT)
         
         if lcd_name != None and name == lcd_name:
             gc.collect()
@@ -105,23 +155,46 @@ async def main(parms,config):
     for svc_parms in parms["services"]:
         gc.collect()
         name = svc_parms["name"]
+        
+        # wait for the first message or get_svc(), a service
+        # already loaded by get_svc() was started by load()
+        if name in lazy:
+            uasyncio.create_task(lazy[name].run())
+            continue
+            
         svc  = services[name]
         # print("... " + name)
-        uasyncio.create_task(svc.run())
+        
+        coro = svc.run()
+        if prof != None and prof.profiler != None:
+            coro = prof.profiler.wrap(name,coro)
+        uasyncio.create_task(coro)
+        
+        # this loop doesn't yield, so no service has run
+        # yet and none is charged for another's allocations
+        if boot_mem != None:
+            boot_mem.mark(name,svc_parms["module"],psos_boot_mem.RUN)
 
         
+    if boot_mem != None:
+        boot_mem.done()
+        
     # pmap = True
     defaults["started"] = True
+    defaults_changed()
     
     if lcd_svc != None:
         lcd_svc.display_lcd_msg("Running...")
+        
+    if boot_mem != None:
+        uasyncio.create_task(report_boot_mem(boot_mem,services,defaults))
     
     while True:
         # nothing to do here, but can't return?
                     
         # allow co-routines to execute
         # print("main: free space "+str(gc.mem_free()))
-        gc.collect()
+        psos_gc.maybe_collect()
         await uasyncio.sleep_ms(5000)
         
         
@@ -0,0 +1,118 @@
+'''
+    Message metrics.
+
+    Counts messages per topic and per subscription, and keeps a
+    histogram of the time from a message arriving (or being published
+    locally) to it being taken off a queue by a service using
+    SvcMsg.load_subscr, or by svc_mqtt_proxy_server for a client.
+    Services that index the queued record directly (msg[1], msg[2])
+    are counted per topic and subscription but not in the histogram.
+
+    Metrics are off unless a service calls enable(). When off,
+    the module variable "metrics" is None and the only cost is
+    checking for None.
+
+    Memory use is fixed:
+      - the first max_topics topics seen are counted individually,
+        any other topic is counted under "*"
+      - counts per subscription are kept in the Subscription
+        (puts, drops and the queue high water mark)
+      - latency is counted in LAT_BUCKETS+1 buckets. Bucket 0 is
+        under 1ms, bucket n is 2**(n-1) to 2**n - 1 ms and the
+        last bucket is everything longer.
+
+    snapshot() returns a compact dictionary:
+      {"up":  seconds since enabled,
+       "t":   [[topic, in, out, dropped, duplicates], ...],
+       "s":   [[filter, in, dropped, high water, queued], ...],
+       "lat": [bucket counts]}
+'''
+
+import time
+import uasyncio
+
+LAT_BUCKETS = 10
+
+metrics = None
+
+# turn metrics on, returns the Metrics object
+def enable(max_topics=16):
+    global metrics
+    if metrics == None:
+        metrics = Metrics(max_topics)
+    return metrics
+
+class Metrics:
+
+    def __init__(self,max_topics=16):
+        self.max_topics = max_topics
+        self._idx = {}
+
+        # the last slot counts all other topics
+        n = max_topics + 1
+        self._in   = [0] * n
+        self._out  = [0] * n
+        self._drop = [0] * n
+        self._dup  = [0] * n
+
+        self.lat = [0] * (LAT_BUCKETS + 1)
+        self._start = time.ticks_ms()
+
+    def _slot(self,topic):
+        i = self._idx.get(topic)
+        if i == None:
+            i = len(self._idx)
+            if i >= self.max_topics:
+                return self.max_topics
+            self._idx[topic] = i
+        return i
+
+    def msg_in(self,topic):
+        self._in[self._slot(topic)] += 1
+
+    def msg_out(self,topic):
+        self._out[self._slot(topic)] += 1
+
+    def dropped(self,topic):
+        self._drop[self._slot(topic)] += 1
+
+    def dup(self,topic):
+        self._dup[self._slot(topic)] += 1
+
+    # a service took msg (a PsosMsg) off its queue
+    def dequeued(self,msg):
+        ms = time.ticks_diff(time.ticks_ms(),msg.ticks)
+        b = 0
+        while ms > 0 and b < LAT_BUCKETS:
+            ms >>= 1
+            b += 1
+        self.lat[b] += 1
+
+    # subs is a list of Subscriptions to report
+    def snapshot(self,subs=()):
+        topics = []
+        for t,i in self._idx.items():
+            topics.append([t,self._in[i],self._out[i],self._drop[i],self._dup[i]])
+
+        i = self.max_topics
+        if self._in[i] or self._out[i] or self._drop[i] or self._dup[i]:
+            topics.append(["*",self._in[i],self._out[i],self._drop[i],self._dup[i]])
+
+        s = []
+        for sub in subs:
+            s.append([sub._filter_str,sub.puts,sub.drops,sub.hwm,sub._queue.qsize()])
+
+        return {"up"  : time.ticks_diff(time.ticks_ms(),self._start)//1000,
+                "t"   : topics,
+                "s"   : s,
+                "lat" : list(self.lat) }
+
+# publish a snapshot every secs seconds.
+# mqtt is the service publishing the metrics,
+# subs its list of Subscriptions
+async def report(mqtt,topic,secs,subs):
+    while True:
+        await uasyncio.sleep(secs)
+        m = metrics.snapshot(subs)
+        m["dev"] = mqtt.dev
+        await mqtt.publish(topic,m)
@@ -0,0 +1,102 @@
+'''
+    Message record passed from a subscription to a service queue.
+
+    One PsosMsg is created for each message received and
+    every matching subscription puts a reference to the same
+    object on its queue, so the topic and payload strings are
+    not copied for each subscriber.
+
+    The record is shared and must be treated as read only.
+    A service that needs to change the payload must work on
+    its own copy (e.g. SvcMsg.load_subscr parses JSON payloads
+    into a new object).
+
+    Fields:
+      topic   - topic string
+      payload - payload string
+      ticks   - time.ticks_ms() when the message arrived
+      subs    - Subscriptions the message matched, in match order
+
+    msg.json() returns the payload parsed as JSON. It is parsed by
+    the first subscriber that asks for it and the same object is
+    returned to later subscribers, so it must not be changed either.
+    SvcMsg.get_payload_rw() gives a service its own copy to change.
+
+    Messages published locally (see svc_mqtt.local_publish) may
+    carry a dict, list or tuple payload. The object is handed
+    to subscribers as is by msg.json() and is only converted to
+    a JSON string if msg.payload is used, e.g. to log it.
+    The publisher must not change the object after publishing it.
+
+    For compatibility with services that index the message,
+    msg[0], msg[1] and msg[2] return the filter, topic and payload.
+    msg[0] is the filter of the first matching subscription.
+    A queue used by more than one subscription should use
+    msg.filter(queue) to get the filter of its own subscription.
+'''
+
+import time
+import ujson
+from psos_util import to_str
+
+class PsosMsg:
+    def __init__(self,topic,payload,subs):
+        self.topic   = topic
+        self.ticks   = time.ticks_ms()
+        self.subs    = subs
+        
+        if isinstance(payload,(dict,list,tuple)):
+            self._str    = None
+            self._json   = payload
+            self._parsed = True
+        else:
+            # True, None and numbers as JSON, as to_bytes() sends them
+            if type(payload) == str or type(payload) == bytes:
+                self._str = to_str(payload)
+            else:
+                self._str = ujson.dumps(payload)
+            self._json   = None
+            self._parsed = False
+
+    # payload as a string, serializing an object payload
+    # the first time it is needed
+    @property
+    def payload(self):
+        if self._str is None:
+            self._str = ujson.dumps(self._json)
+        return self._str
+
+    # return the filter of the first matching subscription
+    # that writes to queue
+    def filter(self,queue=None):
+        for sub in self.subs:
+            if queue is None or sub._queue is queue:
+                return sub._filter_str
+        return ""
+
+    # return the payload parsed as JSON if it looks like JSON,
+    # i.e. starts with '{' or '[', otherwise the payload itself.
+    # The result is shared, treat it as read only.
+    def json(self):
+        if not self._parsed:
+            p = self._str
+            if p.startswith('{') or p.startswith('['):
+                p = ujson.loads(p)
+            self._json   = p
+            self._parsed = True
+        return self._json
+
+    def __getitem__(self,i):
+        if i == 1:
+            return self.topic
+        if i == 2:
+            return self.payload
+        if i == 0:
+            return self.filter()
+        raise IndexError(i)
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return "PsosMsg({}, {}, {})".format(self.filter(),self.topic,self.payload)
@@ -12,6 +12,7 @@
     
     A dictionary of services is also in the default dictionary.
     The values in that dictionary can be accessed via the get_svc(name) method.
+    A lazy service (see psos_lazy.py) is loaded by its first get_svc(name).
     
     Calls to get_parm specify a name and a default value.
     If name is not in the instance specific dictionary,
@@ -19,14 +20,33 @@
     If name is not in the default dictionary
     get_parm will return the default value.
 
+    A parm containing {...} is formatted with the defaults the first
+    time it is read and the result is cached, so services can call
+    get_parm for a templated topic on every message. The cache is
+    cleared by set_parm, and for all instances by set_default or
+    defaults_changed() when the defaults are changed.
+    compile() resolves all of the templated parms at once,
+    psos_main calls it for each service when config.json
+    has "compile_parms": true.
+
 """
 
+# incremented when the defaults change,
+# instances with an older value clear their cache
+_gen = 0
+
+def defaults_changed():
+    global _gen
+    _gen += 1
+
 class PsosParms:
     
     def __init__(self, parms, default_parms, config):
         self._parms = parms
         self._defaults = default_parms
         self.config = config
+        self._cache = {}
+        self._gen   = _gen
         
         try:
             self.no_fmt = default_parms["no_format"]
@@ -39,8 +59,15 @@ class PsosParms:
             # if '{' in result
             # and key not in the list of keys to NOT format
             #  - format the result using defaults
+            #    unless already formatted
             if type(r) == str and '{'in r and not key in self.no_fmt:
-                return r.format(**self._defaults)
+                if self._gen != _gen:
+                    self._cache = {}
+                    self._gen   = _gen
+                elif key in self._cache:
+                    return self._cache[key]
+                r = r.format(**self._defaults)
+                self._cache[key] = r
             return r
         except KeyError:
             pass
@@ -59,6 +86,17 @@ class PsosParms:
     
     def set_parm(self,key,value):
         self._parms[key] = value
+        self._cache = {}
+        
+    # change a default for all services
+    def set_default(self,key,value):
+        self._defaults[key] = value
+        defaults_changed()
+        
+    # format all of the templated parms now
+    def compile(self):
+        for key in self._parms:
+            self.get_parm(key)
     
     def get_svc(self,svc_name):
         try:
@@ -66,6 +104,11 @@ class PsosParms:
         except KeyError:
             pass
         
+        # not loaded yet?
+        lazy = self._defaults.get("lazy",{}).get(svc_name)
+        if lazy != None:
+            return lazy.load()
+        
         return None
     
     def get_config(self):
@@ -78,7 +121,7 @@ class PsosParms:
     # A 2 value tuple with key and default value
     # where default value returned if key not found.
     def __getitem__(self, key):
-        if type(key) == tuple and len(key_ == 2):
+        if type(key) == tuple and len(key) == 2:
             # assume I have a default value
             return self.get_parm(key[0],key[1])
         
@@ -0,0 +1,118 @@
+'''
+    Service task profiler.
+
+    psos_main wraps each service's run() coroutine with
+    Profiler.wrap() when svc_prof is configured. The wrapper
+    resumes the service coroutine itself, so the time from
+    resuming the service until it yields back to the scheduler
+    is the time it kept every other service waiting.
+
+    For each service it counts:
+      us    - total time running in the current interval
+      steps - number of times it was resumed
+      max   - longest single run between yields
+
+    A run longer than long_us is recorded as a long synchronous
+    section. The service is always known. The method is the
+    innermost service coroutine that was waiting when the service
+    yielded, where the port supports cr_await (CPython);
+    on MicroPython it is reported as "run".
+
+    Memory use is one small list per service plus the last
+    max_long long sections.
+'''
+
+import time
+
+try:
+    from types import coroutine
+except ImportError:
+    # MicroPython uasyncio accepts plain generators
+    def coroutine(f):
+        return f
+
+profiler = None
+
+class Profiler:
+
+    def __init__(self,long_us=50000,max_long=8):
+        self.long_us  = long_us
+        self.max_long = max_long
+        self.svcs = {}    # name -> [us, steps, max]
+        self.long = []    # [[name, method, us], ...]
+
+    def reset(self):
+        for s in self.svcs.values():
+            s[0] = 0
+            s[1] = 0
+            s[2] = 0
+        self.long = []
+
+    # return a coroutine that runs coro and times each step
+    def wrap(self,name,coro):
+        stats = [0,0,0]
+        self.svcs[name] = stats
+        return self._run(name,stats,coro)
+
+    @coroutine
+    def _run(self,name,stats,coro):
+        ticks_us   = time.ticks_us
+        ticks_diff = time.ticks_diff
+        val = None
+        err = None
+
+        while True:
+            t = ticks_us()
+            try:
+                if err != None:
+                    y = coro.throw(err)
+                else:
+                    y = coro.send(val)
+            except StopIteration as e:
+                self._step(name,stats,coro,ticks_diff(ticks_us(),t))
+                return e.args[0] if e.args else None
+            self._step(name,stats,coro,ticks_diff(ticks_us(),t))
+
+            try:
+                val = yield y
+                err = None
+            except BaseException as e:
+                val = None
+                err = e
+
+    def _step(self,name,stats,coro,us):
+        stats[0] += us
+        stats[1] += 1
+        if us > stats[2]:
+            stats[2] = us
+
+        if us >= self.long_us:
+            if len(self.long) >= self.max_long:
+                self.long.pop(0)
+            method = self._method(coro)
+            self.long.append([name,method,us])
+            print("prof: {}.{} ran {} ms without yielding".format(name,method,us//1000))
+
+    # innermost service coroutine being awaited, not counting
+    # asyncio itself or the host uasyncio shim (host/upy_compat.py)
+    def _method(self,coro):
+        c = coro
+        while True:
+            inner = getattr(c,"cr_await",None)
+            if inner == None or not hasattr(inner,"cr_await"):
+                break
+            fn = inner.cr_code.co_filename
+            if "asyncio" in fn or "upy_compat" in fn:
+                break
+            c = inner
+        return getattr(c,"__name__","run")
+
+    # top n services by time used since the last reset.
+    # returns [[name, pct of elapsed, steps, max us], ...]
+    def top(self,n,elapsed_us):
+        svcs = sorted(self.svcs.items(),key=lambda s: s[1][0],reverse=True)
+        res = []
+        for name,s in svcs[:n]:
+            pct = round(s[0]*100/elapsed_us,1) if elapsed_us > 0 else 0
+            res.append([name,pct,s[1],s[2]])
+        return res
@@ -0,0 +1,131 @@
+'''
+    Binary frames for the MQTT proxy protocol, used by
+    svc_mqtt_proxy_server and svc_mqtt_proxy_client when the
+    "bin" option is agreed at "con" (see svc_mqtt_proxy_server.py).
+
+    Each frame is a 7 byte header followed by the payload:
+        length   2 bytes, bytes after the length field
+        op       1 byte, the opcode in the low 4 bits.
+                 A PUB has retain in bit 4 and qos in bits 5-6
+        rid      2 bytes, request id, 0 if no ack is wanted
+        tid      2 bytes, topic id, 0 if none
+    all big endian.
+
+    Topics are sent as small integers. The first time a topic
+    is sent on a connection an ALIAS frame gives its id:
+        ALIAS  tid=<new id>, payload = topic
+    Each direction has its own table of up to alias_max topics.
+    Once the table is full a topic is sent inline with tid
+    NO_ALIAS and the payload starting with the 2 byte topic
+    length and the topic.
+
+    Client to server:
+        PUB    rid, tid = topic, payload = message payload
+        SUB    rid, tid = topic filter, payload = qos (1 byte)
+        RCV    rid, payload = max messages (2 bytes), version 1 only
+        PING   rid
+        CREDIT payload = credits (2 bytes), never acked
+    Server to client:
+        MSG    tid = topic, payload = message payload
+        ACK    rid, payload = status (1 byte, ACK_OK or ACK_ERR)
+               followed by the reason for an error
+    A RCV is answered by up to max MSG frames and then its ACK.
+
+    A frame holds at most MAX_PAYLOAD bytes of payload, with an
+    inline topic. FrameWriter.write() raises ValueError, without
+    writing anything, for a longer one. The server sends an ACK
+    with rid 0 and ACK_ERR in place of a MSG too long for a frame.
+'''
+
+import struct
+from psos_util import to_bytes
+
+OP_ALIAS = 0
+OP_PUB   = 1
+OP_SUB   = 2
+OP_ACK   = 3
+OP_MSG   = 4
+OP_RCV   = 5
+OP_PING  = 6
+OP_CREDIT = 7
+
+ACK_OK   = 0
+ACK_ERR  = 1
+
+NO_ALIAS = 0
+
+_HDR = ">HBHH"
+HDR_LEN = 7
+
+# the length field counts the 5 header bytes after it
+MAX_PAYLOAD = 0xFFFF - 5
+
+# writes frames to a uasyncio stream, the caller drains it
+class FrameWriter:
+
+    def __init__(self,swriter,alias_max=64):
+        self._w = swriter
+        self._alias = {}  # topic to id
+        self._alias_max = alias_max
+
+    # Raises ValueError if the payload and any inline
+    # topic are more than MAX_PAYLOAD bytes
+    def write(self,op,rid=0,topic=None,payload=b""):
+        tid = NO_ALIAS
+        alias = None
+        if topic != None:
+            tid = self._alias.get(topic,NO_ALIAS)
+            if tid == NO_ALIAS:
+                t = to_bytes(topic)
+                if len(self._alias) < self._alias_max:
+                    tid = len(self._alias) + 1
+                    alias = t
+                else:
+                    payload = struct.pack(">H",len(t)) + t + payload
+
+        if len(payload) > MAX_PAYLOAD or (alias != None and len(alias) > MAX_PAYLOAD):
+            raise ValueError("frame too long")
+
+        if alias != None:
+            self._alias[topic] = tid
+            self._w.write(struct.pack(_HDR,len(alias)+5,OP_ALIAS,0,tid))
+            self._w.write(alias)
+
+        self._w.write(struct.pack(_HDR,len(payload)+5,op,rid,tid))
+        if len(payload) > 0:
+            self._w.write(payload)
+
+    def ack(self,rid,rsn=None):
+        if rsn == None:
+            self.write(OP_ACK,rid,None,bytes((ACK_OK,)))
+        else:
+            self.write(OP_ACK,rid,None,bytes((ACK_ERR,)) + to_bytes(rsn))
+
+# reads frames from a uasyncio stream
+class FrameReader:
+
+    def __init__(self,sreader):
+        self._r = sreader
+        self._alias = {}  # id to topic
+
+    # returns op (with its flags), rid, topic and payload.
+    # ALIAS frames are handled here and not returned.
+    async def read(self):
+        while True:
+            n,op,rid,tid = struct.unpack(_HDR,await self._r.readexactly(HDR_LEN))
+            payload = b""
+            if n > 5:
+                payload = await self._r.readexactly(n-5)
+
+            if op == OP_ALIAS:
+                self._alias[tid] = payload.decode()
+                continue
+
+            topic = None
+            if tid != NO_ALIAS:
+                topic = self._alias[tid]
+            elif op & 0x0F in (OP_PUB,OP_SUB,OP_MSG):
+                i = 2 + (payload[0] << 8 | payload[1])
+                topic = payload[2:i].decode()
+                payload = payload[i:]
+            return op,rid,topic,payload
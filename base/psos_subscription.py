@@ -5,21 +5,48 @@
     and a queue to write messages to when received
     from the mqtt broker.
     
-    Messages placed in queue are JSON formatted strings
-    containing the filter, topic, payload (and perhaps
-    additional info to be determined)
+    Messages placed in queue are PsosMsg records
+    containing the filter, topic, payload and arrival time,
+    see psos_msg.py. The same record is shared by all
+    subscriptions matching the message.
+    
+    A subscriber may also specify a maximum queue depth
+    and what to do when a message arrives while the queue
+    is at that depth:
+      Q_DROP_OLDEST - remove the oldest queued message (default)
+      Q_DROP_NEWEST - throw away the new message
+      Q_CONFLATE    - replace a queued message for the same topic
+                      with the new message, otherwise drop oldest
+    Dropped messages are counted in self.drops.
+    
+    If metrics are on (see psos_metrics.py) messages put
+    are counted in self.puts and the deepest the queue has
+    been in self.hwm.
+    
+    A max_q of 0 means the queue is not limited.
 '''
 
 import queue
 from psos_util import to_str, to_bytes
+from psos_msg import PsosMsg
 
+Q_DROP_OLDEST = "oldest"
+Q_DROP_NEWEST = "newest"
+Q_CONFLATE    = "conflate"
 
 class Subscription:
-    def __init__(self, topic_filter, queue,qos=0):
+    def __init__(self, topic_filter, queue,qos=0,max_q=0,policy=Q_DROP_OLDEST):
         self._filter = to_bytes(topic_filter)
+        self._filter_str = to_str(topic_filter)
         self._filter_split = to_str(topic_filter).split('/')
         self._queue = queue
         self._qos   = qos
+        self._max_q = max_q
+        self._policy = policy
+        self.drops  = 0
+        self.puts   = 0
+        self.hwm    = 0
+        self._metrics = None
         
     def subscribe(self,client):
         print("subscribe "+to_str(self._filter))
@@ -30,7 +57,44 @@ class Subscription:
     # topic_split = topic.split('/')
     def put_match(self,topic_split,topic,payload):
         if self.filter_match(topic_split):
-            self._queue.put_nowait([to_str(self._filter),to_str(topic),to_str(payload)])
+            self.put(PsosMsg(to_str(topic),to_str(payload),(self,)))
+            
+    # write a message record to this subscriptions queue
+    # without checking the filter. Used by TopicTree which
+    # has already matched the topic against the filter.
+    def put(self,msg):
+        item = msg
+        q = self._queue
+        if self._metrics != None:
+            self.puts += 1
+        
+        if self._max_q > 0:
+            t = msg.topic
+            
+            # replace any queued message for the same topic
+            if self._policy == Q_CONFLATE:
+                if q.replace(lambda m: m.topic == t, item):
+                    self._dropped(msg)
+                    return
+                
+            # the drop is for the topic of the message dropped
+            if q.qsize() >= self._max_q:
+                if self._policy == Q_DROP_NEWEST:
+                    self._dropped(msg)
+                    return
+                self._dropped(q.get_nowait())
+                
+        q.put_nowait(item)
+        
+        if self._metrics != None:
+            n = q.qsize()
+            if n > self.hwm:
+                self.hwm = n
+                
+    def _dropped(self,msg):
+        self.drops += 1
+        if self._metrics != None:
+            self._metrics.dropped(msg.topic)
     
     # return True if the topic and queue
     # match this subscription
@@ -13,6 +13,7 @@ import time
 
 import psos_util
 import gc
+import psos_gc
 
 class PsosService:
     
@@ -71,7 +72,7 @@ class PsosService:
         # self.display_lcd_payload(["clear",{"msg":msg}])
         self.lcd_pl[1]["msg"] = msg
         self.display_lcd_payload(self.lcd_pl)
-        gc.collect()
+        psos_gc.maybe_collect()
         
     # methods that define type of device and capabilities
     def is_esp32(self):
@@ -0,0 +1,125 @@
+'''
+    Topic Tree class indexes subscriptions by topic level.
+
+    Each level of a subscription filter is a node in the tree.
+    A node is a 2 element list: [children, subscriptions]
+    where children is a dictionary of level name to node
+    and subscriptions is the list of Subscription objects
+    whose filter ends at that node.
+
+    Wildcards "+" and "#" are stored as ordinary children
+    named "+" and "#". Matching a topic then only has to
+    follow the topic level, "+" and "#" children at each level
+    so the cost depends on the depth of the topic rather
+    than the number of subscriptions.
+
+    Matching follows the same rules as Subscription.filter_match,
+    including "a/#" matching the topic "a".
+'''
+
+from psos_msg import PsosMsg
+
+class TopicTree:
+    def __init__(self):
+        self._root = [{},[]]
+        self._cnt  = 0
+
+    # add a subscription to the tree
+    def add(self,sub):
+        node = self._root
+        for lvl in sub._filter_split:
+            children = node[0]
+            if lvl in children:
+                node = children[lvl]
+            else:
+                n = [{},[]]
+                children[lvl] = n
+                node = n
+
+        node[1].append(sub)
+        self._cnt += 1
+
+    # remove a subscription from the tree,
+    # pruning any nodes left without subscriptions or children
+    def remove(self,sub):
+        path = []
+        node = self._root
+        for lvl in sub._filter_split:
+            children = node[0]
+            if not lvl in children:
+                return False
+            path.append((node,lvl))
+            node = children[lvl]
+
+        if not sub in node[1]:
+            return False
+
+        node[1].remove(sub)
+        self._cnt -= 1
+
+        # prune empty nodes from the bottom up
+        for i in range(len(path)-1,-1,-1):
+            if len(node[0]) > 0 or len(node[1]) > 0:
+                break
+            parent,lvl = path[i]
+            del parent[0][lvl]
+            node = parent
+
+        return True
+
+    # remove all of the subscriptions for a given queue
+    # and return them as a list
+    def remove_queue(self,queue):
+        removed = []
+        self._find_queue(self._root,queue,removed)
+        for sub in removed:
+            self.remove(sub)
+        return removed
+
+    def _find_queue(self,node,queue,removed):
+        for sub in node[1]:
+            if sub._queue == queue:
+                removed.append(sub)
+        for child in node[0].values():
+            self._find_queue(child,queue,removed)
+
+    def __len__(self):
+        return self._cnt
+
+    # write a message to the queue of every subscription
+    # that matches the topic. A single PsosMsg is created
+    # and shared by all the matching subscriptions.
+    # Returns the message, or None if nothing matched.
+    # topic_split = topic.split('/')
+    def put_match(self,topic_split,topic,payload):
+        subs = self.match(topic_split)
+        if len(subs) == 0:
+            return None
+
+        msg = PsosMsg(topic,payload,subs)
+        for sub in subs:
+            sub.put(msg)
+        return msg
+
+    # return a list of subscriptions that match the topic
+    def match(self,topic_split):
+        result = []
+        self._match(self._root,topic_split,0,result)
+        return result
+
+    def _match(self,node,topic_split,i,result):
+        children = node[0]
+
+        if "#" in children:
+            result.extend(children["#"][1])
+
+        if i >= len(topic_split):
+            result.extend(node[1])
+            return
+
+        lvl = topic_split[i]
+        if lvl in children:
+            self._match(children[lvl],topic_split,i+1,result)
+
+        if "+" in children:
+            self._match(children["+"],topic_split,i+1,result)
@@ -15,7 +15,7 @@ import psos_util
 from lcd_3inch5 import LCD
 import color_brg_556 as clr
 
-from psos_subscription import Subscription
+from psos_subscription import Subscription, Q_CONFLATE
 
 import gc
 
@@ -66,8 +66,14 @@ class ModuleService(PsosService):
         # list of topics to subscribe to
         subs = self.get_parm("subs")
         
-        for sub in subs.values():
-            await mqtt.subscribe(sub,q)
+        # conflate device data so only the newest
+        # state for each device is displayed
+        max_q = self.get_parm("max_q",32)
+        for key,sub in subs.items():
+            if key in ("temp","soil","mem"):
+                await mqtt.subscribe(sub,q,0,max_q,Q_CONFLATE)
+            else:
+                await mqtt.subscribe(sub,q)
             
         # topics I recognize/require
         self.topic_calls = {subs["tch"] :self.handle_touch,
@@ -82,8 +88,9 @@ class ModuleService(PsosService):
         while True:
             data = await q.get()
             # print("received msg:",data)
-            msg.load_subscr(data)
-            filter = msg._filter
+            msg.load_subscr(data,q)
+            # q is shared by several subscriptions
+            filter = data.filter(q)
             
             if filter in self.topic_calls:
                 await (self.topic_calls[filter](msg))
@@ -161,7 +168,8 @@ class ModuleService(PsosService):
     async def save_msg(self,data,data_type):
         data_idx = ["temp","soil","mem"].index(data_type)
         # add time to the payload (dictionary)
-        d = data.get_payload()
+        # the payload is shared with other subscribers, get own copy
+        d = data.get_payload_rw()
         t = time.localtime(time.mktime(time.localtime())+self.tz*3600)
         d["time"] = "{3}:{4:02d}:{5:02d}".format(*t)
         
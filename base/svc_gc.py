@@ -0,0 +1,98 @@
+"""
+    Garbage Collection Service Class
+
+    Selects the garbage collection policy used by
+    psos_gc.maybe_collect() and reports collection statistics.
+
+    Parameters:
+      policy      - "always", "threshold" (default) or "idle",
+                    see psos_gc.py. Without this service the
+                    policy is "always".
+      min_free    - collect when free memory is below this (bytes)
+      check_ms    - minimum time between free memory checks
+      alloc_kb    - gc.threshold() setting, 0 leaves it unchanged
+      idle_kb     - "idle" policy: collect when idle if at least
+                    this much was allocated since the last collection
+      idle_ms     - how often to check if the event loop is idle
+      idle_lag_ms - the loop is idle if the check wakes up no
+                    later than this
+      subscr_upd  - topic requesting the statistics
+      pub_upd     - topic to publish the statistics to
+      report_s    - also publish the statistics every report_s seconds,
+                    0 (default) only publishes when requested
+
+    Statistics published:
+      {"policy":"idle", "collects":12, "auto":1, "hints":3120,
+       "per_min":2.4, "pause_avg":4100, "pause_max":6300,
+       "mem_free":61232, "dev":"e02"}
+    pause times are in microseconds.
+
+"""
+
+from psos_svc import PsosService
+import uasyncio
+import queue
+import time
+
+import psos_gc
+
+# All initialization classes are named ModuleService
+class ModuleService(PsosService):
+
+    def __init__(self, parms):
+        super().__init__(parms)
+
+        self.sched = psos_gc.get_scheduler()
+        self.sched.configure(self.get_parm("policy",psos_gc.POLICY_THRESHOLD),
+                             self.get_parm("min_free",16*1024),
+                             self.get_parm("check_ms",1000),
+                             self.get_parm("alloc_kb",0),
+                             self.get_parm("idle_kb",8))
+
+        self._trigger_q = queue.Queue()
+
+    async def run(self):
+
+        mqtt = self.get_mqtt()
+        sub  = self.get_parm("subscr_upd",None)
+        if sub != None:
+            await mqtt.subscribe(sub,self._trigger_q)
+
+        idle_ms   = self.get_parm("idle_ms",250)
+        lag_ms    = self.get_parm("idle_lag_ms",5)
+        report_ms = self.get_parm("report_s",0)*1000
+
+        # function aliases
+        ticks_ms   = time.ticks_ms
+        ticks_diff = time.ticks_diff
+
+        last_report = ticks_ms()
+
+        while True:
+            t = ticks_ms()
+            await uasyncio.sleep_ms(idle_ms)
+            lag = ticks_diff(ticks_ms(),t) - idle_ms
+
+            self.sched.idle_collect(lag <= lag_ms)
+
+            send = False
+            while not self._trigger_q.empty():
+                self._trigger_q.get_nowait()
+                send = True
+
+            if report_ms > 0 and ticks_diff(ticks_ms(),last_report) >= report_ms:
+                send = True
+
+            if send:
+                last_report = ticks_ms()
+                await self.send_data(mqtt)
+
+    # send collection statistics via MQTT
+    async def send_data(self,mqtt):
+        pub = self.get_parm("pub_upd",None)
+        if pub == None:
+            return
+
+        msg = self.sched.stats()
+        msg["dev"] = self.dev
+        await mqtt.publish(pub,msg)
@@ -6,6 +6,11 @@
     Add, change and delete files by comparing the local
     manifest.json file with the current github manifest.json file.
     
+    Directories in the github manifest but not in the local manifest,
+    such as the mpy directory of precompiled modules added by
+    build_manifest.py, are created and all of their files saved.
+    .mpy files are saved as binary files.
+    
 """
 
 from psos_svc import PsosService
@@ -96,11 +101,33 @@ class ModuleService(PsosService):
             # ignore if local object no longer in git
             name = local_obj["name"]
             if name in git:
-                git_obj = git[name]
+                git_obj = git.pop(name)
                 if "files" in local_obj:
                     await self.sync_dir(local_obj,git_obj)
                 else:
                     await self.sync_file(local_obj,git_obj,dir="")
+                    
+        # objects new in git
+        for git_obj in git.values():
+            if "files" in git_obj:
+                await self.add_dir(git_obj)
+            else:
+                await self.save_git_file(git_obj["name"])
+                
+    # add a directory and all of its files
+    async def add_dir(self,git):
+        directory = git["name"]
+        self.display_lcd_msg("add dir\n"+directory)
+        await self.log("add directory "+directory)
+        
+        if not self.test_mode:
+            try:
+                os.mkdir(directory)
+            except OSError:
+                pass # already exists
+            
+        git_mani = self.cnv_list_to_dict(git["files"],"name")
+        await self.add_new_files(None,git_mani,directory)
 
     async def sync_dir(self,local,git):
         if local["sha"] == git["sha"]:
@@ -156,7 +183,8 @@ class ModuleService(PsosService):
         await self.save_git_file(fn)
 
     async def save_git_file(self,fn):
-        f = await self.get_github_file(fn)
+        binary = fn.endswith(".mpy")
+        f = await self.get_github_file(fn,binary=binary)
         self.display_lcd_msg("save file\n"+fn)
         await self.log("save file "+fn)
         
@@ -164,10 +192,11 @@ class ModuleService(PsosService):
         
         # comment out below for testing
         if not self.test_mode:
-            self.write_file(fn,f) 
+            self.write_file(fn,f,binary) 
           
     # this is the only read of github files
-    async def get_github_file(self,fn,windows=True):
+    # binary files are returned as bytes
+    async def get_github_file(self,fn,windows=True,binary=False):
         await uasyncio.sleep_ms(0)
         self.display_lcd_msg("read git file\n{}".format(fn))
         await self.log("read git file {}".format(fn))
@@ -183,6 +212,13 @@ class ModuleService(PsosService):
             r.close()
             self.reset(rsn="git uri not found: {}".format(uri))
         
+        if binary:
+            c = r.content
+            r.close()
+            gc.collect()
+            await uasyncio.sleep_ms(0)
+            return c
+        
         c = psos_util.to_str(r.content)
         r.close()
         
@@ -208,8 +244,8 @@ class ModuleService(PsosService):
             
         return r
     
-    def write_file(self,fn,o):
-        with open(fn, "w") as f:
+    def write_file(self,fn,o,binary=False):
+        with open(fn, "wb" if binary else "w") as f:
             f.write(o)
             f.close()
             
@@ -42,7 +42,8 @@ class ModuleService(PsosService):
         self._hg_msg = None
         
         if self._pub_hourglass != None :
-            self._hg_msg = SvcLcdMsg().dsp_hg().dumps()
+            # passed as is to a local svc_lcd, serialized if sent to the broker
+            self._hg_msg = SvcLcdMsg().dsp_hg().get_payload()
             
         self.trigger = self.get_parm("trigger",25)
         self.tr_z    = self.get_parm("tr_z",-90)
@@ -29,8 +29,10 @@ import svc_lcd_msg
 
 import queue
 import uasyncio
+from psos_subscription import Q_CONFLATE
 
 import gc
+import psos_gc
 
 # All services classes are named ModuleService
 class ModuleService(PsosService):
@@ -44,7 +46,10 @@ class ModuleService(PsosService):
         i2c_svc = parms.get_parm("i2c")
         i2c = self.get_svc(i2c_svc).get_i2c()
         
-        i2c_addr         = int(self.get_parm("i2c_addr", "0x27"))
+        # int() only takes the 0x prefix without a base on MicroPython
+        i2c_addr         = self.get_parm("i2c_addr", "0x27")
+        if type(i2c_addr) == str:
+            i2c_addr     = int(i2c_addr,0)
         self.lcd_row_cnt = int(self.get_parm("lcd_row_cnt", "2"))
         self.lcd_col_cnt = int(self.get_parm("lcd_col_cnt", "16"))
 
@@ -158,14 +163,19 @@ class ModuleService(PsosService):
         if mqtt == None:
             return
         
-        await mqtt.subscribe(self.get_parm("subscr_msg"),self._trigger_q)
+        # every message is queued unless parms set max_q, then only
+        # the newest message for a topic is kept (q_policy) if
+        # messages arrive faster than they are displayed
+        await mqtt.subscribe(self.get_parm("subscr_msg"),self._trigger_q,0,
+                             self.get_parm("max_q",0),
+                             self.get_parm("q_policy",Q_CONFLATE))
         
         while True:
             q = await self._trigger_q.get()
             
             # throw away any queued input while display is locked
             if self.lock_cnt <= 0:
-                self.lcd_msg.load_subscr(q)                
+                self.lcd_msg.load_subscr(q,self._trigger_q)                
                 self.process_msg(self.lcd_msg)
                     
     def process_msg(self, msg):
@@ -211,7 +221,7 @@ class ModuleService(PsosService):
             # log error in command type?
             pass
         
-        gc.collect()
+        psos_gc.maybe_collect()
         
     def set_cursor(self, xy):
         if (isinstance(xy,list) or isinstance(xy,tuple)) and len(xy) == 2:
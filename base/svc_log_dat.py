@@ -50,13 +50,14 @@ class ModuleService(PsosService):
     # write to disk a time stamp followed by topic and payload
     async def log_data(self,data):
         
+        # data is shared with other subscribers, don't change it
         out = {"topic":data[1]}
-        data[2] = data[2].replace('\n','↩')
+        payload = data[2].replace('\n','↩')
         
-        if data[2].startswith('{'):
-            out.update(ujson.loads(data[2]))
+        if payload.startswith('{'):
+            out.update(ujson.loads(payload))
             
-        out['payload'] = data[2]
+        out['payload'] = payload
             
         # get time adjusted to local timezone
         # format time as mm/dd/yyyy hh:mm:ss
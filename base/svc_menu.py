@@ -74,7 +74,7 @@ class ModuleService(PsosService):
         
         while True:
             data = await self.q.get()
-            msg.load_subscr(data)
+            msg.load_subscr(data,self.q)
             await self.execute(mqtt,msg)
         
     # execute a given command received via MQTT
@@ -11,8 +11,22 @@
        a. removes the "local/" prefix
        b. forwards the message to any services subscribing to the topic
        c. does not forward the message the global MQTT broker
+       d. passes a dict or list payload to the subscribers without
+          converting it to JSON and back (see psos_msg.py)
        
-    2. If there is no wifi service or the wifi service has not yet connected
+    2. If the "mode" parm is "async" the broker connection is read by
+       a uasyncio stream reader (see lib/umqtt_async.py) instead of
+       polling check_msg() every 100ms. Messages are then delivered
+       as soon as they arrive and keepalive pings are sent on a timer.
+       
+       In this mode QoS 1 publishes do not wait for the broker PUBACK.
+       Up to "qos1_window" (default 4) messages may be waiting for a
+       PUBACK and are resent after "qos1_retry_ms" (default 5000).
+       publish() returns a PubAck which can be awaited for delivery:
+           ack = await mqtt.publish(topic,payload,qos=1)
+           ok  = await ack.wait()
+       
+    3. If there is no wifi service or the wifi service has not yet connected
        or this service has not yet connected to the MQTT broker,
        it will forward published messages to any subscribed service.
        
@@ -20,6 +34,18 @@
        This can be useful for testing since it allows running the test without
        waiting for WiFi and the MQTT broker. This also allows PSOS to be run on
        microcontrollers without WiFi such as the original Raspberry Pi Pico.
+       
+    4. The same topic and payload received again within "dedup_ms"
+       (default 3000, 0 to disable) is dropped. The last "dedup_size"
+       (default 64) messages are remembered, so nodes receiving more than
+       that between a message and its duplicate should use a larger size.
+       See psos_dedup.py.
+       
+    5. If "metrics_s" is set, message counts per topic and subscription,
+       queue depths and delivery latency are published to "pub_metrics"
+       (default "{dev}/metrics") every metrics_s seconds.
+       "metrics_topics" (default 16) topics are counted individually.
+       See psos_metrics.py.
 
 """
 
@@ -33,15 +59,20 @@ from psos_util import to_str, to_bytes
 import sys
 import time
 import gc
+import psos_gc
 import utf8_char
 
 # not present on non-wifi pico
 try:
     from umqtt_simple import MQTTClient
+    from umqtt_async import MQTTAsyncClient
 except ImportError:
     pass
 
-from psos_subscription import Subscription
+from psos_subscription import Subscription, Q_DROP_OLDEST
+from psos_topic_tree import TopicTree
+from psos_dedup import DedupCache
+import psos_metrics
 
 # make root ca part of this module
 from micropython import const
@@ -90,41 +121,45 @@ class ModuleService(PsosService):
         
         self._client = None
         self._subscriptions = []       
+        self._sub_tree = TopicTree()
         self.wifi    = self.get_svc("wifi")
-        self._msg_buff = []
+        
+        # duplicate messages within "dedup_ms" are dropped
+        self._dedup = None
+        dedup_ms = self.get_parm("dedup_ms",3000)
+        if dedup_ms > 0:
+            self._dedup = DedupCache(dedup_ms,self.get_parm("dedup_size",64))
+            
+        self._async  = self.get_parm("mode","poll") == "async"
+        
+        # message metrics, off unless "metrics_s" is set
+        self._metrics = None
+        self._metrics_s = self.get_parm("metrics_s",0)
+        if self._metrics_s > 0:
+            self._metrics = psos_metrics.enable(self.get_parm("metrics_topics",16))
 
     def mqtt_callback(self,topic,msg):
         if self._in_buff(topic,msg):
+            if self._metrics != None:
+                self._metrics.dup(to_str(topic))
             return
         
         t = to_str(topic)
         m = to_str(msg)
+        if self._metrics != None:
+            self._metrics.msg_in(t)
         
         t_split = t.split('/')
         
-        for subscr in self._subscriptions:
-            subscr.put_match(t_split,t,m)
+        self._sub_tree.put_match(t_split,t,m)
             
     # check if we recently received the the same topic and buffer.
     # This deals with duplicate messages received due to the
     # RPi400 Mosquitto MQTT broker bridge with HiveMQ
     def _in_buff(self,topic,msg):
-        # remove any messages in buffer older than 3 seconds
-        t = time.ticks_ms()
-        while len(self._msg_buff) > 0:
-            if time.ticks_diff(t,self._msg_buff[0][0]) > 3000:
-                self._msg_buff.pop(0)
-            else:
-                break
-                
-        for i in range(len(self._msg_buff)):
-            b = self._msg_buff[i]
-            if b[1] == topic and b[2] == msg:
-                return True
-            
-        # msg not in buff, add it
-        self._msg_buff.append([t,topic,msg])
-        return False
+        if self._dedup == None:
+            return False
+        return self._dedup.is_dup(topic,msg)
           
     def exit_svc(self):
         if (self._client != None and
@@ -140,9 +175,25 @@ class ModuleService(PsosService):
         self.get_svc_lcd()
         if self.svc_lcd != None:
             self.svc_lcd.set_sym(utf8_char.SYM_EX_OUT)
+            
+        if self._metrics != None:
+            topic = self.get_parm("pub_metrics",self.dev+"/metrics")
+            uasyncio.create_task(psos_metrics.report(self,topic,self._metrics_s,
+                                                     self._subscriptions))
         
         while True:
             if (self._client != None and
+                self.wifi.wifi_connected() and
+                self._async):
+                
+                # only returns when the connection is lost
+                try:
+                    await self._client.wait_msgs()
+                except Exception as e:
+                    print("MQTT error: ",e)
+                self._client = None
+                
+            elif (self._client != None and
                 self.wifi.wifi_connected()):
                 
                 try:
@@ -155,7 +206,7 @@ class ModuleService(PsosService):
                         await uasyncio.sleep_ms(0)
                         
                     self._client.check_msg()
-                    gc.collect()
+                    psos_gc.maybe_collect()
                 except Exception as e:
                     print("MQTT error: ",e)
                     self._client = None
@@ -235,18 +286,26 @@ class ModuleService(PsosService):
         if cert != None:
             ssl_params = {"server_hostname":server, "cert":cert}
             
+        client_class = MQTTClient
+        if self._async:
+            client_class = MQTTAsyncClient
+            
         if username != None:
             
             if cert != None:
-                client = MQTTClient(cid, server,
+                client = client_class(cid, server,
                                           user=username, password=password, port=port,
                                           keepalive=30, ssl=True, ssl_params=ssl_params)
             else:
-                client = MQTTClient(cid, server,
+                client = client_class(cid, server,
                                           user=username, password=password, port=port,
                                           keepalive=30)
         else:
-            client = MQTTClient(cid, server, port=port, keepalive=30)
+            client = client_class(cid, server, port=port, keepalive=30)
+            
+        if self._async:
+            client.window   = self.get_parm("qos1_window",4)
+            client.retry_ms = self.get_parm("qos1_retry_ms",5000)
             
         client.set_callback(self.mqtt_callback)
         client.connect()
@@ -258,13 +317,17 @@ class ModuleService(PsosService):
     # Payloads received for the topic are placed on queue.
     # Tasks can therefore just go into a wait
     # until a payload to be written to a queue.
-    async def subscribe(self,topic_filter,queue,qos=0):
+    # max_q and policy limit the depth of the queue,
+    # see psos_subscription.py
+    async def subscribe(self,topic_filter,queue,qos=0,max_q=0,policy=Q_DROP_OLDEST):
         await self.log("subscr " + topic_filter)
         
-        sub = Subscription(topic_filter,queue,qos)
+        sub = Subscription(topic_filter,queue,qos,max_q,policy)
+        sub._metrics = self._metrics
         self._subscriptions.append(sub)
+        self._sub_tree.add(sub)
         if self._client != None:
-            sub.subscribe(self._client)
+            await self._subscribe(sub)
             
         # give other tasks a chance to run
         await uasyncio.sleep_ms(0)
@@ -274,30 +337,77 @@ class ModuleService(PsosService):
     async def resubscribe(self):
         for sub in self._subscriptions:
             await self.log("resubscr " + to_str(sub._filter))
+            await self._subscribe(sub)
+            
+    async def _subscribe(self,sub):
+        if self._async:
+            print("subscribe "+to_str(sub._filter))
+            await self._client.subscribe(sub._filter,sub._qos)
+        else:
             sub.subscribe(self._client)
     
     # publish messages
+    # In async mode returns a PubAck for QoS 1 messages sent to the broker
     async def publish(self,topic,payload,retain=False, qos=0):
+        ack = None
+        if self._metrics != None:
+            self._metrics.msg_out(topic[6:] if topic.startswith('local/') else topic)
+        
         # if local topic, only send to local services
         if topic.startswith('local/'):
             if self.get_parm("print_local",False):
                 print("pub local: ",topic[6:],payload)
-            self.mqtt_callback(to_bytes(topic[6:]),to_bytes(payload))
+            self.local_publish(topic[6:],payload)
         else:
-            if self._client != None:
+            if self._client != None and self._async:
+                ack = await self._client.publish(to_bytes(topic), to_bytes(payload),retain,qos)
+            elif self._client != None:
                 self._client.publish(to_bytes(topic), to_bytes(payload),retain,qos)
                 
             # go ahead and publish locally
             else:
-                self.mqtt_callback(to_bytes(topic),to_bytes(payload))
+                self.local_publish(topic,payload)
                 
         # give other tasks a chance to run
         await uasyncio.sleep_ms(0)
+        return ack
+    
+    # deliver a message straight to local subscribers.
+    # A dict or list payload is passed to subscribers as is,
+    # it is only serialized if a subscriber needs the string.
+    # Duplicate checking is skipped, it is only needed for
+    # messages coming back from the broker bridge.
+    def local_publish(self,topic,payload):
+        t = to_str(topic)
+        if self._metrics != None:
+            self._metrics.msg_in(t)
+        self._sub_tree.put_match(t.split('/'),t,payload)
 
-    # remove all of the subscriptions for a given queue
+    # remove all of the subscriptions for a given queue.
+    # A filter no longer subscribed by any queue is
+    # unsubscribed at the broker.
     async def unsubscribe(self,queue):
+        for s in self._sub_tree.remove_queue(queue):
+            self._subscriptions.remove(s)
+            if self._client != None and not self._subscribed(s._filter):
+                await self._unsubscribe(s._filter)
+                
+    def _subscribed(self,topic_filter):
         for s in self._subscriptions:
-            if s._queue == queue:
-                self._subscriptions.remove(s)
+            if s._filter == topic_filter:
+                return True
+        return False
+    
+    # a lost connection is found by run(), and the filter
+    # is not resubscribed when it reconnects
+    async def _unsubscribe(self,topic_filter):
+        print("unsubscribe "+to_str(topic_filter))
+        try:
+            if self._async:
+                await self._client.unsubscribe(topic_filter)
+            else:
+                self._client.unsubscribe(topic_filter)
+        except Exception as e:
+            print("MQTT error: ",e)
                 
   
\ No newline at end of file
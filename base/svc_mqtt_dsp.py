@@ -17,6 +17,7 @@ import color_brg_556 as clr
 from psos_subscription import Subscription
 
 import gc
+import psos_gc
 
 lcd_width = const(480)
 lcd_height = const(320)
@@ -81,7 +82,7 @@ class ModuleService(PsosService):
         
             await self.show_msg(data)
             
-            gc.collect()
+            psos_gc.maybe_collect()
                 
     # execute a command
     async def exec_cmd(self,cmd):
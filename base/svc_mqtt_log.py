@@ -39,7 +39,8 @@ import queue
 import gc
 
 from psos_util import to_str,to_bytes,file_sz
-from psos_subscription import Subscription
+from psos_subscription import Subscription, Q_DROP_OLDEST
+from psos_topic_tree import TopicTree
 import struct
 import os
     
@@ -57,7 +58,7 @@ class ModuleService(PsosService):
 
         self.fn_idx = self.get_parm("idx_fn",None)
 
-        self.subs = [] # if we are forwarding msg
+        self.subs = TopicTree() # if we are forwarding msg
         
         self.spi_svc = None
         spi_lock = self.get_parm("spi_lock",None)
@@ -88,12 +89,12 @@ class ModuleService(PsosService):
     
     # Subscribe to a given topic
     # This version does nothgin so we ignore subscribe requests.
-    async def subscribe(self,topic_filter,queue,qos=0):
+    async def subscribe(self,topic_filter,queue,qos=0,max_q=0,policy=Q_DROP_OLDEST):
         # logging might cause loop?
         # await self.log("sub mqtt log {}".format(topic_filter))
         
-        sub = Subscription(topic_filter,queue,qos)
-        self.subs.append(sub)
+        sub = Subscription(topic_filter,queue,qos,max_q,policy)
+        self.subs.add(sub)
             
         # give other tasks a chance to run
         await uasyncio.sleep_ms(0)
@@ -118,7 +119,10 @@ class ModuleService(PsosService):
             f.write('\t')
             
             # remove newline - messes log file
-            s = to_str(payload).replace("\\n","↵")
+            line = payload
+            if isinstance(line,(dict,list,tuple)):
+                line = to_bytes(line)
+            s = to_str(line).replace("\\n","↵")
             s = s.replace("\n","↵")
             f.write(to_bytes(s))
             
@@ -135,7 +139,6 @@ class ModuleService(PsosService):
     # forward messages to local subscribers
     async def local_callback(self,topic,msg):        
         t = to_str(topic)
-        m = to_str(msg)
         
         # don't think this would happen,
         # but just in case...
@@ -144,8 +147,7 @@ class ModuleService(PsosService):
         
         t_split = t.split('/')
         
-        for s in self.subs:
-            s.put_match(t_split,t,m)        
+        self.subs.put_match(t_split,t,msg)
             
     # write the current size (next position to write) 
     # as a 4 byte int to the index file
@@ -17,6 +17,57 @@
     and then a simple set of commands to send and receive
     MQTT messages.
     
+    If "metrics_s" is set, message metrics are published as by
+    svc_mqtt (see psos_metrics.py).
+    
+    The protocol version is agreed when connecting, see
+    svc_mqtt_proxy_server.py. "proto" (default 2) is the highest
+    version asked for, 1 to poll as older clients do.
+    With version 2 the server pushes messages as they arrive and
+    they are read by a reader task. Publishes and subscribes are
+    sent as soon as they are queued, without waiting for the
+    response to the previous one. A ping is sent after "ping_s"
+    (default 10) seconds without a request so the server does
+    not time the connection out.
+    
+    With "batch" (default true), if the server supports it, queued
+    publishes and subscribes are sent in one frame and answered by
+    one response, and each rcv (version 1) or push (version 2) brings
+    up to "batch_max" (default 16) messages or "batch_bytes" (default
+    1024) bytes of topics and payloads.
+    
+    With "bin" (default true), if the server supports it, binary
+    frames with topic aliases are sent instead of JSON lines, see
+    psos_proxy_frame.py. Set it to false to see the JSON when
+    debugging. "alias_max" (default 64) limits the topic aliases.
+    
+    With "credit" (default 32), if the server supports it, version 2
+    pushes are limited to that many messages not yet taken by this
+    client. Credits are given back once half of them are used. Any
+    other messages wait on the server, which limits them. 0 to not
+    limit pushes.
+    
+    The server is connected to without blocking other services and
+    is given "connect_s" (default 10) seconds to answer. If the first
+    connection can't be made, or the connection to the server is
+    lost, it is made again, at once and then after "backoff_ms"
+    (default 50) ms, doubling up to "backoff_max_s" (default 10)
+    seconds between tries. The device is only reset if the server
+    can't be reached for "reconnect_s" (default 300, 0 to never
+    reset) seconds. The session token from the server is sent when
+    connecting again, so a server that kept the session (see
+    svc_mqtt_proxy_server.py) still has this client's subscriptions
+    and the messages queued for it. The subscriptions
+    are sent again anyway, for a server that didn't. With version 2
+    a connection that hasn't answered a ping for 2 * "ping_s" is
+    taken to be lost.
+    
+    Requests are queued while they can't be sent. While not connected,
+    once "send_max" (default 32) are queued the oldest publish is
+    dropped for a new one. Publishes written but not answered when
+    the connection is lost are sent again, so a publish may reach
+    the server twice.
+    
 """
 
 from psos_svc import PsosService
@@ -35,7 +86,12 @@ import ujson
 import queue
 import secrets
 
-from psos_subscription import Subscription
+from psos_subscription import Subscription, Q_DROP_OLDEST
+from psos_topic_tree import TopicTree
+import psos_metrics
+import struct
+import psos_proxy_frame
+from psos_proxy_frame import OP_PUB, OP_SUB, OP_ACK, OP_MSG, OP_RCV, OP_PING, OP_CREDIT, ACK_OK
 
 # All initialization classes are named ModuleService
 class ModuleService(PsosService):
@@ -52,10 +108,57 @@ class ModuleService(PsosService):
             
         self._sock = None
         self._subscriptions = []
+        self._sub_tree = TopicTree()
         
         self._connected = False
 
         self._q_send = queue.Queue()
+        self._send_max = self.get_parm("send_max",32)
+        self.send_drops = 0
+        
+        # reconnecting
+        self._gen     = 0     # connections made, to tell a lost one
+        self._reconnecting = False
+        self._reader  = None
+        self._session = None
+        self._backoff_ms     = self.get_parm("backoff_ms",50)
+        self._backoff_max_ms = self.get_parm("backoff_max_s",10)*1000
+        self._reconnect_ms   = self.get_parm("reconnect_s",300)*1000
+        self._connect_s      = self.get_parm("connect_s",10)
+        self.reconnects = 0
+        
+        # protocol version asked for and the one agreed
+        self._proto   = self.get_parm("proto",2)
+        self._ver     = 1
+        self._rid     = 0
+        self._pending = {}  # request id to request, until answered
+        self._inflight = [] # [request id, request] written, until acked
+        self._ping_ms = self.get_parm("ping_s",10)*1000
+        self._sent    = time.ticks_ms()
+        self._rcvd    = time.ticks_ms()
+        
+        # options asked for and the ones agreed
+        self._opts    = []
+        if self.get_parm("batch",True):
+            self._opts.append("batch")
+        if self.get_parm("bin",True):
+            self._opts.append("bin")
+        self._credit_max = self.get_parm("credit",32)
+        self._credit  = 0
+        if self._credit_max > 0:
+            self._opts.append("credit")
+        self._taken   = 0     # messages pushed since credits were given
+        self._batch   = False
+        self._bin     = False
+        self._alias_max = self.get_parm("alias_max",64)
+        self._batch_max   = self.get_parm("batch_max",16)
+        self._batch_bytes = self.get_parm("batch_bytes",1024)
+        
+        # message metrics, off unless "metrics_s" is set
+        self._metrics = None
+        self._metrics_s = self.get_parm("metrics_s",0)
+        if self._metrics_s > 0:
+            self._metrics = psos_metrics.enable(self.get_parm("metrics_topics",16))
         
         gc.collect()
         
@@ -64,6 +167,16 @@ class ModuleService(PsosService):
             
         await self.retry_connect_mqtt_proxy()
         wifi = self.get_svc("wifi")
+        
+        if self._metrics != None:
+            topic = self.get_parm("pub_metrics",self.dev+"/metrics")
+            uasyncio.create_task(psos_metrics.report(self,topic,self._metrics_s,
+                                                     self._subscriptions))
+        
+        if self._ver >= 2:
+            self._reader = uasyncio.create_task(self.read_msgs())
+            uasyncio.create_task(self.keepalive())
+            await self.send_msgs()
        
         while True:
             # make sure wifi is connected
@@ -73,64 +186,83 @@ class ModuleService(PsosService):
             # check for any subscribed messages
             try:
                 # send any queued pub/sub messages
+                if self._bin:
+                    await self.send_frames()
+                elif self._batch and self._q_send.qsize() > 1:
+                    await self.send_batch()
                 while not self._q_send.empty():
-                    await self.send_msg(self._q_send.get_nowait())
+                    msg = self._q_send.get_nowait()
+                    self._inflight.append([0,msg])
+                    await self.send_msg(msg)
+                    self._inflight = []
                     
                 # see if any incoming MQTT messages
                 await self.check_msg()
                     
             except Exception as e:
-                # self.close_sock()
                 sys.print_exception(e)
-                # sys.exit()
-                self.reset("MQTT Proxy Client :"+str(e))
+                await self.lost(self._gen,"MQTT Proxy Client :"+str(e))
                     
             await uasyncio.sleep_ms(100)
             
-    async def retry_connect_mqtt_proxy(self,try_cnt=3):
-
-        while try_cnt > 0:
-            try:
-                await self.connect_mqtt_proxy()
-                if self._sock != None:
-                    print("connected to mqtt proxy {}:{}".format(self._server, self._port))
-                    self._connected = True
-                    break
-                try_cnt = try_cnt - 1
-            except OSError as e:
-                print('Error connecting to {} on port {}'.format(self._server, self._port))
-                self.close_sock()
-                try_cnt = try_cnt - 1
-               
-            # NOTE: NOT an async sleep
-            # Want to wait until connection made
-            time.sleep_ms(2000)
-            
-        if try_cnt <= 0:
-            msg = 'MQTT Proxy {}:{} not available'.format(self._server, self._port)
-            print(msg)
-            self.reset(msg)        
+    # the first connection is made as a lost one is, see connect_retry()
+    async def retry_connect_mqtt_proxy(self):
+        await self.connect_retry()
+        print("connected to mqtt proxy {}:{}".format(self._server, self._port))
+        self._connected = True
         
+    # Raises OSError if the server can't be reached
+    # or doesn't answer within connect_s
     async def connect_mqtt_proxy(self):
 
         print("connecting to MQTT Proxy Server")
-        self._sock = usocket.socket()
-        serv = usocket.getaddrinfo(self._server, self._port)[0][-1]
-        self._sock.connect(serv)
+        try:
+            await uasyncio.wait_for(self.open_mqtt_proxy(),self._connect_s)
+        except uasyncio.TimeoutError:
+            raise OSError("no answer in {}s".format(self._connect_s))
         
-        self.sreader = uasyncio.StreamReader(self._sock)
-        self.swriter = uasyncio.StreamWriter(self._sock, {})
+    async def open_mqtt_proxy(self):
+        self.sreader,self.swriter = await uasyncio.open_connection(self._server,self._port)
+        self._sock = self.swriter.s
+        
+        # credits are not answered, don't hold the next
+        # request back until the server acks one
+        if hasattr(usocket,"TCP_NODELAY"):
+            self._sock.setsockopt(usocket.IPPROTO_TCP,usocket.TCP_NODELAY,1)
         
         print("connected to proxy server")
         
         cid = ubinascii.hexlify(machine.unique_id())
 
-        resp = await self.send_msg({"func":"con","cid":cid})
+        msg = {"func":"con","cid":cid}
+        if self._proto > 1:
+            msg["ver"] = self._proto
+        if len(self._opts) > 0:
+            msg["opts"] = self._opts
+        if self._credit_max > 0:
+            msg["credit"] = self._credit_max
+        if self._session != None:
+            msg["session"] = self._session
+        resp = await self.send_msg(msg)
         
         if "func" in resp and "payload" in resp:
             if resp["func"] != "con" or resp["payload"] != cid.decode("utf-8"):
                 print("unexpected connection response: ", resp)
                 self.close_sock()
+            # an older server does not return a version
+            self._ver = resp.get("ver",1)
+            self._batch = "batch" in resp.get("opts",[])
+            self._bin   = "bin" in resp.get("opts",[])
+            self._credit = 0
+            if "credit" in resp.get("opts",[]):
+                self._credit = self._credit_max
+            self._taken   = 0
+            self._session = resp.get("session",None)
+            self._pending = {}
+            self._rcvd    = time.ticks_ms()
+            if self._bin:
+                self._fr = psos_proxy_frame.FrameReader(self.sreader)
+                self._fw = psos_proxy_frame.FrameWriter(self.swriter,self._alias_max)
         else:
             print("unexpected connection response: ", resp)
             self.close_sock()
@@ -140,18 +272,22 @@ class ModuleService(PsosService):
     # Payloads received for the topic are placed on queue.
     # Subscribed tasks can therefore just go into a wait
     # until a payload to be written to a queue.
-    async def subscribe(self,topic_filter,queue,qos=0):
+    async def subscribe(self,topic_filter,queue,qos=0,max_q=0,policy=Q_DROP_OLDEST):
         
         await self.log("subscr " + topic_filter)
         
-        sub = Subscription(topic_filter,queue,qos)
+        sub = Subscription(topic_filter,queue,qos,max_q,policy)
+        sub._metrics = self._metrics
         self._subscriptions.append(sub)
+        self._sub_tree.add(sub)
         
         msg = {"func":"sub","topic":topic_filter, "qos":qos}
         resp = await self.q_msg(msg)
     
     # publish messages
     async def publish(self,topic,payload,retain=False, qos=0):
+        if self._metrics != None:
+            self._metrics.msg_out(topic)
         msg = {"func":"pub", "topic":topic, "payload":payload, "retain":retain, "qos":qos}     
         print("pub: ",msg["payload"])
         resp = await self.q_msg(msg)
@@ -159,49 +295,344 @@ class ModuleService(PsosService):
     # check for any messages
     # If found, pass to callback
     async def check_msg(self):
+        if self._bin:
+            n = self._batch_max if self._batch else 1
+            while True:
+                rid = self.write_msg({"func":"rcv","max":n})
+                await self.swriter.drain()
+                if await self.wait_ack(rid) == 0:
+                    return
+            
         func = "rcv"
         
         while func == "rcv":
             msg = {"func":"rcv"}
+            if self._batch:
+                msg["max"]   = self._batch_max
+                msg["bytes"] = self._batch_bytes
             resp = await self.send_msg(msg)
             func = resp["func"]
-            if func == "rcv":
+            if func == "rcv" and "batch" in resp:
+                for m in resp["batch"]:
+                    await self.mqtt_callback(m[1],m[2])
+            elif func == "rcv":
                 resp = resp["payload"]
                 # print("resp:",resp)
                 await self.mqtt_callback(resp[1],resp[2])
             else:
                 # TODO: check responses?
                 pass
+                
+    # version 1: send the queued requests in one frame
+    async def send_batch(self):
+        msgs = []
+        while not self._q_send.empty():
+            msgs.append(self._q_send.get_nowait())
+        msg = {"func":"batch","msgs":msgs}
+        self._inflight.append([0,msg])
+        resp = await self.send_msg(msg)
+        self._inflight = []
+        self.batch_errs(msgs,resp)
+        
+    # version 1 binary: send the queued requests, waiting for
+    # the ack of each or, with batch, only of the last
+    async def send_frames(self):
+        while not self._q_send.empty():
+            msg = self._q_send.get_nowait()
+            last = not self._batch or self._q_send.empty()
+            rid = self.write_msg(msg,last)
+            if last:
+                await self.swriter.drain()
+                if rid != 0:
+                    await self.wait_ack(rid)
+                
+    # version 1 binary: read frames until the ack for rid.
+    # Returns the number of messages received before it.
+    async def wait_ack(self,rid):
+        n = 0
+        while True:
+            op,r,topic,payload = await self._fr.read()
+            if op == OP_MSG:
+                n += 1
+                await self.mqtt_callback(topic,payload)
+            elif op == OP_ACK:
+                self.check_ack(r,payload)
+                if r == rid:
+                    return n
+                
+    # requests are answered in order, so an ack is for every
+    # request written before it too, whatever it was for.
+    # Ids wrap, an entry up to half of them back is covered.
+    def acked(self,rid):
+        if not rid:
+            return
+        f = self._inflight
+        n = 0
+        while n < len(f) and (rid - f[n][0]) % 65535 < 32768:
+            n += 1
+        del f[:n]
+            
+    def check_ack(self,rid,payload):
+        self.acked(rid)
+        msg = self._pending.pop(rid,None)
+        if payload[0] != ACK_OK:
+            print("proxy error:",msg,to_str(payload[1:]))
+        
+    def batch_errs(self,msgs,resp):
+        for i,rsn in resp.get("errs",[]):
+            print("proxy error:",msgs[i]["func"],rsn)
+    
+    # version 2: send requests as they are queued,
+    # without waiting for their responses
+    async def send_msgs(self):
+        wifi = self.get_svc("wifi")
+        
+        while True:
+            msg = await self._q_send.get()
+            while not wifi.wifi_connected():
+                await uasyncio.sleep_ms(300)
+            while self._reconnecting:
+                await uasyncio.sleep_ms(10)
+                
+            gen = self._gen
+            try:
+                if self._bin:
+                    # with batch only the last request is acked
+                    self.write_msg(msg,not self._batch or self._q_send.empty())
+                    while not self._q_send.empty():
+                        msg = self._q_send.get_nowait()
+                        self.write_msg(msg,not self._batch or self._q_send.empty())
+                elif self._batch and not self._q_send.empty():
+                    msgs = [msg]
+                    while not self._q_send.empty():
+                        msgs.append(self._q_send.get_nowait())
+                    self.write_msg({"func":"batch","msgs":msgs})
+                else:
+                    self.write_msg(msg)
+                    while not self._q_send.empty():
+                        self.write_msg(self._q_send.get_nowait())
+                await self.swriter.drain()
+            except OSError as e:
+                await self.lost(gen,"MQTT Proxy Client :"+str(e))
+                
+    # write a request, returns its id
+    # A binary request without ack, or too long
+    # for a frame and not written, has id 0.
+    # Credits are never answered and have no id.
+    def write_msg(self,msg,ack=True):
+        self._sent = time.ticks_ms()
+        rid = 0
+        if (ack or not self._bin) and msg["func"] != "credit":
+            self._rid = self._rid % 65535 + 1
+            rid = self._rid
+            self._pending[rid] = msg
+            
+        if self._bin:
+            try:
+                self.write_frame(msg,rid)
+            except ValueError as e:
+                # too long for a frame, never sent
+                print("proxy error:",msg,e)
+                self._pending.pop(rid,None)
+                return 0
+        else:
+            if rid != 0:
+                msg["id"] = rid
+            self.swriter.write('{}\n'.format(ujson.dumps(msg)))
+            
+        # one without an id is covered by the ack of the next
+        if msg["func"] in ("pub","batch"):
+            self._inflight.append([rid if rid != 0 else self._rid % 65535 + 1,msg])
+        return rid
+            
+    def write_frame(self,msg,rid):
+        fw = self._fw
+        func = msg["func"]
+        if func == "pub":
+            op = OP_PUB | msg["qos"] << 5
+            if msg["retain"]:
+                op |= 0x10
+            fw.write(op,rid,msg["topic"],to_bytes(msg["payload"]))
+        elif func == "sub":
+            fw.write(OP_SUB,rid,msg["topic"],bytes((msg["qos"],)))
+        elif func == "rcv":
+            fw.write(OP_RCV,rid,None,struct.pack(">H",msg["max"]))
+        elif func == "credit":
+            fw.write(OP_CREDIT,0,None,struct.pack(">H",msg["n"]))
+        else:
+            fw.write(OP_PING,rid)
+        
+    # version 2: read messages pushed by the server
+    # and the responses to requests
+    async def read_msgs(self):
+        gen = self._gen
+        try:
+            while self._bin:
+                op,rid,topic,payload = await self._fr.read()
+                self._rcvd = time.ticks_ms()
+                if op == OP_MSG:
+                    await self.mqtt_callback(topic,payload)
+                    await self.took(1)
+                elif op == OP_ACK:
+                    self.check_ack(rid,payload)
+                    
+            while True:
+                line = await self.sreader.readline()
+                if line == b'':
+                    raise OSError("server closed connection")
+                self._rcvd = time.ticks_ms()
+                
+                resp = ujson.loads(line.rstrip())
+                if resp["func"] == "msg" and "batch" in resp:
+                    for m in resp["batch"]:
+                        await self.mqtt_callback(m[1],m[2])
+                    await self.took(len(resp["batch"]))
+                elif resp["func"] == "msg":
+                    msg = resp["payload"]
+                    await self.mqtt_callback(msg[1],msg[2])
+                    await self.took(1)
+                else:
+                    self.acked(resp.get("id"))
+                    msg = self._pending.pop(resp.get("id"),None)
+                    if resp["func"] == "err":
+                        print("proxy error:",msg,resp.get("payload"))
+                    elif resp["func"] == "batch" and msg != None:
+                        self.batch_errs(msg["msgs"],resp)
+        except (OSError, ValueError, EOFError) as e:
+            await self.lost(gen,'Server disconnect: '+str(e),True)
+            
+    # The connection gen was lost. The first task to see it
+    # connects again, the others wait for it. With version 2
+    # a new reader task is started for the new connection.
+    async def lost(self,gen,rsn,reader=False):
+        if gen == self._gen and not self._reconnecting:
+            self._reconnecting = True
+            print(rsn)
+            self.close_sock()
+            if not reader and self._reader != None:
+                self._reader.cancel()
+            await self.reconnect()
+            self._reconnecting = False
+            if self._ver >= 2:
+                self._reader = uasyncio.create_task(self.read_msgs())
+                
+        while self._reconnecting:
+            await uasyncio.sleep_ms(10)
+            
+    async def reconnect(self):
+        await self.connect_retry()
+        print("reconnected to mqtt proxy {}:{}".format(self._server, self._port))
+        self._gen += 1
+        self._connected = True
+        self.reconnects += 1
+        self.resubscribe()
+        
+    # connect with backoff, resetting the device
+    # if the server can't be reached for reconnect_s
+    async def connect_retry(self):
+        wifi = self.get_svc("wifi")
+        delay = self._backoff_ms
+        t = time.ticks_ms()
+        while True:
+            while not wifi.wifi_connected():
+                await uasyncio.sleep_ms(300)
+            try:
+                await self.connect_mqtt_proxy()
+                if self._sock != None:
+                    break
+            except OSError as e:
+                print('Error connecting to {} on port {}'.format(self._server, self._port))
+                self.close_sock()
+                
+            if self._reconnect_ms > 0 and time.ticks_diff(time.ticks_ms(),t) >= self._reconnect_ms:
+                self.reset('MQTT Proxy {}:{} not available'.format(self._server, self._port))
+            await uasyncio.sleep_ms(delay)
+            delay = min(delay*2,self._backoff_max_ms)
+        
+    # queue the subscriptions ahead of the publishes not acked
+    # and those waiting to be sent, dropping credits and pings
+    # for the old connection
+    def resubscribe(self):
+        q = self._q_send
+        pubs = []
+        for rid,msg in self._inflight:
+            if msg["func"] == "batch":
+                pubs.extend([m for m in msg["msgs"] if m["func"] == "pub"])
+            elif msg["func"] == "pub":
+                pubs.append(msg)
+        self._inflight = []
+        while not q.empty():
+            msg = q.get_nowait()
+            if msg["func"] == "pub":
+                pubs.append(msg)
+        for sub in self._subscriptions:
+            q.put_nowait({"func":"sub", "topic":sub._filter_str, "qos":sub._qos})
+        for msg in pubs:
+            q.put_nowait(msg)
+            
+    # version 2: give back credits for pushed messages
+    # once half of them have been taken
+    async def took(self,n):
+        if self._credit > 0:
+            self._taken += n
+            if self._taken*2 >= self._credit:
+                await self.q_msg({"func":"credit","n":self._taken})
+                self._taken = 0
+            
+    # version 2: ping when idle so the server doesn't time out
+    # and take the connection to be lost if nothing
+    # has been received for two pings
+    async def keepalive(self):
+        while True:
+            await uasyncio.sleep_ms(self._ping_ms)
+            if self._reconnecting:
+                continue
+            if time.ticks_diff(time.ticks_ms(),self._rcvd) >= 2*self._ping_ms:
+                await self.lost(self._gen,"MQTT Proxy Client : no response")
+            elif time.ticks_diff(time.ticks_ms(),self._sent) >= self._ping_ms:
+                await self.q_msg({"func":"ping"})
     
     async def mqtt_callback(self,topic,msg):
         t = to_str(topic)
         m = to_str(msg)
+        if self._metrics != None:
+            self._metrics.msg_in(t)
         
         t_split = t.split('/')
         
-        for subscr in self._subscriptions:
-            subscr.put_match(t_split,t,m)
+        self._sub_tree.put_match(t_split,t,m)
             
+    # queue a request. While not connected, drop the oldest
+    # publish for a publish if send_max are queued.
     async def q_msg(self,msg):
-        self._q_send.put_nowait(msg)
+        q = self._q_send
+        if (msg["func"] == "pub" and not self._connected and
+            self._send_max > 0 and q.qsize() >= self._send_max):
+            msgs = []
+            while not q.empty():
+                msgs.append(q.get_nowait())
+            for i in range(len(msgs)):
+                if msgs[i]["func"] == "pub":
+                    del msgs[i]
+                    self.send_drops += 1
+                    break
+            for m in msgs:
+                q.put_nowait(m)
+        q.put_nowait(msg)
         
     # send a message to the mqtt proxy server
-    # and receive a response
+    # and receive a response.
+    # Raises OSError if the connection is lost.
     async def send_msg(self,msg):
+        self.swriter.write('{}\n'.format(ujson.dumps(msg)))
+        await self.swriter.drain()
+        resp = await self.sreader.readline()
+        if resp == b'':
+            raise OSError("server closed connection")
         try:
-            self.swriter.write('{}\n'.format(ujson.dumps(msg)))
-            await self.swriter.drain()
-            resp = await self.sreader.readline()
             return ujson.loads(resp.rstrip())
-        except OSError as e:
-            self.close_sock()
-            print('Server disconnect.')
-            self.reset('Server disconnect')
         except ValueError as e:
-            msg = "received invalid json response: {}".format(resp)
-            print(msg)
-            self.close_sock()
-            self.reset(msg)
+            raise OSError("received invalid json response: {}".format(resp))
 
     def close_sock(self):
         self._connected = False
@@ -17,6 +17,95 @@
     Clients use simple async sockets to connect to this MQTT Proxy Server
     and then a simple set of commands to send and receive MQTT messages.
     
+    Each command is a JSON line with a "func" and the server answers
+    each with a JSON line. The client first sends
+        {"func":"con", "cid":<client id>, "ver":2}
+    and the server answers with the protocol version both support,
+    the lower of the client's "ver" (1 if not given) and PROTO_VER:
+        {"func":"con", "payload":<client id>, "ver":2}
+    
+    Version 1: request/response in lockstep. The client polls with
+    {"func":"rcv"} and is sent one queued message, or {"func":"nop"}.
+    
+    Version 2: messages are pushed to the client as soon as they are
+    queued for it:
+        {"func":"msg", "payload":[<filter>, <topic>, <payload>]}
+    Requests carry an "id" and the client does not wait for the
+    response before sending the next. The response only returns the
+    func and id, e.g. {"func":"pub", "id":7}, or is an "err" with the
+    id. {"func":"ping"} keeps an idle connection from timing out.
+    
+    Options are also agreed at "con": the client lists the ones it
+    wants in "opts" and the server returns those it supports.
+    
+    "batch" option, with either version:
+      - {"func":"rcv", "max":<n>, "bytes":<b>} is answered with up to
+        n queued messages, stopping once b bytes of topic and payload
+        have been added, {"func":"rcv", "batch":[[<filter>, <topic>,
+        <payload>], ...]}, or with {"func":"nop"} if none are queued.
+        The server's "batch_max" (default 16) and "batch_bytes"
+        (default 1024) parms limit n and b.
+      - {"func":"batch", "msgs":[<pub, sub or credit request>, ...]}
+        carries several requests in one frame. They are answered by one
+        {"func":"batch", "n":<requests done>} with "errs":[[<index>,
+        <reason>], ...] if any failed.
+      - version 2 pushes the messages queued for the client in
+        one {"func":"msg", "batch":[...]}, within the same limits.
+    
+    "bin" option: after the "con" response both ends send binary
+    frames instead of JSON lines, see psos_proxy_frame.py. Topics
+    are sent as small integers and acks only carry a status, so
+    payloads are not echoed back. JSON lines are kept for older
+    clients and for debugging. With "batch" a client only asks for
+    an ack on the last of the requests it sends together.
+    
+    "credit" option, version 2 only: the client gives the server
+    credits for the messages it may push, n in the "con" request,
+    {"func":"con", ..., "credit":<n>}, and more as it takes them,
+    {"func":"credit", "n":<n>}, which is not answered. A message is
+    only pushed for a credit, so the messages for a client that is
+    not keeping up wait on the server, where they are limited as
+    below, instead of in socket buffers.
+    
+    Each client's queue is limited to "max_q" (default 64) messages
+    and "max_bytes" (default 4096) bytes of topics and payloads.
+    "policy" (see psos_subscription.py) chooses what is dropped for
+    a new message once the queue is full, the oldest message (default),
+    the new one, or with "conflate" a queued message for the same
+    topic is replaced by the new one. A client that has had messages
+    waiting but taken none for "stall_s" (default "timeout") seconds
+    is disconnected, as is a connected client when a new connection
+    comes in with its cid.
+    
+    If "stats_s" is set, each client's queued messages, queued bytes,
+    dropped messages, high water mark, lag (age in ms of the oldest
+    queued message) and credits are published to "pub_stats" (default
+    "{dev}/proxy/stats") every stats_s seconds, with the number of
+    sessions held for disconnected clients (see below):
+        {"evicted":<n>, "held":<n>,
+         "clients":{<cid>:[<queued>, <bytes>, <drops>, <hwm>,
+                           <lag ms>, <credit>], ...}}
+    
+    Sessions: the "con" response gives the client a session token,
+    {"func":"con", ..., "session":<token>}. When a client disconnects
+    its queue and subscriptions are kept for "grace_s" (default 30)
+    seconds, still queueing its messages within the limits above.
+    A client connecting again within that time with the token,
+    {"func":"con", ..., "session":<token>}, gets them back and the
+    response has "resumed":true. Otherwise the old session is
+    dropped and a new one started. A client can send its
+    subscriptions again either way, those it already has are
+    not added again. 0 to drop a session on disconnect.
+    
+    Clients subscribing to the same filter share one subscription
+    with the mqtt service, and so one broker SUBSCRIBE, which puts
+    each message on the queue of every client subscribed (see
+    _Fanout below). The broker is sent an UNSUBSCRIBE when the last
+    of those clients disconnects. A client subscribing to a filter
+    it already has is not subscribed again, and a message matching
+    more than one of a client's filters is only queued for it once.
+    The qos of the first client to subscribe to a filter is used.
+    
 """
 from psos_svc import PsosService
 
@@ -27,6 +116,180 @@ import network
 import queue
 
 import gc
+import time
+import random
+
+import psos_proxy_frame
+import psos_metrics
+from psos_proxy_frame import OP_PUB, OP_SUB, OP_MSG, OP_RCV, OP_PING, OP_CREDIT
+from psos_subscription import Q_DROP_OLDEST, Q_DROP_NEWEST, Q_CONFLATE
+from psos_util import to_bytes
+
+# highest protocol version supported
+PROTO_VER = 2
+
+# options supported
+PROTO_OPTS = ("batch","bin","credit")
+
+# bytes of topic and payload a message holds on a queue
+def _size(msg):
+    return len(msg.topic) + len(msg.payload)
+
+# A client's queue, limited to max_q messages and max_bytes bytes
+# (0 for no limit) with policy choosing what is dropped.
+# With credit set, messages are only taken from it for credits,
+# empty() is True while there are none.
+class _ClientQueue(queue.Queue):
+    
+    def __init__(self,max_q,max_bytes,policy):
+        super().__init__()
+        self.max_q     = max_q
+        self.max_bytes = max_bytes
+        self.policy    = policy
+        self.bytes  = 0
+        self.drops  = 0
+        self.hwm    = 0
+        self.credit = None
+        self._evcredit = uasyncio.Event()
+        self._got = time.ticks_ms()  # last taken, or first put since
+        
+    def put_nowait(self,msg):
+        n = _size(msg)
+        
+        # replace any queued message for the same topic
+        if self.policy == Q_CONFLATE:
+            t = msg.topic
+            old = []
+            def match(m):
+                if m.topic == t:
+                    old.append(m)
+                    return True
+                return False
+            if self.replace(match,msg):
+                self.bytes += n - _size(old[0])
+                self.drops += 1
+                return
+                
+        while self._cnt > 0 and ((self.max_q > 0 and self._cnt >= self.max_q) or
+                                 (self.max_bytes > 0 and self.bytes + n > self.max_bytes)):
+            self.drops += 1
+            if self.policy == Q_DROP_NEWEST:
+                return
+            # not taken by the client, so no credit used
+            self.bytes -= _size(queue.Queue._get(self))
+            
+        if self._cnt == 0:
+            self._got = time.ticks_ms()
+        self.bytes += n
+        self._put(msg)
+        if self._cnt > self.hwm:
+            self.hwm = self._cnt
+            
+    def _get(self):
+        msg = super()._get()
+        self.bytes -= _size(msg)
+        self._got = time.ticks_ms()
+        if psos_metrics.metrics != None:
+            psos_metrics.metrics.dequeued(msg)
+        if self.credit != None:
+            self.credit -= 1
+        return msg
+    
+    async def get(self):
+        while self.empty():
+            if self.credit == 0:
+                await self._evcredit.wait()
+            else:
+                await self._evput.wait()
+        return self._get()
+    
+    def empty(self):
+        return self._cnt == 0 or self.credit == 0
+    
+    # credits are ignored if not agreed
+    def add_credit(self,n):
+        if self.credit == None:
+            return
+        self.credit += n
+        self._evcredit.set()
+        self._evcredit.clear()
+        
+    # a held queue given back to its client, with
+    # no credits until they are agreed again
+    def resume(self):
+        self.credit = None
+        self._got = time.ticks_ms()
+        
+    # ms messages have been waiting without one being taken
+    def wait_ms(self):
+        if self._cnt == 0:
+            return 0
+        return time.ticks_diff(time.ticks_ms(),self._got)
+    
+    def stats(self):
+        lag = 0
+        if self._cnt > 0:
+            lag = time.ticks_diff(time.ticks_ms(),self.peek().ticks)
+        return [self._cnt, self.bytes, self.drops, self.hwm, lag, self.credit]
+
+# The queue of a subscription shared by the clients subscribed
+# to one filter. Puts each message on those clients' queues.
+class _Fanout:
+    
+    def __init__(self,last):
+        self.queues = []
+        self._last  = last  # id of client queue to last message put
+        
+    def put_nowait(self,msg):
+        last = self._last
+        for q in self.queues:
+            # already put for another of the client's filters
+            if last.get(id(q)) is msg:
+                continue
+            last[id(q)] = msg
+            q.put_nowait(msg)
+            
+    # the messages are on the clients' queues
+    def qsize(self):
+        return 0
+    
+# one subscription with the mqtt service for each filter
+# subscribed to by any client
+class _SubMux:
+    
+    def __init__(self,svc):
+        self._svc = svc
+        self.fanouts = {}  # filter to _Fanout
+        self._last   = {}
+        
+    async def subscribe(self,topic_filter,q,qos):
+        f = self.fanouts.get(topic_filter,None)
+        if f == None:
+            f = _Fanout(self._last)
+            f.queues.append(q)
+            self.fanouts[topic_filter] = f
+            await self._svc.get_mqtt().subscribe(topic_filter,f,qos)
+        elif not q in f.queues:
+            f.queues.append(q)
+            
+    # remove a client's queue from every filter,
+    # unsubscribing filters it was the last client of
+    async def unsubscribe(self,q):
+        for topic_filter,f in list(self.fanouts.items()):
+            if q in f.queues:
+                f.queues.remove(q)
+                if len(f.queues) == 0:
+                    del self.fanouts[topic_filter]
+                    await self._svc.get_mqtt().unsubscribe(f)
+        self._last.pop(id(q),None)
+        
+    # the client's filter the message was queued for
+    def filter(self,q,msg):
+        for sub in msg.subs:
+            f = sub._queue
+            if f is q or (type(f) == _Fanout and q in f.queues):
+                return sub._filter_str
+        return ""
 
 class ModuleService(PsosService):
 
@@ -38,51 +301,274 @@ class ModuleService(PsosService):
         self.backlog = self.get_parm("backlog",5)
         self.timeout = self.get_parm("timeout",20)
         
+        self.batch_max   = self.get_parm("batch_max",16)
+        self.batch_bytes = self.get_parm("batch_bytes",1024)
+        self.alias_max   = self.get_parm("alias_max",64)
+        
+        self.max_q     = self.get_parm("max_q",64)
+        self.max_bytes = self.get_parm("max_bytes",4096)
+        self.policy    = self.get_parm("policy",Q_DROP_OLDEST)
+        self.stall_ms  = self.get_parm("stall_s",self.timeout)*1000
+        self.stats_s   = self.get_parm("stats_s",0)
+        self.grace_ms  = self.get_parm("grace_s",30)*1000
+        
         self.users = {} # dictionary of users to queue
+        self.vers  = {} # protocol version of each user
+        self.opts  = {} # options agreed with each user
+        self.writers = {} # stream writer of each user
+        self.pushes  = {} # version 2 push task of each user
+        self.tokens  = {} # session token of each user
+        self.held    = {} # disconnected user to [token, queue, ticks]
+        self.evicted = 0
+        self.mux   = _SubMux(self)
 
     async def run(self):
         await self.log('Awaiting client connection: {}'.format(network.WLAN(network.STA_IF).ifconfig()[0]))
         self.cid = 0
         # uasyncio.create_task(heartbeat(100))
         self.server = await uasyncio.start_server(self.run_client, self.host, self.port, self.backlog)
+        if self.stall_ms > 0 or self.stats_s > 0 or self.grace_ms > 0:
+            await self.watch()
         while True:
             await uasyncio.sleep(1000)
+            
+    # disconnect stalled clients, drop sessions held past
+    # their grace period and publish client stats
+    async def watch(self):
+        stats_ms = self.stats_s*1000
+        topic = self.get_parm("pub_stats",self.dev+"/proxy/stats")
+        t = time.ticks_ms()
+        while True:
+            await uasyncio.sleep(1)
+            if self.stall_ms > 0:
+                for cid,q in list(self.users.items()):
+                    if q.wait_ms() > self.stall_ms:
+                        await self.evict(cid,"stalled")
+                        
+            for cid,h in list(self.held.items()):
+                if time.ticks_diff(time.ticks_ms(),h[2]) > self.grace_ms:
+                    await self.drop_session(cid)
+                    
+            if stats_ms > 0 and time.ticks_diff(time.ticks_ms(),t) >= stats_ms:
+                t = time.ticks_ms()
+                clients = {}
+                for cid,q in self.users.items():
+                    clients[cid] = q.stats()
+                await self.get_mqtt().publish(topic,ujson.dumps({"evicted":self.evicted,
+                                                                 "held":len(self.held),
+                                                                 "clients":clients}))
+                
+    # disconnect a client, its run_client then cleans up.
+    # Nothing more is sent, so messages stay queued.
+    async def evict(self,cid,rsn):
+        swriter = self.writers.pop(cid,None)
+        push = self.pushes.pop(cid,None)
+        if push != None:
+            push.cancel()
+        if swriter != None:
+            await self.log("Client {} evicted: {}".format(cid,rsn))
+            self.evicted += 1
+            swriter.close()
+            
+    # unsubscribe a disconnected client's held session
+    async def drop_session(self,cid):
+        h = self.held.pop(cid,None)
+        if h != None:
+            await self.mux.unsubscribe(h[1])
 
     async def run_client(self, sreader, swriter):
-        cid = None
+        cid  = None
+        push = None
+        err  = None
+        started = False
+        
+        # responses and pushed messages share the writer
+        lock = uasyncio.Lock()
         try:
             while True:
                 try:
                     rcv = await uasyncio.wait_for(sreader.readline(), self.timeout)
                 except uasyncio.TimeoutError:
                     rcv = b''
-                if rcv == b'':
+                if rcv == b'' or (started and not self.writers.get(cid) is swriter):
                     raise OSError
 
                 cid,res = await self.process_input(cid,rcv)
 
                 # write back response
-                swriter.write(res)
-                swriter.write('\n')
-                await swriter.drain()
+                if res != None:
+                    async with lock:
+                        swriter.write(res)
+                        swriter.write('\n')
+                        await swriter.drain()
+                
+                if cid == None or started:
+                    continue
+                started = True
+                self.writers[cid] = swriter
+                
+                # the rest of the connection is binary frames
+                if "bin" in self.opts[cid]:
+                    fw = psos_proxy_frame.FrameWriter(swriter,self.alias_max)
+                    if self.vers[cid] >= 2:
+                        push = uasyncio.create_task(self.push_frames(cid,fw,swriter,lock))
+                        self.pushes[cid] = push
+                    await self.run_bin(cid,sreader,swriter,fw,lock)
+                
+                # version 2 clients are sent messages as they arrive
+                elif self.vers[cid] >= 2:
+                    push = uasyncio.create_task(self.push_msgs(cid,swriter,lock))
+                    self.pushes[cid] = push
+        except (OSError, EOFError):
+            pass
+        except Exception as e:
+            # a request the server couldn't handle, drop the client
+            err = repr(e)
+        finally:
+            # whatever ended the connection, so the cid can be used again
+            q = self.end_client(cid,push,swriter)
+            
+        if err != None:
+            await self.log('Client {} error: {}'.format(cid,err))
+        if q != None:
+            await self.mux.unsubscribe(q)
+        
+        await self.log('Client {} disconnect.'.format(cid))
+        try:
+            await sreader.wait_closed()
         except OSError:
+            # reset by the client
             pass
+
+    # stop pushing to a client and forget it, keeping its session
+    # for it to resume. Returns its queue if that is to be
+    # unsubscribed instead.
+    def end_client(self,cid,push,swriter):
+        if push != None:
+            push.cancel()
         
-        # Unsubscribe client based on queue for cid
-        if cid != None:
-            q = self.users[cid]
-            await self.get_mqtt().unsubscribe(q)
-            del self.users[cid]
+        if cid == None:
+            return None
         
-        await self.log('Client {} disconnect.'.format(cid))
-        await sreader.wait_closed()
+        q = self.users[cid]
+        if self.grace_ms > 0:
+            self.held[cid] = [self.tokens[cid], q, time.ticks_ms()]
+        del self.users[cid]
+        del self.vers[cid]
+        del self.opts[cid]
+        del self.tokens[cid]
+        if self.writers.get(cid) is swriter:
+            del self.writers[cid]
+        if push != None and self.pushes.get(cid) is push:
+            del self.pushes[cid]
+        return None if self.grace_ms > 0 else q
 
+    # send queued messages to a version 2 client
+    async def push_msgs(self,cid,swriter,lock):
+        q = self.users[cid]
+        batch = "batch" in self.opts[cid]
+        try:
+            while True:
+                msg = await q.get()
+                async with lock:
+                    if batch:
+                        msgs = self.get_batch(q,msg,self.batch_max,self.batch_bytes)
+                        swriter.write(ujson.dumps({"func":"msg", "batch":msgs}))
+                        swriter.write('\n')
+                    else:
+                        swriter.write(self.msg_line(q,msg))
+                        
+                        # and anything else queued while waiting
+                        while not q.empty():
+                            swriter.write(self.msg_line(q,q.get_nowait()))
+                    await swriter.drain()
+        except OSError:
+            # run_client sees the closed socket
+            pass
+            
+    # read and answer binary frames, only returns by raising
+    # an exception when the connection is lost
+    async def run_bin(self,cid,sreader,swriter,fw,lock):
+        fr = psos_proxy_frame.FrameReader(sreader)
+        q  = self.users[cid]
+        while True:
+            try:
+                op,rid,topic,payload = await uasyncio.wait_for(fr.read(), self.timeout)
+            except uasyncio.TimeoutError:
+                raise OSError
+            if not self.writers.get(cid) is swriter:
+                raise OSError
+            
+            rsn = None
+            code = op & 0x0F
+            if code == OP_PUB:
+                msg = {"topic":topic, "payload":payload.decode(),
+                       "retain":op & 0x10 != 0, "qos":op >> 5}
+                rsn = await self.do_publish(cid,msg)
+            elif code == OP_SUB:
+                msg = {"topic":topic, "qos":payload[0] if len(payload) > 0 else 0}
+                rsn = await self.do_subscribe(cid,msg)
+            elif (code == OP_RCV or code == OP_CREDIT) and len(payload) < 2:
+                # payload is a 2 byte count
+                rsn = "invalid payload"
+            elif code == OP_RCV:
+                n = min(payload[0] << 8 | payload[1],self.batch_max)
+                async with lock:
+                    if not q.empty():
+                        for m in self.get_batch(q,q.get_nowait(),n,self.batch_bytes):
+                            self.write_msg_frame(fw,m[1],m[2])
+                    fw.ack(rid)
+                    await swriter.drain()
+                continue
+            elif code == OP_CREDIT:
+                q.add_credit(payload[0] << 8 | payload[1])
+                continue
+            elif code != OP_PING:
+                rsn = "invalid op: {}".format(code)
+            
+            if rid != 0 or rsn != None:
+                async with lock:
+                    fw.ack(rid,rsn)
+                    await swriter.drain()
+                    
+    # send queued messages to a version 2 client as binary frames
+    async def push_frames(self,cid,fw,swriter,lock):
+        q = self.users[cid]
+        try:
+            while True:
+                msg = await q.get()
+                async with lock:
+                    self.write_msg_frame(fw,msg.topic,msg.payload)
+                    
+                    # and up to batch_max in all, queued while waiting
+                    n = 1
+                    while n < self.batch_max and not q.empty():
+                        msg = q.get_nowait()
+                        self.write_msg_frame(fw,msg.topic,msg.payload)
+                        n += 1
+                    await swriter.drain()
+        except OSError:
+            # run_client sees the closed socket
+            pass
+            
+    # a message too long for a frame is dropped
+    # and the client told with an ACK_ERR for rid 0
+    def write_msg_frame(self,fw,topic,payload):
+        try:
+            fw.write(OP_MSG,0,topic,to_bytes(payload))
+        except ValueError as e:
+            fw.ack(0,"{}: {}".format(e,topic))
+            
+    def msg_line(self,q,msg):
+        msg = [self.mux.filter(q,msg), msg.topic, msg.payload]
+        return ujson.dumps({"func":"msg", "payload":msg}) + '\n'
+    
     async def process_input(self,cid,rcv):
         msg = ujson.loads(rcv.rstrip())
         
         # always require function
         if not "func" in msg:
-            return cid, self.set_err("missing func")
+            return cid, self.set_err("missing func",msg.get("id"))
         
         # cid = None if client not yet connected
         if cid == None:
@@ -95,14 +581,34 @@ class ModuleService(PsosService):
             return await self.publish(cid,msg)
         
         if msg["func"] == "rcv":
-            return await self.check_queue(cid)
+            return await self.check_queue(cid,msg)
+        
+        if msg["func"] == "batch":
+            return await self.batch(cid,msg)
+        
+        if msg["func"] == "ping":
+            return cid, self.ack(msg)
         
-        return cid, self.set_err("invalid function: {}".format(msg["func"]))
+        # not answered
+        if msg["func"] == "credit":
+            self.users[cid].add_credit(msg.get("n",0))
+            return cid, None
+        
+        return cid, self.set_err("invalid function: {}".format(msg["func"]),msg.get("id"))
     
     async def subscribe(self,cid,msg):
-
+        rsn = await self.do_subscribe(cid,msg)
+        if rsn != None:
+            return cid, self.set_err(rsn,msg.get("id"))
+        
+        if "id" in msg:
+            return cid, self.ack(msg)
+        return cid,ujson.dumps({"func":"sub", "topic":msg["topic"], "qos":msg.get("qos",0)})
+    
+    # subscribe the client's queue, returns the reason if not done
+    async def do_subscribe(self,cid,msg):
         if not "topic" in msg:
-            return cid, self.set_err("subscribe requires topic")
+            return "subscribe requires topic"
         
         topic = msg["topic"]
         qos = 0
@@ -111,15 +617,24 @@ class ModuleService(PsosService):
         
         print(cid, "sub", topic)
         
-        mqtt = self.get_mqtt()
         q = self.users[cid]
-        await mqtt.subscribe(topic,q,qos)
-        
-        return cid,ujson.dumps({"func":"sub", "topic":topic, "qos":qos})
+        await self.mux.subscribe(topic,q,qos)
+        return None
     
     async def publish(self,cid,msg):
+        rsn = await self.do_publish(cid,msg)
+        if rsn != None:
+            return cid, self.set_err(rsn,msg.get("id"))
+        
+        if "id" in msg:
+            return cid, self.ack(msg)
+        return cid,ujson.dumps({"func":"pub", "topic":msg["topic"], "payload":msg.get("payload",""),
+                                "retain":msg.get("retain",False), "qos":msg.get("qos",0) })
+    
+    # publish for the client, returns the reason if not done
+    async def do_publish(self,cid,msg):
         if not "topic" in msg:
-            return cid, self.set_err("publish requires topic")
+            return "publish requires topic"
         
         topic = msg["topic"]
         payload = ""
@@ -138,19 +653,64 @@ class ModuleService(PsosService):
         print(cid,"pub",topic,payload)
         
         await self.get_mqtt().publish(topic,payload,retain,qos)
+        return None
+    
+    # several pub and sub requests answered by one response
+    async def batch(self,cid,msg):
+        n = 0
+        errs = []
+        for m in msg.get("msgs",[]):
+            func = m.get("func",None)
+            if func == "pub":
+                rsn = await self.do_publish(cid,m)
+            elif func == "sub":
+                rsn = await self.do_subscribe(cid,m)
+            elif func == "credit":
+                self.users[cid].add_credit(m.get("n",0))
+                rsn = None
+            else:
+                rsn = "invalid function: {}".format(func)
+            if rsn != None:
+                errs.append([n,rsn])
+            n += 1
+            
+        resp = {"func":"batch", "n":n}
+        if "id" in msg:
+            resp["id"] = msg["id"]
+        if len(errs) > 0:
+            resp["errs"] = errs
+        return cid,ujson.dumps(resp)
         
-        return cid,ujson.dumps({"func":"pub", "topic":topic, "payload":payload, "retain":retain, "qos":qos }) 
-        
-    async def check_queue(self,cid):
+    async def check_queue(self,cid,msg=None):
         
         q_out = self.users[cid]
         
+        # batched receive
+        if msg != None and "max" in msg and not q_out.empty():
+            n = min(msg["max"],self.batch_max)
+            b = min(msg.get("bytes",self.batch_bytes),self.batch_bytes)
+            msgs = self.get_batch(q_out,q_out.get_nowait(),n,b)
+            return cid,ujson.dumps({"func":"rcv", "batch":msgs})
+        
         if not q_out.empty():
             msg = q_out.get_nowait()
+            msg = [self.mux.filter(q_out,msg), msg.topic, msg.payload]
             return cid,ujson.dumps({"func":"rcv", "payload":msg})
             
         return cid,ujson.dumps({"func":"nop"}) 
-
+    
+    # msg and then up to n messages in all from the queue,
+    # stopping once b bytes of topic and payload are added
+    def get_batch(self,q,msg,n,b):
+        msgs = []
+        size = 0
+        while True:
+            p = msg.payload
+            size += len(msg.topic) + len(p)
+            msgs.append([self.mux.filter(q,msg), msg.topic, p])
+            if len(msgs) >= n or size >= b or q.empty():
+                return msgs
+            msg = q.get_nowait()
 
     async def register_client(self,cid,msg):
         # only accept a connection request
@@ -161,20 +721,54 @@ class ModuleService(PsosService):
             return cid, self.set_err("cid required for connection")
         
         cid = msg["cid"]
-        q = queue.Queue()
+        ver = min(msg.get("ver",1),PROTO_VER)
+        opts = [o for o in msg.get("opts",[]) if o in PROTO_OPTS and (o != "credit" or ver > 1)]
         
         # IF client is already connected
-        # Wait for that socket to timeout
+        # disconnect it and wait for it to clean up
+        if cid in self.users:
+            await self.evict(cid,"reconnected")
         while cid in self.users:
-            await uasyncio.sleep(1)
+            await uasyncio.sleep_ms(10)
             
-        self.users[cid] = q
+        # resume the session held for the client
+        h = self.held.get(cid,None)
+        resumed = h != None and h[0] == msg.get("session")
+        if resumed:
+            del self.held[cid]
+            token,q = h[0],h[1]
+            q.resume()
+        else:
+            await self.drop_session(cid)
+            token = random.getrandbits(30)
+            q = _ClientQueue(self.max_q,self.max_bytes,self.policy)
+        if "credit" in opts:
+            q.credit = msg.get("credit",self.batch_max)
             
-        await self.log("client connected: {} ".format(cid))
-        return cid,ujson.dumps({"func":"con", "payload":cid})        
+        self.users[cid]  = q
+        self.vers[cid]   = ver
+        self.opts[cid]   = opts
+        self.tokens[cid] = token
+            
+        await self.log("client connected: {} ver {} {}{}".format(cid,ver,opts,
+                       " resumed" if resumed else ""))
+        resp = {"func":"con", "payload":cid, "session":token}
+        if resumed:
+            resp["resumed"] = True
+        if ver > 1:
+            resp["ver"] = ver
+        if "opts" in msg:
+            resp["opts"] = opts
+        return cid,ujson.dumps(resp)
+    
+    # version 2 response to a request with an id
+    def ack(self,msg):
+        return ujson.dumps({"func":msg["func"], "id":msg.get("id")})
         
     # return an error response
-    def set_err(self,rsn):
+    def set_err(self,rsn,rid=None):
+       if rid != None:
+           return ujson.dumps({"func":"err", "id":rid, "payload":rsn})
        return ujson.dumps({"func":"err", "payload":rsn})
 
     # never called?
@@ -9,12 +9,15 @@
 """
 
 import ujson
+from psos_msg import PsosMsg
+import psos_metrics
 
 class SvcMsg:
     
     def __init__(self,f="",t="",payload=""):
         self._filter  = f
         self._topic   = t
+        self._shared  = False
         
         if payload == "":
             self._payload = []
@@ -25,10 +28,26 @@ class SvcMsg:
     # It should contain a filter, topic, and payload.
     # Payload may be a JSON string. Assume it is IF
     # it starts with a '{' or '['
-    def load_subscr(self,q):
+    # A PsosMsg is shared with other subscribers so its
+    # fields are referenced, never changed, and the JSON
+    # payload is only parsed once for all subscribers.
+    # Use get_payload_rw() to get a payload that can be changed.
+    # queue is the queue q was taken from, to get the filter
+    # of its own subscription when a message is shared.
+    def load_subscr(self,q,queue=None):
+        if isinstance(q,PsosMsg):
+            if psos_metrics.metrics != None:
+                psos_metrics.metrics.dequeued(q)
+            self._filter  = q.filter(queue)
+            self._topic   = q.topic
+            self._payload = q.json()
+            self._shared  = True
+            return self
+        
         self._filter = q[0]
         self._topic  = q[1]
         self._payload = q[2]
+        self._shared  = False
         
         if isinstance(self._payload,str):
             if (self._payload.startswith('[') or
@@ -39,11 +58,24 @@ class SvcMsg:
     
     def set_payload(self,payload):
         self._payload = payload
+        self._shared  = False
         return self
     
     def get_payload(self):
         return self._payload
     
+    # return a payload the caller may change.
+    # A payload loaded from a shared PsosMsg is copied
+    # (shallow) the first time it is asked for.
+    def get_payload_rw(self):
+        if self._shared:
+            if isinstance(self._payload,dict):
+                self._payload = dict(self._payload)
+            elif isinstance(self._payload,list):
+                self._payload = list(self._payload)
+            self._shared = False
+        return self._payload
+    
     # dumps will generate a string version of the payload for this object
     def dumps(self):
         # msg = [self._filter, self._topic, self._payload]
@@ -56,6 +88,7 @@ class SvcMsg:
         self._filter  = msg[0]
         self._topic   = msg[1]
         self._payload = msg[2]
+        self._shared  = False
         
         return self
 
@@ -37,14 +37,14 @@ class ModuleService(PsosService):
         
         while True:
             data = await self._trigger_q.get()
-            msg.load_subscr(data)
+            msg.load_subscr(data,self._trigger_q)
             await self.send_data(mqtt,msg)
             
             
     # send data via MQTT after receiving an input message
     async def send_data(self,mqtt,msg):
 
-        out = msg.get_payload()
+        out = msg.get_payload_rw()
         
         if type(out) != dict:
             out = {}
@@ -0,0 +1,80 @@
+"""
+    Profiler Service Class
+
+    Measures how late the event loop wakes up sleeping tasks
+    (scheduler lag) and how much time each service runs between
+    yields (see psos_prof.py). Add it to psos_parms.json:
+        {"name": "prof", "module": "svc_prof", "pub": "{dev}/prof"}
+
+    Parameters:
+      sample_ms - how often lag is sampled (default 100)
+      long_ms   - a service running longer than this without
+                  yielding is reported (default 50)
+      top       - number of services in the report (default 5)
+      report_s  - seconds between reports (default 60)
+      pub       - topic to publish reports to, if None only printed
+
+    Report:
+      {"dev":"e02", "secs":60,
+       "lag":[avg ms, max ms],
+       "top":[[service, % of time, steps, max us], ...],
+       "long":[[service, method, us], ...]}
+
+"""
+
+from psos_svc import PsosService
+import uasyncio
+import time
+
+import psos_prof
+
+# All initialization classes are named ModuleService
+class ModuleService(PsosService):
+
+    def __init__(self, parms):
+        super().__init__(parms)
+
+        self.prof = psos_prof.Profiler(self.get_parm("long_ms",50)*1000)
+        psos_prof.profiler = self.prof
+
+    async def run(self):
+
+        sample_ms = self.get_parm("sample_ms",100)
+        report_ms = self.get_parm("report_s",60)*1000
+        top_n     = self.get_parm("top",5)
+        pub       = self.get_parm("pub",None)
+
+        # function aliases
+        ticks_ms   = time.ticks_ms
+        ticks_us   = time.ticks_us
+        ticks_diff = time.ticks_diff
+        sleep_ms   = uasyncio.sleep_ms
+
+        while True:
+            start   = ticks_us()
+            lag_sum = 0
+            lag_max = 0
+            samples = 0
+
+            report_at = ticks_ms()
+            while ticks_diff(ticks_ms(),report_at) < report_ms:
+                t = ticks_ms()
+                await sleep_ms(sample_ms)
+                lag = ticks_diff(ticks_ms(),t) - sample_ms
+                lag_sum += lag
+                samples += 1
+                if lag > lag_max:
+                    lag_max = lag
+
+            elapsed = ticks_diff(ticks_us(),start)
+            msg = {"dev"  : self.dev,
+                   "secs" : elapsed//1000000,
+                   "lag"  : [lag_sum//samples if samples > 0 else 0,lag_max],
+                   "top"  : self.prof.top(top_n,elapsed),
+                   "long" : self.prof.long }
+            self.prof.reset()
+
+            if pub == None:
+                print("prof:",msg)
+            else:
+                await self.get_mqtt().publish(pub,msg)
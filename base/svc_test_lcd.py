@@ -41,7 +41,7 @@ class ModuleService(PsosService):
         while True:
             data = await q.get()
             try:
-                msg.load_subscr(data)
+                msg.load_subscr(data,q)
                 await self.run_test(msg.get_payload())
             except Exception as e:
                 print("exception",str(e))
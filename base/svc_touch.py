@@ -29,7 +29,8 @@ class ModuleService(PsosService):
         self._hg_msg = None
         
         if self._pub_hourglass != None :
-            self._hg_msg = SvcLcdMsg().dsp_hg().dumps()
+            # passed as is to a local svc_lcd, serialized if sent to the broker
+            self._hg_msg = SvcLcdMsg().dsp_hg().get_payload()
         
         # topic to send message under
         self._pub_touch = parms.get_parm("pub_touch")
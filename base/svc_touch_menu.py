@@ -65,7 +65,7 @@ class ModuleService(PsosService):
 
         while True:
             data = await q.get()
-            m.load_subscr(data)
+            m.load_subscr(data,q)
             await self.check_menu(m.get_payload())
         
     async def init_main_menu(self):
@@ -18,16 +18,41 @@
 
     During that process the remote device replaces the local copy
     of the manifest.json file with the repo version.
+
+    Precompiled modules:
+        python build_manifest.py --mpy [mpy-cross options]
+    first cross compiles every base/*.py and lib/*.py module with
+    mpy-cross into the mpy directory, e.g. for an ESP32:
+        python build_manifest.py --mpy -march=xtensawin
+    The .mpy files must be compiled by the mpy-cross version matching
+    the MicroPython firmware on the devices, installed with
+        pip install mpy-cross==<firmware version>
+    Commit and push the mpy
+    directory, then run build_manifest.py again so that manifest.json
+    records the .mpy hashes from the repo. The hash of each local .mpy
+    file is checked against the repo to catch files not yet pushed.
+
+    Devices with "mpy": true in config.json load the precompiled
+    modules in place of the .py files (see main.py). Rebuild the
+    mpy directory whenever a .py file changes, or a device will
+    keep loading the old .mpy.
 '''
 
 import requests
 import json
 import sys
+import os
+import glob
+import hashlib
+import subprocess
 
 sys.path.extend([".\lib",".\\base"])
 
 import secrets
 
+MPY_DIR = "mpy"
+MPY_SRC = ["base","lib"]
+
 headers = {
     "User-Agent"    : "ddgarrett",
     "Authorization" : "Bearer " + (secrets.git_token),
@@ -92,6 +117,56 @@ def rebuild_dir(name):
     return files
 
 
+# git blob sha of a local file,
+# the same as the sha github reports for the file
+def git_sha(fn):
+    with open(fn,"rb") as f:
+        data = f.read()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+# cross compile every module in MPY_SRC into MPY_DIR.
+# args are passed to mpy-cross.
+# returns a dictionary of compiled file name to git sha
+def compile_mpy(args):
+    print("cross compiling",", ".join(MPY_SRC),"to",MPY_DIR)
+    os.makedirs(MPY_DIR,exist_ok=True)
+
+    compiled = {}
+    for src in MPY_SRC:
+        for fn in sorted(glob.glob(os.path.join(src,"*.py"))):
+            name = os.path.basename(fn)[:-3] + ".mpy"
+            out  = os.path.join(MPY_DIR,name)
+            r = subprocess.run(["mpy-cross","-o",out] + args + [fn],
+                               capture_output=True,text=True)
+            if r.returncode != 0:
+                print("... mpy-cross failed, {} will load from source:".format(fn))
+                print("   ",r.stderr.strip().replace("\n","\n    "))
+                if os.path.exists(out):
+                    os.remove(out)
+            else:
+                compiled[name] = git_sha(out)
+
+    # remove .mpy files without a source file
+    for fn in glob.glob(os.path.join(MPY_DIR,"*.mpy")):
+        if not os.path.basename(fn) in compiled:
+            print("... remove",fn)
+            os.remove(fn)
+
+    print("... {} modules compiled".format(len(compiled)))
+    return compiled
+
+# warn about local .mpy files that differ from the repo
+def check_mpy(files):
+    local = glob.glob(os.path.join(MPY_DIR,"*.mpy"))
+    repo  = cnv_list_to_dict(files,"name")
+    stale = 0
+    for fn in local:
+        name = os.path.basename(fn)
+        if not name in repo or repo[name]["sha"] != git_sha(fn):
+            stale += 1
+    if stale > 0 or len(local) != len(files):
+        print("WARNING: {} local .mpy files differ from the repo, push {} first".format(stale,MPY_DIR))
+
 # rebuild the manifest using the initial manifest
 # defined in filename (fn)
 def rebuild_manifest(fn):
@@ -104,14 +179,22 @@ def rebuild_manifest(fn):
     git = cnv_list_to_dict(git,"name")
 
     for obj in manifest["obj"]:
+        if not obj["name"] in git:
+            print("... {} not in repo".format(obj["name"]))
+            continue
         obj["sha"] = git[obj["name"]]["sha"]
         if "files" in obj:
             obj["files"] = rebuild_dir(obj["name"])
+            if obj["name"] == MPY_DIR:
+                check_mpy(obj["files"])
             
     return manifest
 
 
-# new_manifest = update(fn)
-manifest = rebuild_manifest("manifest_initial.json")
-save_json("manifest.json",manifest)
+if len(sys.argv) > 1 and sys.argv[1] == "--mpy":
+    compile_mpy(sys.argv[2:])
+else:
+    # new_manifest = update(fn)
+    manifest = rebuild_manifest("manifest_initial.json")
+    save_json("manifest.json",manifest)
     
\ No newline at end of file
@@ -0,0 +1,171 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Compare importing PSOS modules from .py source and from
+    precompiled .mpy files under the MicroPython unix port.
+
+    The modules in base and lib are compiled with mpy-cross into a
+    temporary directory. Then a MicroPython process with a heap the
+    size of an ESP32's imports every module that can be imported
+    on the unix port (hardware modules such as svc_wifi fail and
+    are skipped):
+      - source: sys.path is base and lib
+      - mpy:    the .mpy directory is first on sys.path, as done
+                by main.py on a device with "mpy" set in config.json
+
+    Prints, for each mode, the total import time, the heap used
+    by the imported modules, the free heap and the largest free
+    block after importing, and the modules with the largest change.
+
+    Needs micropython (the unix port) and mpy-cross on the PATH,
+    or given with the MICROPYTHON and MPY_CROSS environment variables.
+    mpy-cross must be the version matching the micropython binary,
+    installed with pip install mpy-cross==<micropython version>.
+
+    Usage:
+        python host/bench_boot_mpy.py [heap size in bytes] [runs]
+'''
+
+import sys
+import os
+import glob
+import json
+import shutil
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC  = [os.path.join(ROOT,"base"),os.path.join(ROOT,"lib")]
+
+MICROPYTHON = os.environ.get("MICROPYTHON","micropython")
+MPY_CROSS   = os.environ.get("MPY_CROSS","mpy-cross")
+
+# run under micropython. PATHS and MODULES are filled in.
+_SCRIPT = '''
+import gc
+import sys
+import time
+import json
+
+sys.path[:0] = PATHS
+
+def max_free_block():
+    lo = 0
+    hi = gc.mem_free()
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        try:
+            b = bytearray(mid)
+            b = None
+            lo = mid
+        except MemoryError:
+            hi = mid - 1
+    return lo
+
+res = []
+gc.collect()
+free0 = gc.mem_free()
+for m in MODULES:
+    gc.collect()
+    f = gc.mem_free()
+    t = time.ticks_us()
+    try:
+        __import__(m)
+        ok = True
+    except BaseException:
+        ok = False
+    t = time.ticks_diff(time.ticks_us(),t)
+    gc.collect()
+    res.append([m,ok,t,f - gc.mem_free()])
+
+gc.collect()
+free = gc.mem_free()
+print("RESULT " + json.dumps({"mods":res,"used":free0 - free,
+                              "free":free,"block":max_free_block()}))
+'''
+
+def modules():
+    mods = []
+    for d in SRC:
+        for fn in sorted(glob.glob(os.path.join(d,"*.py"))):
+            mods.append(os.path.basename(fn)[:-3])
+    return mods
+
+def compile_mpy(out):
+    failed = []
+    for d in SRC:
+        for fn in sorted(glob.glob(os.path.join(d,"*.py"))):
+            name = os.path.basename(fn)[:-3] + ".mpy"
+            r = subprocess.run([MPY_CROSS,"-o",os.path.join(out,name),fn],
+                               capture_output=True,text=True)
+            if r.returncode != 0:
+                failed.append(os.path.basename(fn))
+    return failed
+
+def run(paths,mods,heap,tmp):
+    script = _SCRIPT.replace("PATHS",repr(paths)).replace("MODULES",repr(mods))
+    fn = os.path.join(tmp,"boot_bench.py")
+    with open(fn,"w") as f:
+        f.write(script)
+
+    r = subprocess.run([MICROPYTHON,"-X","heapsize={}".format(heap),fn],
+                       capture_output=True,text=True,cwd=tmp)
+    for line in r.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[7:])
+    raise RuntimeError("micropython failed: " + r.stderr[-500:])
+
+def main(heap=111168,runs=3):
+    for tool in (MICROPYTHON,MPY_CROSS):
+        if shutil.which(tool) == None:
+            print("{} not found".format(tool))
+            sys.exit(2)
+
+    tmp = tempfile.mkdtemp()
+    mpy = os.path.join(tmp,"mpy")
+    os.mkdir(mpy)
+    try:
+        failed = compile_mpy(mpy)
+        if failed:
+            print("not compiled:",", ".join(failed))
+
+        mods = modules()
+        results = {}
+        for mode,paths in (("source",SRC),("mpy",[mpy] + SRC)):
+            best = None
+            for i in range(runs):
+                r = run(paths,mods,heap,tmp)
+                t = sum(m[2] for m in r["mods"] if m[1])
+                if best == None or t < best[0]:
+                    best = (t,r)
+            results[mode] = best
+    finally:
+        shutil.rmtree(tmp)
+
+    # only compare modules imported in both modes
+    ok = set(m[0] for m in results["source"][1]["mods"] if m[1])
+    ok &= set(m[0] for m in results["mpy"][1]["mods"] if m[1])
+    print("{} of {} modules import on the unix port, heap {}".format(len(ok),len(mods),heap))
+    print()
+    print("{:8} {:>10} {:>10} {:>10} {:>10}".format("mode","import ms","heap used","free","max block"))
+    for mode in ("source","mpy"):
+        r = results[mode][1]
+        t = sum(m[2] for m in r["mods"] if m[0] in ok)
+        print("{:8} {:10.1f} {:10} {:10} {:10}".format(mode,t/1000,r["used"],r["free"],r["block"]))
+
+    src = {m[0]:m for m in results["source"][1]["mods"]}
+    cmp = []
+    for m in results["mpy"][1]["mods"]:
+        if m[0] in ok:
+            s = src[m[0]]
+            cmp.append((s[2]-m[2],m[0],s[2],m[2],s[3],m[3]))
+    cmp.sort(reverse=True)
+
+    print()
+    print("{:22} {:>9} {:>9} {:>9} {:>9}".format("module","src us","mpy us","src heap","mpy heap"))
+    for d,name,ts,tm,hs,hm in cmp[:10]:
+        print("{:22} {:9} {:9} {:9} {:9}".format(name,ts,tm,hs,hm))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
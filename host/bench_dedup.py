@@ -0,0 +1,97 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Benchmark duplicate suppression at a given message rate
+    using simulated time:
+      - legacy: the original svc_mqtt._in_buff list of [ticks,topic,msg]
+      - cache:  psos_dedup.DedupCache
+
+    Every 4th message is a duplicate of a message received 50ms earlier,
+    as happens with the Mosquitto/HiveMQ bridge. The cache must
+    suppress as many duplicates as the list did.
+
+    Usage:
+        python host/bench_dedup.py [messages per second] [seconds] [cache size]
+'''
+
+import sys
+import time
+
+import upy_compat
+upy_compat.install()
+
+from psos_dedup import DedupCache
+
+_now = [0]
+def fake_ticks_ms():
+    return _now[0]
+
+# the original svc_mqtt._in_buff
+class LegacyBuff:
+    def __init__(self):
+        self._msg_buff = []
+        self.dups = 0
+
+    def is_dup(self,topic,msg):
+        t = time.ticks_ms()
+        while len(self._msg_buff) > 0:
+            if time.ticks_diff(t,self._msg_buff[0][0]) > 3000:
+                self._msg_buff.pop(0)
+            else:
+                break
+
+        for i in range(len(self._msg_buff)):
+            b = self._msg_buff[i]
+            if b[1] == topic and b[2] == msg:
+                self.dups += 1
+                return True
+
+        self._msg_buff.append([t,topic,msg])
+        return False
+
+def build_msgs(rate,secs):
+    msgs = []
+    step = 1000 / rate
+    lag = int(50/step) + 1
+    for i in range(rate*secs):
+        t = int(i*step)
+        if i % 4 == 3 and i >= lag + 4:
+            # duplicate of the message received ~50ms earlier
+            j = i - lag
+            while j % 4 == 3:
+                j -= 1
+            msgs.append((t,msgs[j][1],msgs[j][2]))
+        else:
+            topic = "d{:02d}/dht".format(i % 20).encode()
+            msg = '{{"temp": "{}", "seq": {}}}'.format(60 + i % 30, i).encode()
+            msgs.append((t,topic,msg))
+    return msgs
+
+def run(cache,msgs):
+    start = time.perf_counter()
+    for t,topic,msg in msgs:
+        _now[0] = t
+        cache.is_dup(topic,msg)
+    return time.perf_counter() - start
+
+def main(rate=1000,secs=10,size=64):
+    msgs = build_msgs(rate,secs)
+    expected = len(msgs) - len(set(msgs[i][1:] for i in range(len(msgs))))
+
+    time.ticks_ms = fake_ticks_ms
+
+    legacy = LegacyBuff()
+    t_legacy = run(legacy,msgs)
+
+    cache = DedupCache(3000,size)
+    t_cache = run(cache,msgs)
+
+    print("{} msgs/s for {} s, {} duplicates sent".format(rate,secs,expected))
+    print("{:8} {:>10} {:>10} {:>12}".format("impl","us/msg","suppressed","entries held"))
+    print("{:8} {:10.2f} {:10} {:12}".format("legacy",t_legacy/len(msgs)*1000000,legacy.dups,len(legacy._msg_buff)))
+    print("{:8} {:10.2f} {:10} {:12}".format("cache",t_cache/len(msgs)*1000000,cache.dups,cache.size))
+    assert cache.dups == legacy.dups, "cache suppressed {} of {}".format(cache.dups,legacy.dups)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    main(*args)
@@ -0,0 +1,84 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Compare PsosParms.get_parm for a templated parm such as
+    svc_dht's "pub_upd": "{dev}/dht", read on every publish:
+      - legacy:   the original get_parm, formatted on every call
+      - cached:   psos_parms.PsosParms, formatted on the first call
+      - compiled: psos_parms.PsosParms after compile()
+    and for a plain parm, to check it is no slower.
+
+    Reports time per call and the heap allocated per call.
+
+    Usage:
+        python host/bench_get_parm.py [calls]
+'''
+
+import sys
+import time
+import tracemalloc
+
+import upy_compat
+upy_compat.install()
+
+from psos_parms import PsosParms
+
+# the original PsosParms.get_parm
+class LegacyParms(PsosParms):
+    def get_parm(self,key,parm_default=None):
+        try:
+            r = self._parms[key]
+            if type(r) == str and '{'in r and not key in self.no_fmt:
+                return r.format(**self._defaults)
+            return r
+        except KeyError:
+            pass
+        try:
+            return self._defaults[key]
+        except KeyError:
+            pass
+        try:
+            return self.config[key]
+        except KeyError:
+            pass
+        return parm_default
+
+def build(cls,compile=False):
+    defaults = {"dev":"e02","mqtt_prefix":"emp","lcd":"lcd","services":{}}
+    parms = {"name":"temp","module":"svc_dht","dht11_pin":5,
+             "subscr_upd":"{dev}/dht/upd","pub_upd":"{dev}/dht"}
+    p = cls(parms,defaults,{"device":"e02"})
+    if compile:
+        p.compile()
+    return p
+
+def run(p,key,n):
+    get_parm = p.get_parm
+    get_parm(key)
+
+    t = time.perf_counter()
+    for i in range(n):
+        get_parm(key)
+    t = time.perf_counter() - t
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in range(100):
+        r = get_parm(key)
+    alloc = (tracemalloc.get_traced_memory()[1] - base) / 100
+    tracemalloc.stop()
+
+    return t/n*1000000000,alloc
+
+def main(n=200000):
+    print("{:9} {:10} {:>9} {:>12}".format("parms","key","ns/call","bytes/call"))
+    for name,cls,comp in (("legacy",LegacyParms,False),
+                          ("cached",PsosParms,False),
+                          ("compiled",PsosParms,True)):
+        for key in ("pub_upd","dht11_pin"):
+            ns,alloc = run(build(cls,comp),key,n)
+            print("{:9} {:10} {:9.0f} {:12.1f}".format(name,key,ns,alloc))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
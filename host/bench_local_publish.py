@@ -0,0 +1,123 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Compare local delivery of published messages:
+      - legacy: the original svc_mqtt local path, payload converted
+                with to_bytes (ujson.dumps for a dict or list),
+                to_str again in mqtt_callback, a list built for each
+                subscriber and ujson.loads in SvcMsg.load_subscr
+      - local:  svc_mqtt.local_publish, the payload object is put
+                on the subscriber queues in a shared PsosMsg
+
+    One pass of the gyro -> menu -> lcd chain is:
+      - svc_gyro publishes the hourglass to local/{dev}/lcd
+      - svc_gyro publishes "enter" to local/{dev}/menu
+      - svc_menu publishes the menu text to local/{dev}/lcd
+        as a svc_lcd_msg payload ["clear",{"msg":...}]
+    Each message is read by the subscriber with SvcMsg.load_subscr
+    as svc_menu and svc_lcd do.
+
+    Reports time per chain, JSON dumps/loads calls per chain and
+    the peak heap used while the chain is delivered.
+
+    Usage:
+        python host/bench_local_publish.py [chain count]
+'''
+
+import sys
+import time
+import tracemalloc
+
+import upy_compat
+upy_compat.install()
+
+import ujson
+import queue
+from psos_util import to_str, to_bytes
+from psos_topic_tree import TopicTree
+from psos_subscription import Subscription
+from svc_msg import SvcMsg
+from svc_lcd_msg import SvcLcdMsg
+
+# count calls to ujson.dumps and ujson.loads
+calls = {"dumps":0, "loads":0}
+_dumps = ujson.dumps
+_loads = ujson.loads
+def _count_dumps(o):
+    calls["dumps"] += 1
+    return _dumps(o)
+def _count_loads(s):
+    calls["loads"] += 1
+    return _loads(s)
+ujson.dumps = _count_dumps
+ujson.loads = _count_loads
+
+DEV = "e02"
+
+def build():
+    tree = TopicTree()
+    q_menu = queue.Queue()
+    q_lcd  = queue.Queue()
+    tree.add(Subscription(DEV+"/menu",q_menu))
+    tree.add(Subscription(DEV+"/lcd",q_lcd))
+    return tree,q_menu,q_lcd
+
+# the original svc_mqtt.publish for local/ topics
+def legacy_publish(tree,topic,payload):
+    topic = to_bytes(topic[6:])
+    payload = to_bytes(payload)
+    t = to_str(topic)
+    m = to_str(payload)
+    for sub in tree.match(t.split('/')):
+        sub._queue.put_nowait([to_str(sub._filter),t,m])
+
+def local_publish(tree,topic,payload):
+    t = topic[6:]
+    tree.put_match(t.split('/'),t,payload)
+
+def chain(publish,tree,q_menu,q_lcd,msg,hg,text):
+    publish(tree,"local/"+DEV+"/lcd",hg)
+    msg.load_subscr(q_lcd.get_nowait())
+
+    publish(tree,"local/"+DEV+"/menu","enter")
+    msg.load_subscr(q_menu.get_nowait())
+
+    publish(tree,"local/"+DEV+"/lcd",text)
+    msg.load_subscr(q_lcd.get_nowait())
+    return msg.get_payload()
+
+def run(publish,n):
+    tree,q_menu,q_lcd = build()
+    msg  = SvcMsg()
+    hg   = SvcLcdMsg().dsp_hg().get_payload()
+    text = ["clear",{"msg":"SHOW TEMP"}]
+
+    # check the lcd receives the same payload either way
+    out = chain(publish,tree,q_menu,q_lcd,msg,hg,text)
+    assert out == text, out
+
+    calls["dumps"] = calls["loads"] = 0
+    t = time.perf_counter()
+    for i in range(n):
+        chain(publish,tree,q_menu,q_lcd,msg,hg,text)
+    t = time.perf_counter() - t
+    dumps = calls["dumps"] / n
+    loads = calls["loads"] / n
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    chain(publish,tree,q_menu,q_lcd,msg,hg,text)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return t/n*1000000,dumps,loads,peak
+
+def main(n=20000):
+    print("{:8} {:>10} {:>8} {:>8} {:>11}".format("path","us/chain","dumps","loads","heap peak"))
+    for name,publish in (("legacy",legacy_publish),("local",local_publish)):
+        us,dumps,loads,peak = run(publish,n)
+        print("{:8} {:10.2f} {:8.1f} {:8.1f} {:11}".format(name,us,dumps,loads,peak))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
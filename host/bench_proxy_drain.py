@@ -0,0 +1,147 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Time an svc_mqtt_proxy_client draining a backlog over loopback,
+    with each proxy protocol version and with and without the
+    "batch" and "bin" options (see svc_mqtt_proxy_server.py):
+      - rcv: n messages queued for the client on the server,
+             until the client has delivered all of them
+      - pub: n publishes queued on the client, until the
+             server has published all of them
+    and the bytes sent by the client (up) and server (down).
+
+    The server and client run on one device booted by
+    host/psos_sim.py, talking to each other over loopback. Version 1 polls every 100ms, so its rcv
+    time includes the wait for the next poll.
+
+    Usage:
+        python host/bench_proxy_drain.py [messages]
+'''
+
+import sys
+import time
+import socket
+import asyncio
+
+from psos_sim import Sim
+
+MODES = (("v1",1,False,False),("v1 batch",1,True,False),("v1 bin",1,True,True),
+         ("v2",2,False,False),("v2 batch",2,True,False),("v2 bin",2,True,True))
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1",0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def parms(port,proto,batch,bin):
+    return {"name": "bench", "main": "psos_main",
+            "defaults": {"dev": "sim"},
+            "services": [
+                {"name": "wifi", "module": "svc_wifi", "disconnect": False},
+                {"name": "mqtt", "module": "svc_mqtt", "broker": "sim", "mode": "async"},
+                {"name": "proxy", "module": "svc_mqtt_proxy_server",
+                 "host": "127.0.0.1", "port": port, "lazy": True},
+                {"name": "client", "module": "svc_mqtt_proxy_client",
+                 "server": "127.0.0.1", "port": port,
+                 "proto": proto, "batch": batch, "bin": bin, "lazy": True}]}
+
+async def wait_until(cond,timeout_s=30):
+    t = time.perf_counter()
+    while not cond():
+        if time.perf_counter() - t > timeout_s:
+            raise RuntimeError("timeout")
+        await asyncio.sleep(0)
+
+async def bench(n,proto,batch,bin):
+    import queue
+    sim = Sim(parms(free_port(),proto,batch,bin))
+    await sim.boot()
+
+    # the server is started here so its client
+    # connections can be wrapped to count the bytes
+    server = sim.defaults["lazy"]["proxy"].load()
+    up   = [0]
+    down = [0]
+    run_client = server.run_client
+    async def count_bytes(sreader,swriter):
+        write = swriter.write
+        def count_write(buf):
+            down[0] += len(buf)
+            write(buf)
+        swriter.write = count_write
+        for name in ("readline","readexactly"):
+            def counter(read):
+                async def count_read(*args):
+                    b = await read(*args)
+                    up[0] += len(b)
+                    return b
+                return count_read
+            setattr(sreader,name,counter(getattr(sreader,name)))
+        await run_client(sreader,swriter)
+    server.run_client = count_bytes
+
+    # the client is lazy so it can be started once the server
+    # is listening, its retries would block the server
+    await wait_until(lambda: hasattr(server,"server"))
+    client = sim.defaults["lazy"]["client"].load()
+    await wait_until(lambda: len(server.users) > 0)
+
+    # count the publishes done by the server
+    pubs   = [0]
+    do_publish = server.do_publish
+    async def count_pubs(cid,msg):
+        pubs[0] += 1
+        return await do_publish(cid,msg)
+    server.do_publish = count_pubs
+
+    q = queue.Queue()
+    await client.subscribe("bench/rcv",q)
+    mqtt = sim.services["mqtt"]
+    await wait_until(lambda: "bench/rcv" in server.mux.fanouts)
+    await asyncio.sleep(0.3)
+
+    res = {}
+    payload = {"temp": 71, "hum": 40, "dev": "sim"}
+
+    # a backlog on the server
+    u,d = up[0],down[0]
+    for i in range(n):
+        payload["seq"] = i
+        mqtt.local_publish("bench/rcv",dict(payload))
+    t = time.perf_counter()
+    await wait_until(lambda: q.qsize() >= n)
+    res["rcv_ms"] = (time.perf_counter() - t)*1000
+    res["rcv_up"]   = up[0] - u
+    res["rcv_down"] = down[0] - d
+
+    # a backlog on the client
+    u,d = up[0],down[0]
+    t = time.perf_counter()
+    for i in range(n):
+        payload["seq"] = i
+        await client.publish("bench/pub",dict(payload))
+    await wait_until(lambda: pubs[0] >= n)
+    res["pub_ms"] = (time.perf_counter() - t)*1000
+    await asyncio.sleep(0.05)
+    res["pub_up"]   = up[0] - u
+    res["pub_down"] = down[0] - d
+
+    await sim.stop()
+    if sim.errors:
+        res["error"] = sim.errors[0]
+    return res
+
+async def run(n):
+    print("{:9} {:>8} {:>7} {:>7} {:>8} {:>7} {:>7}".format(
+          "mode","rcv ms","up","down","pub ms","up","down"))
+    for name,proto,batch,bin in MODES:
+        r = await bench(n,proto,batch,bin)
+        print("{:9} {:8.1f} {:7} {:7} {:8.1f} {:7} {:7}  {}".format(
+              name,r["rcv_ms"],r["rcv_up"],r["rcv_down"],
+              r["pub_ms"],r["pub_up"],r["pub_down"],r.get("error","")))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    asyncio.run(run(n))
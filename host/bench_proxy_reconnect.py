@@ -0,0 +1,119 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    The server drops an svc_mqtt_proxy_client's connection, as a
+    LAN blip would, and n messages are published for the client
+    and n by it straight after. Measured with each protocol
+    version, with the server keeping sessions ("grace_s") and not
+    (see svc_mqtt_proxy_server.py):
+      - recon ms: until the client is connected again
+      - rx:       messages for the client it received
+      - tx:       messages by the client the server published
+      - subs:     the client's entries for its filter on the server,
+                  1 if its subscription was not duplicated
+      - resets:   device resets, which is how the client recovered
+                  before it could reconnect
+
+    The server and client run on one device booted by
+    host/psos_sim.py, as in host/bench_proxy_drain.py. The boot
+    time of that device is printed for comparison with a reset.
+
+    Usage:
+        python host/bench_proxy_reconnect.py [messages]
+'''
+
+import sys
+import time
+import socket
+import asyncio
+
+from psos_sim import Sim
+
+MODES = (("v1",1,False,30),("v2",2,False,30),("v2 bin",2,True,30),
+         ("v2 bin",2,True,0))
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1",0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def parms(port,proto,bin,grace_s):
+    return {"name": "bench", "main": "psos_main",
+            "defaults": {"dev": "sim"},
+            "services": [
+                {"name": "wifi", "module": "svc_wifi", "disconnect": False},
+                {"name": "mqtt", "module": "svc_mqtt", "broker": "sim", "mode": "async"},
+                {"name": "proxy", "module": "svc_mqtt_proxy_server",
+                 "host": "127.0.0.1", "port": port, "grace_s": grace_s, "lazy": True},
+                {"name": "client", "module": "svc_mqtt_proxy_client",
+                 "server": "127.0.0.1", "port": port,
+                 "proto": proto, "bin": bin, "lazy": True}]}
+
+async def wait_until(cond,timeout_s=5):
+    t = time.perf_counter()
+    while not cond():
+        if time.perf_counter() - t > timeout_s:
+            return False
+        await asyncio.sleep(0.001)
+    return True
+
+async def bench(n,proto,bin,grace_s):
+    import queue
+    sim = Sim(parms(free_port(),proto,bin,grace_s))
+    boot_ms = await sim.boot()
+    import machine
+
+    # the client is started once the server is listening
+    server = sim.defaults["lazy"]["proxy"].load()
+    await wait_until(lambda: hasattr(server,"server"))
+    client = sim.defaults["lazy"]["client"].load()
+    await wait_until(lambda: len(server.users) > 0)
+    cid = list(server.users)[0]
+
+    pubs = [0]
+    do_publish = server.do_publish
+    async def count_pubs(cid,msg):
+        if msg["topic"] == "bench/tx":
+            pubs[0] += 1
+        return await do_publish(cid,msg)
+    server.do_publish = count_pubs
+
+    q = queue.Queue()
+    await client.subscribe("bench/rx",q)
+    mqtt = sim.services["mqtt"]
+    await wait_until(lambda: "bench/rx" in server.mux.fanouts)
+    await asyncio.sleep(0.2)
+
+    res = {"boot_ms": boot_ms}
+    await server.evict(cid,"bench")
+    t = time.perf_counter()
+    for i in range(n):
+        mqtt.local_publish("bench/rx",{"seq": i})
+        await client.publish("bench/tx",{"seq": i})
+
+    await wait_until(lambda: client.reconnects > 0 and cid in server.users)
+    res["recon_ms"] = (time.perf_counter() - t)*1000
+    await wait_until(lambda: q.qsize() >= n and pubs[0] >= n,1)
+    res["rx"] = q.qsize()
+    res["tx"] = pubs[0]
+    f = server.mux.fanouts.get("bench/rx")
+    res["subs"] = 0 if f == None else len(f.queues)
+    res["resets"] = len(machine.resets)
+
+    await sim.stop()
+    return res
+
+async def run(n):
+    print("{:7} {:>5} {:>9} {:>5} {:>5} {:>5} {:>7}".format(
+          "mode","grace","recon ms","rx","tx","subs","resets"))
+    for name,proto,bin,grace_s in MODES:
+        r = await bench(n,proto,bin,grace_s)
+        print("{:7} {:5} {:9.1f} {:5} {:5} {:5} {:7}".format(
+              name,grace_s,r["recon_ms"],r["rx"],r["tx"],r["subs"],r["resets"]))
+    print("boot ms {:.0f}".format(r["boot_ms"]))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    asyncio.run(run(n))
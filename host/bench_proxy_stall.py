@@ -0,0 +1,142 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    A client of svc_mqtt_proxy_server that stops reading, with
+    the server's queue limits off and with each drop policy
+    (see svc_mqtt_proxy_server.py):
+      - queued: messages and bytes held for the client after
+                n messages are published for it, and drops
+      - recon:  ms until a new connection with the client's
+                cid is answered, the old one is disconnected
+      - stall:  ms until the new connection, which doesn't read
+                either, is disconnected for stalling ("-" if not
+                within stall_s + 2 seconds)
+
+    The client is a raw socket asking for version 2 with 8
+    credits, so the messages it doesn't take wait on the server.
+    Messages are published on 10 topics. The server runs on a
+    device booted by host/psos_sim.py.
+
+    Usage:
+        python host/bench_proxy_stall.py [messages]
+'''
+
+import sys
+import json
+import time
+import socket
+import asyncio
+
+from psos_sim import Sim
+
+STALL_S = 2
+
+MODES = (("unbounded", {"max_q": 0, "max_bytes": 0, "stall_s": 0}),
+         ("oldest",    {"stall_s": STALL_S}),
+         ("newest",    {"stall_s": STALL_S, "policy": "newest"}),
+         ("conflate",  {"stall_s": STALL_S, "policy": "conflate"}))
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1",0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def parms(port,srv):
+    proxy = {"name": "proxy", "module": "svc_mqtt_proxy_server",
+             "host": "127.0.0.1", "port": port, "lazy": True}
+    proxy.update(srv)
+    return {"name": "bench", "main": "psos_main",
+            "defaults": {"dev": "sim"},
+            "services": [
+                {"name": "wifi", "module": "svc_wifi", "disconnect": False},
+                {"name": "mqtt", "module": "svc_mqtt", "broker": "sim", "mode": "async"},
+                proxy]}
+
+async def wait_until(cond,timeout_s=30):
+    t = time.perf_counter()
+    while not cond():
+        if time.perf_counter() - t > timeout_s:
+            raise RuntimeError("timeout")
+        await asyncio.sleep(0.001)
+
+async def request(r,w,msg):
+    w.write((json.dumps(msg)+"\n").encode())
+    await w.drain()
+    return json.loads(await r.readline())
+
+async def connect(port):
+    r,w = await asyncio.open_connection("127.0.0.1",port)
+    await request(r,w,{"func":"con", "cid":"stall", "ver":2,
+                       "opts":["credit"], "credit":8})
+    return r,w
+
+# ms until the server closes the connection
+async def closed_ms(r,timeout_s):
+    t = time.perf_counter()
+    try:
+        while await asyncio.wait_for(r.read(4096),timeout_s) != b"":
+            pass
+    except asyncio.TimeoutError:
+        return None
+    return (time.perf_counter() - t)*1000
+
+def publish(mqtt,n):
+    payload = {"temp": 71, "hum": 40, "dev": "sim"}
+    for i in range(n):
+        payload["seq"] = i
+        mqtt.local_publish("stall/t{}".format(i % 10),dict(payload))
+
+async def bench(n,srv):
+    port = free_port()
+    sim = Sim(parms(port,srv))
+    await sim.boot()
+    server = sim.defaults["lazy"]["proxy"].load()
+    mqtt = sim.services["mqtt"]
+    await wait_until(lambda: hasattr(server,"server"))
+
+    res = {}
+    r,w = await connect(port)
+    await request(r,w,{"func":"sub", "topic":"stall/#", "id":1})
+    await wait_until(lambda: "stall/#" in server.mux.fanouts)
+
+    publish(mqtt,n)
+    await asyncio.sleep(0.1)
+    queued,size,drops = server.users["stall"].stats()[:3]
+    res["queued"] = queued
+    res["bytes"]  = size
+    res["drops"]  = drops
+
+    # the same client connecting again
+    t = time.perf_counter()
+    r2,w2 = await connect(port)
+    res["recon_ms"] = (time.perf_counter() - t)*1000
+    await closed_ms(r,1)
+    w.close()
+
+    # and stalling
+    await request(r2,w2,{"func":"sub", "topic":"stall/#", "id":1})
+    await wait_until(lambda: "stall/#" in server.mux.fanouts)
+    publish(mqtt,n)
+    res["stall_ms"] = await closed_ms(r2,STALL_S+2)
+    w2.close()
+
+    await sim.stop()
+    if sim.errors:
+        res["error"] = sim.errors[0]
+    return res
+
+async def run(n):
+    print("{:10} {:>7} {:>8} {:>7} {:>9} {:>9}".format(
+          "policy","queued","bytes","drops","recon ms","stall ms"))
+    for name,srv in MODES:
+        r = await bench(n,srv)
+        stall = "-" if r["stall_ms"] == None else "{:.0f}".format(r["stall_ms"])
+        print("{:10} {:7} {:8} {:7} {:9.1f} {:>9}  {}".format(
+              name,r["queued"],r["bytes"],r["drops"],r["recon_ms"],stall,
+              r.get("error","")))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    asyncio.run(run(n))
@@ -0,0 +1,294 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    PSOS throughput benchmarks, run on devices booted by
+    host/psos_sim.py:
+      - local:   messages/s published to local/ topics and
+                 delivered by svc_mqtt to a subscriber
+      - pipe:    messages/s transformed by svc_pipe
+      - log:     publishes/s appended by svc_mqtt_log,
+                 with and without the index file
+      - lcd:     LCD commands/s processed by svc_lcd with the
+                 LCD1602 driver, and I2C bytes written per message
+      - boot:    ms to boot each parms file in devices/
+
+    The boot bench covers the ESP8266 (d01-d03), ESP32 (e01-e05,
+    emp and c01) and RP2040 (r01, r02) parms files and the git
+    update parms, which are booted with the config svc_git_rst
+    leaves for them and reset once the update is done, as on a
+    device. Files the sim can't boot are skipped and listed with
+    the reason, not put in the table:
+      - picow_oled and picow_test are not valid JSON
+      - r03 uses svc_spi, which doesn't compile
+      - upd_oled uses svc_git, which is not in base
+    d01-d03 connect through svc_mqtt_proxy_client. The sim runs no
+    proxy server, so they boot but are put in the table with the
+    connection error, marked "no proxy server".
+
+    Results are printed as a table and, with --out, written as JSON:
+      {"python": "3.11.4", "results": {"local": {"msgs_per_s": ...}, ...},
+       "boot": {"e01_psos_parms.json": {"boot_ms": ..., "services": ..., "error": ...}},
+       "boot_skipped": {"r03_parms.json": "SyntaxError(...)"}}
+
+    With --baseline the results are compared with a previous
+    JSON file. A "_per_s" metric lower, or a "_ms" metric higher,
+    than the baseline by more than the tolerance (default 0.2, 20%)
+    is reported and the exit status is 1.
+
+    Usage:
+        python host/bench_psos.py [-n messages] [--out results.json]
+                                  [--baseline results.json] [--tolerance 0.2]
+                                  [--skip-boot]
+'''
+
+import sys
+import os
+import glob
+import json
+import time
+import asyncio
+import platform
+import argparse
+
+from psos_sim import Sim, ROOT
+
+DEV = "sim"
+
+def parms(*services):
+    return {"name": "bench", "main": "psos_main",
+            "defaults": {"dev": DEV},
+            "services": list(services)}
+
+# mqtt without wifi delivers every publish locally
+MQTT = {"name": "mqtt", "module": "svc_mqtt"}
+
+# count messages arriving on a topic filter
+async def counter(mqtt,topic_filter):
+    import queue
+    q = queue.Queue()
+    got = [0]
+    await mqtt.subscribe(topic_filter,q)
+
+    async def count():
+        while True:
+            await q.get()
+            got[0] += 1
+
+    return got,asyncio.get_running_loop().create_task(count())
+
+async def wait_for(got,n,timeout_s=60):
+    t = time.perf_counter()
+    while got[0] < n and time.perf_counter() - t < timeout_s:
+        await asyncio.sleep(0)
+
+async def bench_local(n):
+    sim = Sim(parms(MQTT),broker=False)
+    await sim.boot()
+    mqtt = sim.services["mqtt"]
+    got,task = await counter(mqtt,DEV+"/bench/#")
+
+    payload = {"temp": 71, "hum": 40, "dev": DEV}
+    t = time.perf_counter()
+    for i in range(n):
+        await mqtt.publish("local/"+DEV+"/bench/t",payload)
+    await wait_for(got,n)
+    t = time.perf_counter() - t
+
+    task.cancel()
+    await sim.stop()
+    return {"msgs_per_s": got[0]/t, "delivered": got[0]}
+
+async def bench_pipe(n):
+    sim = Sim(parms(MQTT,
+                    {"name": "pipe", "module": "svc_pipe",
+                     "subscr_in": "{dev}/pipe/in", "pub_out": "local/{dev}/pipe/out",
+                     "format": "['clear',{{'msg':'TEMP: {temp}\nHUM: {hum}'}}]"}),
+              broker=False)
+    await sim.boot()
+    mqtt = sim.services["mqtt"]
+    got,task = await counter(mqtt,DEV+"/pipe/out")
+
+    payload = {"temp": 71, "hum": 40, "dev": DEV}
+    t = time.perf_counter()
+    for i in range(n):
+        await mqtt.publish("local/"+DEV+"/pipe/in",payload)
+    await wait_for(got,n)
+    t = time.perf_counter() - t
+
+    task.cancel()
+    await sim.stop()
+    return {"msgs_per_s": got[0]/t, "delivered": got[0]}
+
+async def bench_log(n,idx):
+    svc = {"name": "mqtt", "module": "svc_mqtt_log",
+           "log_fn": "mqtt_log.txt", "print": False}
+    if idx:
+        svc["idx_fn"] = "mqtt_log.idx"
+    sim = Sim(parms(svc),broker=False)
+    await sim.boot()
+    log = sim.services["mqtt"]
+
+    payload = {"temp": 71, "hum": 40, "dev": DEV}
+    t = time.perf_counter()
+    for i in range(n):
+        await log.publish(DEV+"/dht",payload)
+    t = time.perf_counter() - t
+    size = os.path.getsize("mqtt_log.txt")
+
+    await sim.stop()
+    return {"appends_per_s": n/t, "bytes": size}
+
+async def bench_lcd(n):
+    import machine
+    sim = Sim(parms(MQTT,
+                    {"name": "i2c0", "module": "svc_i2c"},
+                    {"name": "lcd", "module": "svc_lcd", "i2c": "i2c0",
+                     "i2c_addr": "0x27", "lcd_col_cnt": 20, "lcd_row_cnt": 4,
+                     "timeout": 0, "max_q": 0, "subscr_msg": "{dev}/lcd"}),
+              broker=False)
+    await sim.boot()
+    mqtt = sim.services["mqtt"]
+    lcd  = sim.services["lcd"]
+
+    # count messages processed by the lcd
+    got = [0]
+    process_msg = lcd.process_msg
+    def count(msg):
+        process_msg(msg)
+        got[0] += 1
+    lcd.process_msg = count
+
+    await asyncio.sleep(0.05)
+    payload = ["clear",{"msg":"TEMP: 71\nHUM: 40%"},{"cursor":[0,3]},{"msg":"DEV: "+DEV}]
+    writes = machine.i2c_bytes
+    t = time.perf_counter()
+    for i in range(n):
+        await mqtt.publish("local/"+DEV+"/lcd",payload)
+    await wait_for(got,n)
+    t = time.perf_counter() - t
+    writes = machine.i2c_bytes - writes
+
+    await sim.stop()
+    return {"msgs_per_s": got[0]/t, "cmds_per_s": got[0]*len(payload)/t,
+            "i2c_bytes_per_msg": writes/max(got[0],1)}
+
+# config.json as svc_git_rst leaves it for the update parms
+UPD_CONFIG = {"o_fn_parms": "sim_parms.json", "upd_sha": "main"}
+
+def uses(fn,module):
+    with open(fn) as f:
+        return '"{}"'.format(module) in f.read()
+
+# returns the results for the files booted
+# and the reason each other file was skipped
+async def bench_boot():
+    res  = {}
+    skip = {}
+    for fn in sorted(glob.glob(os.path.join(ROOT,"devices","*parms*.json"))):
+        name = os.path.basename(fn)
+        upd  = uses(fn,"svc_git_upd")
+        sim  = Sim(fn,UPD_CONFIG if upd else None)
+        try:
+            boot_ms = await sim.boot()
+            if boot_ms != None:
+                await sim.run(0.2)
+        except Exception as e:
+            boot_ms = None
+            sim.errors.append(repr(e))
+        await sim.stop()
+
+        if boot_ms == None:
+            skip[name] = sim.errors[0]
+            continue
+
+        errors = sim.errors
+        if upd:
+            errors = [e for e in errors if not "SimReset" in e and not e.endswith("resets")]
+        error = errors[0] if len(errors) > 0 else None
+        if error != None and uses(fn,"svc_mqtt_proxy_client"):
+            error = "no proxy server: " + error
+        res[name] = {"boot_ms": boot_ms, "services": len(sim.services),
+                     "error": error}
+    return res,skip
+
+async def run(n,boot):
+    results = {}
+    results["local"]     = await bench_local(n)
+    results["pipe"]      = await bench_pipe(n)
+    results["log"]       = await bench_log(n,False)
+    results["log_idx"]   = await bench_log(n,True)
+    results["lcd"]       = await bench_lcd(max(n//10,1))
+
+    out = {"python" : platform.python_version(),
+           "n"      : n,
+           "results": results }
+    if boot:
+        out["boot"],out["boot_skipped"] = await bench_boot()
+    return out
+
+def show(out):
+    print("{:10} {:18} {:>12}".format("bench","metric","value"))
+    for bench,metrics in out["results"].items():
+        for k,v in metrics.items():
+            print("{:10} {:18} {:12.1f}".format(bench,k,v))
+
+    if "boot" in out:
+        print()
+        print("{:28} {:>8} {:>5}  {}".format("parms","boot ms","svcs","error"))
+        for fn,r in out["boot"].items():
+            print("{:28} {:8.0f} {:5}  {}".format(fn,r["boot_ms"],r["services"],r["error"] or ""))
+
+        if len(out["boot_skipped"]) > 0:
+            print()
+            print("skipped, the sim can't boot:")
+            for fn,e in out["boot_skipped"].items():
+                print("  {:26} {}".format(fn,e))
+
+# metrics worse than the baseline by more than tolerance
+def compare(out,base,tolerance):
+    worse = []
+    cur = dict(out["results"])
+    old = dict(base.get("results",{}))
+    for fn,r in out.get("boot",{}).items():
+        cur["boot:"+fn] = {"boot_ms": r["boot_ms"]}
+    for fn,r in base.get("boot",{}).items():
+        old["boot:"+fn] = {"boot_ms": r["boot_ms"]}
+
+    for bench,metrics in cur.items():
+        for k,v in metrics.items():
+            b = old.get(bench,{}).get(k,None)
+            if v == None or b == None or b == 0:
+                continue
+            change = (v - b) / b
+            if ((k.endswith("_per_s") and change < -tolerance) or
+                (k.endswith("_ms") and change > tolerance)):
+                worse.append([bench,k,b,v,round(change*100,1)])
+    return worse
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n",type=int,default=2000)
+    ap.add_argument("--out")
+    ap.add_argument("--baseline")
+    ap.add_argument("--tolerance",type=float,default=0.2)
+    ap.add_argument("--skip-boot",action="store_true")
+    args = ap.parse_args()
+
+    out = asyncio.run(run(args.n,not args.skip_boot))
+    show(out)
+
+    if args.out:
+        with open(args.out,"w") as f:
+            json.dump(out,f,indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = compare(out,json.load(f),args.tolerance)
+        print()
+        for bench,k,b,v,pct in worse:
+            print("REGRESSION {} {}: {:.1f} -> {:.1f} ({:+}%)".format(bench,k,b,v,pct))
+        print("ok" if len(worse) == 0 else "failed")
+        sys.exit(0 if len(worse) == 0 else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Compare socket writes and time per message for:
+      - legacy:  the original umqtt_simple publish (header, topic
+                 length, topic and payload written separately)
+      - publish: MQTTClient.publish encoding into the send buffer
+      - many:    MQTTClient.publish_many in batches of 10
+
+    Each socket write on a TLS connection becomes a TLS record,
+    so writes/msg is also TLS records/msg.
+
+    Usage:
+        python host/bench_publish.py [message count]
+'''
+
+import sys
+import time
+
+import upy_compat
+upy_compat.install()
+
+import ustruct as struct
+from umqtt_simple import MQTTClient
+
+# socket that counts writes
+class CountSocket:
+    def __init__(self):
+        self.writes = 0
+        self.bytes  = 0
+
+    def write(self,buf,n=None):
+        if n is None:
+            n = len(buf)
+        self.writes += 1
+        self.bytes  += n
+        return n
+
+# publish as done by the original umqtt_simple
+def legacy_publish(sock, topic, msg, retain=False, qos=0):
+    pkt = bytearray(b"\x30\0\0\0")
+    pkt[0] |= qos << 1 | retain
+    sz = 2 + len(topic) + len(msg)
+    i = 1
+    while sz > 0x7F:
+        pkt[i] = (sz & 0x7F) | 0x80
+        sz >>= 7
+        i += 1
+    pkt[i] = sz
+    sock.write(pkt, i + 1)
+    sock.write(struct.pack("!H", len(topic)))
+    sock.write(topic)
+    sock.write(msg)
+
+def main(n=20000):
+    topic = b"e02/dht"
+    msg   = b'{"temp": " 71", "hum": " 40", "dev": "e02"}'
+    results = []
+
+    sock = CountSocket()
+    t = time.perf_counter()
+    for i in range(n):
+        legacy_publish(sock,topic,msg)
+    results.append(("legacy",time.perf_counter()-t,sock))
+
+    client = MQTTClient(b"bench","localhost")
+    client.sock = CountSocket()
+    t = time.perf_counter()
+    for i in range(n):
+        client.publish(topic,msg)
+    results.append(("publish",time.perf_counter()-t,client.sock))
+
+    client.sock = CountSocket()
+    batch = [(topic,msg)] * 10
+    t = time.perf_counter()
+    for i in range(n//10):
+        client.publish_many(batch)
+    results.append(("many",time.perf_counter()-t,client.sock))
+
+    print("{:8} {:>10} {:>10} {:>10}".format("path","us/msg","writes/msg","bytes/msg"))
+    for name,t,sock in results:
+        print("{:8} {:10.3f} {:10.2f} {:10.1f}".format(
+            name, t/n*1000000, sock.writes/n, sock.bytes/n))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
@@ -0,0 +1,131 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Micro benchmark of queue.Queue, a ring buffer, against
+    ListQueue, the list.pop(0) queue it replaced (kept here).
+
+    For each queue class measures:
+      - backlog: put N items then get N items (a subscriber that fell behind)
+      - async:   a producer and consumer task passing N items
+      - heap:    peak heap growth while passing items through a backlog
+
+    Usage:
+        python host/bench_queue.py [backlog size] [async item count]
+'''
+
+import sys
+import time
+import tracemalloc
+
+import upy_compat
+upy_compat.install()
+
+import uasyncio
+import queue
+
+# the queue.Queue before it used a ring buffer
+class ListQueue:
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self._queue = []
+        self._evput = uasyncio.Event()
+        self._evget = uasyncio.Event()
+
+    def _get(self):
+        self._evget.set()
+        self._evget.clear()
+        return self._queue.pop(0)
+
+    async def get(self):
+        while self.empty():
+            await self._evput.wait()
+        return self._get()
+
+    def get_nowait(self):
+        if self.empty():
+            raise queue.QueueEmpty()
+        return self._get()
+
+    def _put(self, val):
+        self._evput.set()
+        self._evput.clear()
+        self._queue.append(val)
+
+    async def put(self, val):
+        while self.full():
+            await self._evget.wait()
+        self._put(val)
+
+    def put_nowait(self, val):
+        if self.full():
+            raise queue.QueueFull()
+        self._put(val)
+
+    def empty(self):
+        return len(self._queue) == 0
+
+    def full(self):
+        return self.maxsize > 0 and len(self._queue) >= self.maxsize
+
+def bench_backlog(q,n):
+    t = time.perf_counter()
+    for i in range(n):
+        q.put_nowait(i)
+    while not q.empty():
+        q.get_nowait()
+    return time.perf_counter() - t
+
+async def _producer(q,n):
+    for i in range(n):
+        await q.put(i)
+
+async def _consumer(q,n):
+    for i in range(n):
+        await q.get()
+
+async def _run_async(q,n):
+    c = uasyncio.create_task(_consumer(q,n))
+    await _producer(q,n)
+    await c
+
+def bench_async(q,n):
+    t = time.perf_counter()
+    uasyncio.run(_run_async(q,n))
+    return time.perf_counter() - t
+
+# peak heap growth while putting and getting
+# items through a queue that already holds a backlog
+def bench_heap(q,backlog,n):
+    for i in range(backlog):
+        q.put_nowait(i)
+    items = list(range(n))
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for i in items:
+        q.put_nowait(i)
+        q.get_nowait()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return peak - base
+
+def main(backlog=5000,n=20000):
+    print("{:10} {:>14} {:>14} {:>16}".format(
+        "queue","backlog us/op","async us/op","heap peak bytes"))
+
+    for name,cls in (("ListQueue",ListQueue),("Queue",queue.Queue)):
+        t_backlog = bench_backlog(cls(backlog),backlog)
+        t_async   = bench_async(cls(16),n)
+        heap      = bench_heap(cls(backlog*2),backlog,n)
+
+        print("{:10} {:14.3f} {:14.3f} {:16}".format(
+            name,
+            t_backlog/backlog/2*1000000,
+            t_async/n*1000000,
+            heap))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,91 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Benchmark matching inbound topics against subscriptions
+    using the original list scan (Subscription.put_match on every
+    subscription) and the TopicTree index.
+
+    Usage:
+        python host/bench_topic_tree.py [subscription count] [message count]
+'''
+
+import sys
+import time
+
+import upy_compat
+upy_compat.install()
+
+from psos_subscription import Subscription
+from psos_topic_tree import TopicTree
+
+# counts messages instead of queueing them
+class CountQueue:
+    def __init__(self):
+        self.cnt = 0
+
+    def put_nowait(self,v):
+        self.cnt += 1
+
+# build a set of filters similar to a gateway node:
+# per device display, proxy and logger subscriptions
+def build_filters(sub_cnt):
+    filters = ["#", "+/log", "local/lcd"]
+    types = ["dht","mem","soil","lcd","tch","cmd"]
+    i = 0
+    while len(filters) < sub_cnt:
+        dev = "d{:02d}".format(i % 20)
+        filters.append("{}/{}".format(dev,types[i % len(types)]))
+        filters.append("{}/{}/upd".format(dev,types[i % len(types)]))
+        if i % 5 == 0:
+            filters.append("{}/+/upd".format(dev))
+        i += 1
+    return filters[:sub_cnt]
+
+def build_topics(msg_cnt):
+    topics = []
+    types = ["dht","mem","soil","lcd","log"]
+    for i in range(msg_cnt):
+        topics.append("d{:02d}/{}".format(i % 25,types[i % len(types)]))
+    return topics
+
+def run_list(subs,topics):
+    t = time.perf_counter()
+    for topic in topics:
+        t_split = topic.split('/')
+        for s in subs:
+            s.put_match(t_split,topic,"{}")
+    return time.perf_counter() - t
+
+def run_tree(tree,topics):
+    t = time.perf_counter()
+    for topic in topics:
+        tree.put_match(topic.split('/'),topic,"{}")
+    return time.perf_counter() - t
+
+def main(sub_cnt=40,msg_cnt=20000):
+    filters = build_filters(sub_cnt)
+    topics  = build_topics(msg_cnt)
+
+    q_list = CountQueue()
+    q_tree = CountQueue()
+
+    subs = [Subscription(f,q_list) for f in filters]
+
+    tree = TopicTree()
+    for f in filters:
+        tree.add(Subscription(f,q_tree))
+
+    t_list = run_list(subs,topics)
+    t_tree = run_tree(tree,topics)
+
+    # both must deliver exactly the same number of messages
+    assert q_list.cnt == q_tree.cnt, (q_list.cnt,q_tree.cnt)
+
+    print("subscriptions: {}  messages: {}  delivered: {}".format(sub_cnt,msg_cnt,q_tree.cnt))
+    print("list scan: {:8.2f} us/msg".format(t_list/msg_cnt*1000000))
+    print("tree:      {:8.2f} us/msg".format(t_tree/msg_cnt*1000000))
+    print("speedup:   {:8.2f}x".format(t_list/t_tree))
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
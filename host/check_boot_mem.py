@@ -0,0 +1,64 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Check a boot memory report against a memory budget.
+
+    The report is the JSON payload psos_main publishes to
+    {dev}/boot_mem when config.json has "boot_mem": true
+    (see base/psos_boot_mem.py), saved to a file, e.g.
+        mosquitto_sub -t e02/boot_mem -C 1 > e02_boot_mem.json
+
+    The budget (default host/boot_mem_budget.json) gives the bytes
+    allowed for each instance of a module. Modules not listed
+    use the "default" budget.
+
+    Prints the report and exits with a non zero status if any
+    service uses more than its budget.
+
+    Usage:
+        python host/check_boot_mem.py report.json [budget.json]
+'''
+
+import sys
+import os
+import json
+
+def load(fn):
+    with open(fn) as f:
+        return json.load(f)
+
+def check(report,budget):
+    ok = True
+    default = budget.get("default",8192)
+    modules = budget.get("modules",{})
+
+    print("{} heap {}".format(report.get("dev","?"),report.get("total","?")))
+    print("{:12} {:14} {:>7} {:>7} {:>7} {:>7} {:>7}".format(
+          "service","module","import","init","run","total","budget"))
+
+    for name,module,imp,init,run,free in report["svcs"]:
+        used  = imp + init + run
+        allow = modules.get(module,default)
+        flag  = ""
+        if used > allow:
+            flag = "  OVER by {}".format(used - allow)
+            ok = False
+        print("{:12} {:14} {:7} {:7} {:7} {:7} {:7}{}".format(
+              name,module,imp,init,run,used,allow,flag))
+    print("free {} largest block {} frag {}%".format(
+          report.get("free","?"),report.get("block","?"),report.get("frag","?")))
+    return ok
+
+def main(report_fn,budget_fn=None):
+    if budget_fn == None:
+        budget_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "boot_mem_budget.json")
+    ok = check(load(report_fn),load(budget_fn))
+    print("ok" if ok else "failed")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    if not 2 <= len(sys.argv) <= 3:
+        print("usage: python host/check_boot_mem.py report.json [budget.json]")
+        sys.exit(2)
+    main(*sys.argv[1:3])
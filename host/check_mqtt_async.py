@@ -0,0 +1,121 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Check lib/umqtt_async.py against the in-process fake broker:
+      - subscribe, publish QoS 0 and QoS 1 and receive the messages
+      - receive a message larger than the receive buffer
+      - keepalive pings are answered
+      - QoS 1 publishes are pipelined within the in-flight window,
+        acknowledged, and resent with DUP when a PUBACK is lost
+
+    Prints the average publish to callback latency and exits with
+    a non zero status if any check fails.
+
+    Usage:
+        python host/check_mqtt_async.py [message count]
+'''
+
+import sys
+import time
+
+import upy_compat
+upy_compat.install()
+
+import uasyncio
+from fake_broker import FakeBroker
+from umqtt_async import MQTTAsyncClient
+
+async def check_qos1(broker,client):
+    ok = True
+
+    # window limits messages waiting for PUBACK
+    acks = []
+    for i in range(20):
+        acks.append(await client.publish(b"qos1/msg", str(i).encode(), qos=1))
+        if len(client._inflight) > client.window:
+            print("FAIL: {} messages in flight, window {}".format(len(client._inflight),client.window))
+            ok = False
+    results = [await a.wait() for a in acks]
+    if not all(results):
+        print("FAIL: QoS 1 messages not acknowledged")
+        ok = False
+
+    # lost PUBACK is recovered by a resend with DUP set
+    broker.drop_pubacks = 1
+    t = time.ticks_ms()
+    ack = await client.publish(b"qos1/msg", b"dup", qos=1)
+    if not await ack.wait():
+        print("FAIL: resent message not acknowledged")
+        ok = False
+    if broker.dups != 1:
+        print("FAIL: expected 1 DUP resend, broker saw", broker.dups)
+        ok = False
+    print("QoS 1 resend acknowledged after {} ms".format(time.ticks_diff(time.ticks_ms(),t)))
+    return ok
+
+async def check(broker,port,n):
+    rcv = []
+
+    def cb(topic,msg):
+        rcv.append((topic,msg,time.ticks_us()))
+
+    client = MQTTAsyncClient(b"check",  "127.0.0.1", port=port, keepalive=1,
+                             window=4, retry_ms=200)
+    client.set_callback(cb)
+    client.connect()
+    reader = uasyncio.create_task(client.wait_msgs())
+
+    await client.subscribe(b"check/+")
+    await uasyncio.sleep_ms(50)
+
+    sent = []
+    for i in range(n):
+        sent.append(time.ticks_us())
+        await client.publish(b"check/msg", str(i).encode(), qos=i % 2)
+        await uasyncio.sleep_ms(0)
+
+    big = b"x" * 2000
+    await client.publish(b"check/big", big)
+
+    # wait long enough for at least one keepalive ping
+    await uasyncio.sleep_ms(1500)
+
+    ok = True
+    msgs = [r for r in rcv if r[0] == b"check/msg"]
+    if [r[1] for r in msgs] != [str(i).encode() for i in range(n)]:
+        print("FAIL: received {} of {} messages".format(len(msgs),n))
+        ok = False
+    if not (b"check/big", big) in [(r[0],r[1]) for r in rcv]:
+        print("FAIL: large message not received")
+        ok = False
+    if client._ping_sent != 0:
+        print("FAIL: no PINGRESP")
+        ok = False
+    if reader.done():
+        print("FAIL: reader stopped:", reader.exception())
+        ok = False
+
+    if not await check_qos1(broker,client):
+        ok = False
+
+    if len(msgs) > 0:
+        lat = sum(msgs[i][2] - sent[i] for i in range(len(msgs))) / len(msgs)
+        print("{} messages, average latency {:.0f} us".format(len(msgs),lat))
+
+    reader.cancel()
+    client.disconnect()
+    return ok
+
+def main(n=200):
+    broker = FakeBroker()
+    port = broker.start()
+    try:
+        ok = uasyncio.run(check(broker,port,n))
+    finally:
+        broker.stop()
+    print("ok" if ok else "failed")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
@@ -0,0 +1,229 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Minimal in-process MQTT 3.1.1 broker used in place of Mosquitto
+    or HiveMQ when running PSOS modules on a host PC.
+
+    Supports CONNECT, PUBLISH (QoS 0 and 1), SUBSCRIBE, UNSUBSCRIBE,
+    PINGREQ and DISCONNECT. Retained messages, QoS 2, wills and
+    persistent sessions are not supported.
+
+    The broker runs its own asyncio event loop in a background thread
+    so that clients using the blocking umqtt_simple connect() can
+    be run from the host event loop:
+
+        broker = FakeBroker()
+        port = broker.start()
+        ...
+        broker.stop()
+
+    Counters of received and sent PUBLISH packets are kept per client
+    and in total, and of the filters subscribed and unsubscribed.
+
+    Setting drop_pubacks to n makes the broker skip the next n PUBACKs
+    so that client resends can be checked.
+'''
+
+import asyncio
+import threading
+
+def filter_match(fltr,topic):
+    f = fltr.split('/')
+    t = topic.split('/')
+    for i in range(len(f)):
+        if f[i] == "#":
+            return True
+        if i >= len(t):
+            return False
+        if f[i] != "+" and f[i] != t[i]:
+            return False
+    return len(f) == len(t)
+
+def _encode_len(n):
+    b = bytearray()
+    while True:
+        d = n & 0x7F
+        n >>= 7
+        if n:
+            b.append(d | 0x80)
+        else:
+            b.append(d)
+            return bytes(b)
+
+class _Client:
+    def __init__(self,writer):
+        self.writer = writer
+        self.cid  = None
+        self.subs = {}   # filter -> qos
+        self.pid  = 0
+        self.msgs_in  = 0
+        self.msgs_out = 0
+
+class FakeBroker:
+
+    def __init__(self,host="127.0.0.1",port=0):
+        self.host = host
+        self.port = port
+        self.clients = []
+        self.msgs_in  = 0
+        self.msgs_out = 0
+        self.dups     = 0
+        self.subscribes   = 0
+        self.unsubscribes = 0
+        self.drop_pubacks = 0
+        self._loop   = None
+        self._server = None
+        self._thread = None
+
+    # start the broker in a background thread.
+    # returns the port the broker is listening on.
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._run_client,self.host,self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run,daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.port
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(),self._loop).result(2)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(2)
+        self._loop = None
+
+    async def _shutdown(self):
+        self._server.close()
+
+        # let the client tasks end on their own, a cancelled
+        # client task is logged as an error by asyncio
+        for c in self.clients:
+            c.writer.close()
+        await asyncio.sleep(0.01)
+
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks,return_exceptions=True)
+
+    def stats(self):
+        return {
+            "clients"  : len(self.clients),
+            "msgs_in"  : self.msgs_in,
+            "msgs_out" : self.msgs_out,
+            "subscribes"  : self.subscribes,
+            "unsubscribes": self.unsubscribes,
+            "per_client": {str(c.cid):{"subs":len(c.subs),
+                                       "in":c.msgs_in,
+                                       "out":c.msgs_out} for c in self.clients}
+            }
+
+    async def _read_packet(self,reader):
+        hdr = await reader.readexactly(1)
+        n = 0
+        sh = 0
+        while True:
+            b = (await reader.readexactly(1))[0]
+            n |= (b & 0x7F) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        body = await reader.readexactly(n) if n else b""
+        return hdr[0],body
+
+    async def _run_client(self,reader,writer):
+        c = _Client(writer)
+        self.clients.append(c)
+        try:
+            while True:
+                op,body = await self._read_packet(reader)
+                t = op & 0xF0
+                if t == 0x10:
+                    self._connect(c,body)
+                elif t == 0x30:
+                    self._publish(c,op,body)
+                elif t == 0x80:
+                    self._subscribe(c,body)
+                elif t == 0xA0:
+                    self._unsubscribe(c,body)
+                elif t == 0xC0:
+                    writer.write(b"\xd0\0")
+                elif t == 0xE0:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError,ConnectionError):
+            pass
+        finally:
+            self.clients.remove(c)
+            writer.close()
+
+    def _str(self,body,p):
+        n = body[p] << 8 | body[p+1]
+        return body[p+2:p+2+n],p+2+n
+
+    def _connect(self,c,body):
+        # skip protocol name, level, flags and keepalive
+        p = 2 + body[1] + 4
+        c.cid,p = self._str(body,p)
+        c.cid = c.cid.decode()
+        c.writer.write(b"\x20\x02\0\0")
+
+    def _publish(self,c,op,body):
+        topic,p = self._str(body,0)
+        qos = (op >> 1) & 3
+        if op & 0x08:
+            self.dups += 1
+        if qos:
+            pid = body[p:p+2]
+            p += 2
+            if self.drop_pubacks > 0:
+                self.drop_pubacks -= 1
+            else:
+                c.writer.write(b"\x40\x02" + pid)
+        msg = body[p:]
+        c.msgs_in += 1
+        self.msgs_in += 1
+        self.route(topic.decode(),msg)
+
+    # deliver a message to every client with a matching subscription
+    def route(self,topic,msg):
+        tb = topic.encode()
+        for s in self.clients:
+            for fltr in s.subs:
+                if filter_match(fltr,topic):
+                    var = len(tb).to_bytes(2,"big") + tb
+                    s.writer.write(b"\x30" + _encode_len(len(var)+len(msg)) + var + msg)
+                    s.msgs_out += 1
+                    self.msgs_out += 1
+                    break
+
+    def _subscribe(self,c,body):
+        pid = body[0:2]
+        p = 2
+        rc = b""
+        while p < len(body):
+            fltr,p = self._str(body,p)
+            qos = body[p]
+            p += 1
+            c.subs[fltr.decode()] = qos
+            self.subscribes += 1
+            rc += bytes((min(qos,1),))
+        c.writer.write(b"\x90" + _encode_len(2+len(rc)) + pid + rc)
+
+    def _unsubscribe(self,c,body):
+        pid = body[0:2]
+        p = 2
+        while p < len(body):
+            fltr,p = self._str(body,p)
+            c.subs.pop(fltr.decode(),None)
+            self.unsubscribes += 1
+        c.writer.write(b"\xb0\x02" + pid)
@@ -0,0 +1,612 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Run several PSOS nodes in one host process and measure how
+    messages travel between them.
+
+    Each node boots from its own devices/ parms file with the real
+    svc_mqtt, svc_mqtt_proxy_server and svc_mqtt_proxy_client, on the
+    stand-in hardware of host/psos_sim.py. Every node talks to the
+    network through its own link, a TCP relay that adds latency and
+    limits bandwidth in both directions:
+      - a "direct" node's svc_mqtt connects to the FakeBroker
+        (host/fake_broker.py) through its link, as a device
+        connecting straight to HiveMQ
+      - a "proxy" node's mqtt service is replaced by
+        svc_mqtt_proxy_client, connected through its link to the
+        svc_mqtt_proxy_server of another node, which connects to
+        the broker through its own link
+
+    The topology is a JSON file:
+        {"name": "proxy",
+         "link": {"latency_ms": 20, "kbps": 1000},
+         "nodes": [
+             {"name": "r02", "parms": "r02_psos_parms.json",
+              "add": [{"name": "proxy", "module": "svc_mqtt_proxy_server"}]},
+             {"name": "d03", "parms": "d03_psos_parms.json", "proxy": "r02",
+              "link": {"latency_ms": 5, "kbps": 250}}],
+         "load": [{"node": "d03", "topic": "d03/load", "per_s": 20,
+                   "to": ["r02"]}],
+         "secs": 10}
+    "link" sets the default link, a node's "link" replaces it for
+    that node. "add" appends services to the node's parms and
+    "mqtt" adds parms to its mqtt service, e.g. {"proto": 1}. A node
+    without "proxy" is direct. "to" defaults to every other node.
+
+    For each "load" the node publishes per_s messages a second to
+    the topic, each carrying a sequence number and the send time.
+    The "to" nodes subscribe to the topic with a probe queue
+    and the probes measure the latency of every message received.
+
+    Reported for each node:
+      - the deepest and average depth of its subscription queues,
+        sampled every 100ms, and for a proxy server node of its
+        client queues
+      - messages received by its probes, the average, 95th
+        percentile and maximum latency, and messages lost
+      - bytes sent and received over its link and the most bytes
+        waiting in the link
+    and for the broker the messages in and out, the fan-out
+    (messages out per message in) and the filters subscribed.
+
+    All nodes share one event loop, as well as the PSOS modules
+    and their module level state (psos_metrics, psos_prof, ...).
+    A blocking call in one node, such as umqtt_simple's connect(),
+    stalls every node.
+    machine.unique_id() returns the node's name so the broker and
+    proxy server see a different client id for each node.
+
+    Usage:
+        python host/psos_cluster.py topology.json [--secs 10]
+                                    [--out results.json] [-v]
+    host/cluster_direct.json and host/cluster_proxy.json run the same
+    nodes and load directly connected and through a proxy server.
+'''
+
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+import contextlib
+import contextvars
+import shutil
+import tempfile
+
+import psos_sim
+from psos_sim import ROOT
+
+# the node whose code is running
+_node = contextvars.ContextVar("node",default="sim")
+
+def _unique_id():
+    return _node.get().encode()
+
+def _load_json(fn):
+    if not os.path.exists(fn):
+        fn = os.path.join(ROOT,"devices",fn)
+    with open(fn) as f:
+        return psos_sim._load(f)
+
+# one direction of a link. Data is held until it has been
+# sent at the link's bandwidth and then for the latency.
+async def _pump(link,reader,writer,up):
+    loop = asyncio.get_running_loop()
+    q = asyncio.Queue()
+
+    async def send():
+        while True:
+            due,data = await q.get()
+            if data == None:
+                break
+            d = due - loop.time()
+            if d > 0:
+                await asyncio.sleep(d)
+            writer.write(data)
+            await writer.drain()
+            link.backlog -= len(data)
+        writer.close()
+
+    task = loop.create_task(send())
+    busy = 0
+    try:
+        while True:
+            data = await reader.read(4096)
+            if not data:
+                break
+            now = loop.time()
+            busy = max(now,busy) + link.ser_s(len(data))
+            link.backlog += len(data)
+            link.backlog_max = max(link.backlog_max,link.backlog)
+            if up:
+                link.bytes_up += len(data)
+            else:
+                link.bytes_down += len(data)
+            q.put_nowait((busy + link.latency_s,data))
+    except ConnectionError:
+        pass
+    q.put_nowait((0,None))
+    try:
+        await task
+    except ConnectionError:
+        pass
+
+class Link:
+
+    def __init__(self,name,latency_ms=0,kbps=0):
+        self.name = name
+        self.latency_s = latency_ms/1000
+        self.kbps = kbps
+        self.target = None      # (host,port) or a function returning it
+        self.port = None
+        self.conns = 0
+        self.writers = []
+        self.bytes_up   = 0
+        self.bytes_down = 0
+        self.backlog     = 0
+        self.backlog_max = 0
+
+    # seconds to send n bytes
+    def ser_s(self,n):
+        if self.kbps <= 0:
+            return 0
+        return n*8/(self.kbps*1000)
+
+    async def _relay(self,node_r,node_w):
+        target = self.target
+        if callable(target):
+            target = target()
+        try:
+            net_r,net_w = await asyncio.open_connection(*target)
+        except OSError:
+            node_w.close()
+            return
+        self.conns += 1
+        self.writers += [node_w,net_w]
+        await asyncio.gather(_pump(self,node_r,net_w,True),
+                             _pump(self,net_r,node_w,False))
+
+    def stats(self):
+        return {"latency_ms": self.latency_s*1000, "kbps": self.kbps,
+                "conns": self.conns, "bytes_up": self.bytes_up,
+                "bytes_down": self.bytes_down, "backlog_max": self.backlog_max}
+
+# the links run in their own thread, like the FakeBroker,
+# so they keep moving while a node blocks the event loop
+class Links:
+
+    def __init__(self):
+        self.links = []
+        self._loop = None
+        self._thread = None
+        self._servers = []
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run,daemon=True)
+        self._thread.start()
+        started.wait()
+
+    # listen for a node's connections. Returns the port.
+    def add(self,link):
+        async def listen():
+            server = await asyncio.start_server(link._relay,"127.0.0.1",0)
+            self._servers.append(server)
+            return server.sockets[0].getsockname()[1]
+
+        link.port = asyncio.run_coroutine_threadsafe(listen(),self._loop).result(2)
+        self.links.append(link)
+        return link.port
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            for s in self._servers:
+                s.close()
+
+            # let the relays end on their own first, see FakeBroker
+            for link in self.links:
+                for w in link.writers:
+                    w.close()
+            await asyncio.sleep(0.01)
+
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks,return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(),self._loop).result(2)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(2)
+        self._loop = None
+
+# latencies of the messages from one load received by one node
+class Probe:
+
+    def __init__(self,load,node):
+        self.load = load
+        self.node = node
+        self.seqs = set()
+        self.lat  = []
+
+    async def run(self,q):
+        while True:
+            msg = await q.get()
+            try:
+                p = msg.json()
+                t = p["t"]
+                seq = p["seq"]
+            except (ValueError,TypeError,KeyError):
+                continue
+            if p.get("src") != self.load["node"] or seq in self.seqs:
+                continue
+            self.seqs.add(seq)
+            self.lat.append((time.perf_counter() - t)*1000)
+
+class Node:
+
+    def __init__(self,spec,link):
+        self.spec = spec
+        self.name = spec["name"]
+        self.link = link
+        self.proxy = spec.get("proxy",None)
+        self.kind = "proxy" if self.proxy else "direct"
+        self.defaults = None
+        self.boot_ms = None
+        self.task = None
+        self.depths = []
+        self.server_depths = []
+        self.probes = []
+        self.sent = 0
+
+    @property
+    def services(self):
+        if self.defaults == None:
+            return {}
+        return self.defaults.get("services",{})
+
+    def proxy_server(self):
+        for svc in self.services.values():
+            if hasattr(svc,"users") and hasattr(svc,"run_client"):
+                return svc
+        return None
+
+    # the node's parms with its mqtt service connected through its link
+    def parms(self):
+        import secrets
+
+        parms = _load_json(self.spec["parms"])
+        parms.setdefault("defaults",{})
+        svcs = []
+        for svc in parms["services"]:
+            svc = dict(svc)
+            if svc["name"] == "mqtt":
+                if self.proxy:
+                    svc = {"name": "mqtt", "module": "svc_mqtt_proxy_client",
+                           "server": "127.0.0.1", "port": self.link.port}
+                else:
+                    broker = "link_" + self.name
+                    secrets.mqtt[broker] = {"server": "127.0.0.1", "port": self.link.port}
+                    svc = {"name": "mqtt", "module": "svc_mqtt", "broker": broker}
+                svc.update(self.spec.get("mqtt",{}))
+            elif svc["module"] == "svc_mqtt_proxy_server":
+                svc.update({"host": "127.0.0.1", "port": 0})
+            svcs.append(svc)
+        for svc in self.spec.get("add",[]):
+            svc = dict(svc)
+            if svc["module"] == "svc_mqtt_proxy_server":
+                svc.update({"host": "127.0.0.1", "port": 0})
+            svcs.append(svc)
+        parms["services"] = svcs
+        return parms
+
+    def config(self):
+        return {"fn_parms": self.spec["parms"],
+                "parms"   : os.path.join(ROOT,"devices"),
+                "path"    : [],
+                "device"  : self.name,
+                "mpy"     : False}
+
+    async def boot(self,timeout_s=30):
+        import psos_main
+
+        parms = self.parms()
+        t = time.perf_counter()
+        token = _node.set(self.name)
+        try:
+            self.task = asyncio.get_running_loop().create_task(
+                psos_main.main(parms,self.config()))
+        finally:
+            _node.reset(token)
+
+        self.defaults = parms["defaults"]
+        while not self.defaults.get("started",False):
+            if self.task.done():
+                raise RuntimeError("{}: {!r}".format(self.name,self.task.exception()))
+            if time.perf_counter() - t > timeout_s:
+                raise RuntimeError(self.name + ": boot timeout")
+            await asyncio.sleep(0.001)
+        self.boot_ms = (time.perf_counter() - t)*1000
+
+    # the port of the node's proxy server once it is listening
+    async def server_port(self,timeout_s=5):
+        t = time.perf_counter()
+        while time.perf_counter() - t < timeout_s:
+            svc = self.proxy_server()
+            server = getattr(svc,"server",None)
+            if server != None:
+                return server.sockets[0].getsockname()[1]
+            await asyncio.sleep(0.01)
+        raise RuntimeError(self.name + ": no proxy server")
+
+    def sample(self):
+        mqtt = self.services.get("mqtt",None)
+        # a queue may have more than one subscription
+        qs = {}
+        for s in getattr(mqtt,"_subscriptions",[]):
+            qs[id(s._queue)] = s._queue
+        self.depths.append(sum(q.qsize() for q in qs.values()))
+        server = self.proxy_server()
+        if server != None:
+            self.server_depths.append(sum(q.qsize() for q in server.users.values()))
+
+    def stats(self):
+        lat = []
+        recv = 0
+        lost = 0
+        for p in self.probes:
+            lat.extend(p.lat)
+            recv += len(p.seqs)
+            lost += p.load["sent"] - len(p.seqs)
+        lat.sort()
+
+        r = {"kind"      : self.kind,
+             "boot_ms"   : self.boot_ms,
+             "sent"      : self.sent,
+             "q_max"     : max(self.depths,default=0),
+             "q_avg"     : sum(self.depths)/max(len(self.depths),1),
+             "recv"      : recv,
+             "lost"      : lost,
+             "lat_avg_ms": sum(lat)/len(lat) if lat else None,
+             "lat_p95_ms": lat[int(len(lat)*0.95)] if lat else None,
+             "lat_max_ms": lat[-1] if lat else None,
+             "link"      : self.link.stats()}
+        if self.proxy_server() != None:
+            r["kind"] = "server" if self.kind == "direct" else self.kind
+            r["server_q_max"] = max(self.server_depths,default=0)
+            r["server_q_avg"] = sum(self.server_depths)/max(len(self.server_depths),1)
+        return r
+
+class Cluster:
+
+    def __init__(self,topology,quiet=True):
+        psos_sim.install()
+        if type(topology) != dict:
+            with open(topology) as f:
+                topology = json.load(f)
+        self.topology = topology
+        self.quiet  = quiet
+        self.nodes  = {}
+        self.broker = None
+        self.broker_stats = None
+        self.links  = None
+        self.errors = []
+        self._tasks = set()
+        self._dir   = None
+        self._cwd   = None
+        self._out   = None
+
+    async def boot(self):
+        import machine
+        from fake_broker import FakeBroker
+
+        self._dir = tempfile.mkdtemp(prefix="psos_cluster_")
+        self._cwd = os.getcwd()
+        os.chdir(self._dir)
+        if self.quiet:
+            self._out = contextlib.redirect_stdout(open(os.devnull,"w"))
+            self._out.__enter__()
+
+        psos_sim._unload_psos()
+        machine.resets.clear()
+        machine.unique_id = _unique_id
+
+        loop = asyncio.get_running_loop()
+        def task_factory(loop,coro,**kw):
+            task = asyncio.Task(coro,loop=loop,**kw)
+            self._tasks.add(task)
+            return task
+        loop.set_task_factory(task_factory)
+
+        self.broker = FakeBroker()
+        broker = ("127.0.0.1",self.broker.start())
+        self.links = Links()
+        self.links.start()
+
+        default = self.topology.get("link",{})
+        for spec in self.topology["nodes"]:
+            ls = dict(default)
+            ls.update(spec.get("link",{}))
+            link = Link(spec["name"],ls.get("latency_ms",0),ls.get("kbps",0))
+            node = Node(spec,link)
+            if not node.proxy:
+                link.target = broker
+            self.links.add(link)
+            self.nodes[node.name] = node
+
+        # proxy servers first so their clients can connect
+        servers = set(n.proxy for n in self.nodes.values() if n.proxy)
+        order = sorted(self.nodes.values(),key=lambda n: not n.name in servers)
+        for node in order:
+            if node.proxy:
+                server = self.nodes[node.proxy]
+                node.link.target = ("127.0.0.1",await server.server_port())
+            await node.boot()
+
+    # subscribe the probes and publish the load
+    async def run(self,secs):
+        loads = self.topology.get("load",[])
+        for load in loads:
+            load["sent"] = 0
+            to = load.get("to",None)
+            if to == None:
+                to = [n for n in self.nodes if n != load["node"]]
+            for name in to:
+                node = self.nodes[name]
+                probe = Probe(load,node)
+                node.probes.append(probe)
+                q = __import__("queue").Queue()
+                await node.services["mqtt"].subscribe(load["topic"],q)
+                asyncio.get_running_loop().create_task(probe.run(q))
+
+        # let the subscriptions reach the broker
+        await asyncio.sleep(self.topology.get("settle_s",1))
+
+        tasks = [asyncio.get_running_loop().create_task(self._load(l,secs)) for l in loads]
+        t = time.perf_counter()
+        while time.perf_counter() - t < secs:
+            for node in self.nodes.values():
+                node.sample()
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*tasks)
+
+        # messages still on their way
+        await asyncio.sleep(self.topology.get("drain_s",2))
+
+    async def _load(self,load,secs):
+        node = self.nodes[load["node"]]
+        mqtt = node.services["mqtt"]
+        period = 1/load.get("per_s",1)
+        t0 = time.perf_counter()
+        seq = 0
+        while time.perf_counter() - t0 < secs:
+            payload = {"seq": seq, "t": time.perf_counter(), "src": node.name}
+            await mqtt.publish(load["topic"],payload)
+            seq += 1
+            load["sent"] = seq
+            node.sent += 1
+            d = t0 + seq*period - time.perf_counter()
+            await asyncio.sleep(max(d,0))
+
+    def results(self):
+        b = self.broker_stats or self.broker.stats()
+        names = {}
+        for node in self.nodes.values():
+            names[node.name.encode().hex()] = node.name
+        per_client = {}
+        for cid,c in b["per_client"].items():
+            per_client[names.get(cid,cid)] = c
+        b["per_client"] = per_client
+        b["fan_out"] = b["msgs_out"]/b["msgs_in"] if b["msgs_in"] else None
+
+        return {"topology": self.topology.get("name",""),
+                "nodes"   : {n.name: n.stats() for n in self.nodes.values()},
+                "broker"  : b,
+                "errors"  : self.errors}
+
+    async def stop(self):
+        import machine
+
+        if self.broker != None:
+            self.broker_stats = self.broker.stats()
+        for task in self._tasks:
+            if task.done() and not task.cancelled() and task.exception() != None:
+                self.errors.append(repr(task.exception()))
+        if len(machine.resets) > 0:
+            self.errors.append("{} resets".format(len(machine.resets)))
+
+        asyncio.get_running_loop().set_task_factory(None)
+        tasks = [t for t in self._tasks if not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks,return_exceptions=True)
+
+        for node in self.nodes.values():
+            for svc in node.services.values():
+                sock = getattr(getattr(svc,"_client",None),"sock",None)
+                if sock == None and hasattr(svc,"close_sock"):
+                    svc.close_sock()
+                elif sock != None:
+                    sock.close()
+                server = getattr(svc,"server",None)
+                if server != None:
+                    server.close()
+
+        if self.links != None:
+            self.links.stop()
+        if self.broker != None:
+            self.broker.stop()
+
+        if self._out != None:
+            self._out.__exit__(None,None,None)
+            self._out = None
+        if self._cwd != None:
+            os.chdir(self._cwd)
+            shutil.rmtree(self._dir,ignore_errors=True)
+            self._cwd = None
+
+def _ms(v):
+    return "-" if v == None else "{:.1f}".format(v)
+
+def show(res):
+    print("topology:",res["topology"])
+    print("{:6} {:7} {:>7} {:>5} {:>6} {:>6} {:>6} {:>5} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+          "node","kind","boot ms","sent","q max","q avg","recv","lost",
+          "avg ms","p95 ms","max ms","link up","link dn"))
+    for name,r in res["nodes"].items():
+        print("{:6} {:7} {:>7} {:5} {:6} {:6.1f} {:6} {:5} {:>8} {:>8} {:>8} {:8} {:8}".format(
+              name,r["kind"],_ms(r["boot_ms"]),r["sent"],r["q_max"],r["q_avg"],
+              r["recv"],r["lost"],_ms(r["lat_avg_ms"]),_ms(r["lat_p95_ms"]),
+              _ms(r["lat_max_ms"]),r["link"]["bytes_up"],r["link"]["bytes_down"]))
+        if "server_q_max" in r:
+            print("{:6} {:7} client queues: max {} avg {:.1f}".format(
+                  "","",r["server_q_max"],r["server_q_avg"]))
+
+    b = res["broker"]
+    fan = "-" if b["fan_out"] == None else "{:.2f}".format(b["fan_out"])
+    print()
+    print("broker: {} clients, {} msgs in, {} out, fan-out {}, {} subscribes".format(
+          b["clients"],b["msgs_in"],b["msgs_out"],fan,b["subscribes"]))
+    for e in res["errors"]:
+        print("error:",e)
+
+async def run(topology,secs=None,quiet=True):
+    cluster = Cluster(topology,quiet)
+    if secs == None:
+        secs = cluster.topology.get("secs",10)
+    try:
+        await cluster.boot()
+        await cluster.run(secs)
+    except Exception as e:
+        cluster.errors.append(repr(e))
+    finally:
+        await cluster.stop()
+    return cluster.results()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("topology")
+    ap.add_argument("--secs",type=float)
+    ap.add_argument("--out")
+    ap.add_argument("-v",action="store_true")
+    args = ap.parse_args()
+
+    res = asyncio.run(run(args.topology,args.secs,not args.v))
+    show(res)
+
+    if args.out:
+        with open(args.out,"w") as f:
+            json.dump(res,f,indent=1)
+
+if __name__ == "__main__":
+    main()
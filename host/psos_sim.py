@@ -0,0 +1,374 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Boot PSOS on a host PC, without hardware.
+
+    main.py is run as on a device: it reads config.json, loads
+    the parms file and runs psos_main.main(). The hardware modules
+    are replaced by the stand-ins in host/sim_modules (machine,
+    network, ntptime, dht, framebuf, secrets, sdcard and urequests)
+    and every MQTT broker named in the parms resolves to an
+    in-process FakeBroker (host/fake_broker.py). An SD card
+    mounted with os.mount() is a directory in the device's
+    file system.
+
+        sim = Sim("e01_psos_parms.json")
+        boot_ms = await sim.boot()
+        mqtt = sim.services["mqtt"]
+        ...
+        await sim.stop()
+
+    A parms dict can be given instead of a file name. Files are
+    read from devices/, menus and other files named in the parms
+    are also read from there.
+
+    Each boot runs in a new temporary directory (the device's
+    file system) with the PSOS modules imported again, so module
+    level state does not carry over from a previous boot.
+
+    Runs under CPython. The broker needs threads and main.py is
+    run with runpy, so this runner does not run on the MicroPython
+    unix port, but the modules in host/sim_modules do.
+
+    Usage:
+        python host/psos_sim.py parms.json [seconds]
+    boots the device, runs it for the given seconds (default 5)
+    and prints the boot time and broker message counts.
+'''
+
+import sys
+import os
+import gc
+import json
+import time
+import runpy
+import shutil
+import asyncio
+import tempfile
+import re
+import types
+import builtins
+import contextlib
+
+import upy_compat
+
+HOST = os.path.dirname(os.path.abspath(__file__))
+ROOT = upy_compat.ROOT
+SIM_MODULES = os.path.join(HOST,"sim_modules")
+
+# simulated heap for gc.mem_free() and gc.mem_alloc()
+HEAP = 111168
+
+# MicroPython text files also take bytes, which are
+# written as is, and file positions are in bytes
+class _TextFile:
+
+    def __init__(self,f):
+        self._f = f
+
+    def write(self,s):
+        if type(s) == str:
+            s = s.encode()
+        return self._f.write(s)
+
+    def read(self,n=-1):
+        return self._f.read(n).decode()
+
+    def readline(self):
+        return self._f.readline().decode()
+
+    def readlines(self):
+        return [ln.decode() for ln in self._f.readlines()]
+
+    def __getattr__(self,name):
+        return getattr(self._f,name)
+
+    def __iter__(self):
+        return (ln.decode() for ln in self._f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self._f.close()
+
+# os.mount() of an SD card (host/sim_modules/sdcard.py) makes the
+# mount point a directory in the device's file system, and paths
+# under the mount point are mapped to it
+_device_dir = None
+_mounts = {}
+
+def _sim_path(p):
+    if type(p) == str:
+        for pt,d in _mounts.items():
+            if p == pt or p.startswith(pt+"/"):
+                return d + p[len(pt):]
+    return p
+
+def _mount(dev,pt,readonly=False,mkfs=False):
+    pt = pt.rstrip("/")
+    d = os.path.join(_device_dir,pt.strip("/"))
+    os.makedirs(d,exist_ok=True)
+    _mounts[pt] = d
+
+def _umount(pt):
+    _mounts.pop(pt.rstrip("/"),None)
+
+def _on_mounts(f):
+    def call(*args,**kw):
+        return f(*[_sim_path(a) for a in args],**kw)
+    return call
+
+_open = builtins.open
+
+def _upy_open(file,mode="r",*args,**kw):
+    file = _sim_path(file)
+    if "b" in mode or type(file) == int:
+        return _open(file,mode,*args,**kw)
+    kw.pop("encoding",None)
+    return _TextFile(_open(file,mode.replace("t","")+"b",*args,**kw))
+
+# MicroPython's json accepts a trailing comma,
+# which some of the parms files have,
+_trailing = re.compile(r",(\s*[}\]])")
+
+def _loads(s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        if type(s) != str:
+            s = s.decode()
+        return json.loads(_trailing.sub(r"\1",s))
+
+def _load(f):
+    return _loads(f.read())
+
+# and writes bytes as a string
+def _bytes(o):
+    if type(o) in (bytes,bytearray):
+        return o.decode()
+    raise TypeError("can't serialize " + type(o).__name__)
+
+def _dumps(o):
+    return json.dumps(o,default=_bytes)
+
+def _ujson():
+    m = types.ModuleType("ujson")
+    m.__dict__.update(json.__dict__)
+    m.loads = _loads
+    m.load  = _load
+    m.dumps = _dumps
+    return m
+
+_installed = False
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    upy_compat.install()
+    if not SIM_MODULES in sys.path:
+        sys.path.insert(0,SIM_MODULES)
+
+    # CPython has its own secrets module
+    sys.modules.pop("secrets",None)
+    import secrets
+
+    builtins.open = _upy_open
+    sys.modules["ujson"] = _ujson()
+
+    os.mount  = _mount
+    os.umount = _umount
+    for name in ("stat","statvfs","listdir","remove","rename","mkdir","rmdir","chdir"):
+        setattr(os,name,_on_mounts(getattr(os,name)))
+
+    if not hasattr(gc,"mem_free"):
+        gc.mem_free  = lambda: HEAP//2
+        gc.mem_alloc = lambda: HEAP//2
+        gc.threshold = lambda n=None: -1
+
+# PSOS modules are imported again for each boot
+def _unload_psos():
+    dirs = (os.path.join(ROOT,"base"),os.path.join(ROOT,"lib"))
+    for name,m in list(sys.modules.items()):
+        fn = getattr(m,"__file__",None) or ""
+        if name != "queue" and fn.startswith(dirs):
+            del sys.modules[name]
+
+class Sim:
+
+    def __init__(self,parms,config=None,broker=True,quiet=True):
+        install()
+        self.parms   = parms
+        self.config  = config or {}
+        self.quiet   = quiet
+        self.broker  = None
+        self.use_broker = broker
+        self.defaults = None
+        self.services = {}
+        self.errors  = []
+        self._main   = None
+        self._tasks  = set()
+        self._dir    = None
+        self._cwd    = None
+        self._out    = None
+
+    def _load_parms(self):
+        if type(self.parms) == dict:
+            return json.loads(json.dumps(self.parms))
+        fn = self.parms
+        if not os.path.exists(fn):
+            fn = os.path.join(ROOT,"devices",fn)
+        with open(fn) as f:
+            return _load(f)
+
+    # boot the device. Returns the ms until psos_main has
+    # created and started every service.
+    async def boot(self,timeout_s=30):
+        import secrets
+        import machine
+
+        parms = self._load_parms()
+        parms.setdefault("defaults",{})
+        self.defaults = parms["defaults"]
+
+        if self.use_broker:
+            from fake_broker import FakeBroker
+            self.broker = FakeBroker()
+            secrets.broker[:] = ["127.0.0.1",self.broker.start()]
+
+        global _device_dir
+        self._dir = tempfile.mkdtemp(prefix="psos_sim_")
+        self._cwd = os.getcwd()
+        os.chdir(self._dir)
+        _device_dir = self._dir
+        _mounts.clear()
+
+        config = {"fn_parms": "sim_parms.json",
+                  "parms"   : os.path.join(ROOT,"devices"),
+                  "path"    : [],
+                  "device"  : self.defaults.get("dev","sim"),
+                  "mpy"     : False }
+        config.update(self.config)
+        with open("config.json","w") as f:
+            json.dump(config,f)
+        with open("sim_parms.json","w") as f:
+            json.dump(parms,f)
+
+        # the device was installed from this repo
+        manifest = os.path.join(ROOT,"manifest.json")
+        if os.path.exists(manifest):
+            shutil.copy(manifest,"manifest.json")
+
+        if self.quiet:
+            self._out = contextlib.redirect_stdout(open(os.devnull,"w"))
+            self._out.__enter__()
+
+        _unload_psos()
+        machine.resets.clear()
+        loop = asyncio.get_running_loop()
+
+        # keep every task the device creates
+        def task_factory(loop,coro,**kw):
+            task = asyncio.Task(coro,loop=loop,**kw)
+            self._tasks.add(task)
+            return task
+        loop.set_task_factory(task_factory)
+
+        # main.py ends with uasyncio.run(main.main(...)),
+        # run that as a task on this loop instead
+        uasyncio = sys.modules["uasyncio"]
+        run = uasyncio.run
+        def start(coro):
+            self._main = loop.create_task(coro)
+        uasyncio.run = start
+
+        t = time.perf_counter()
+        try:
+            g = runpy.run_path(os.path.join(ROOT,"main.py"),run_name="__sim__")
+        except Exception as e:
+            self.errors.append(repr(e))
+            return None
+        finally:
+            uasyncio.run = run
+
+        # loading the parms file replaced defaults
+        # psos_main uses the one in the loaded parms
+        self.defaults = g["parms"].get("defaults",{})
+
+        while not self.defaults.get("started",False):
+            if self._main.done():
+                e = self._main.exception()
+                self.errors.append(repr(e))
+                return None
+            if time.perf_counter() - t > timeout_s:
+                self.errors.append("boot timeout")
+                return None
+            await asyncio.sleep(0.001)
+
+        boot_ms = (time.perf_counter() - t)*1000
+        self.services = self.defaults["services"]
+        return boot_ms
+
+    # run the device for a while
+    async def run(self,secs):
+        await asyncio.sleep(secs)
+
+    # services that stopped with an error
+    def task_errors(self):
+        errs = []
+        for task in self._tasks:
+            if task.done() and not task.cancelled() and task.exception() != None:
+                errs.append(repr(task.exception()))
+        return errs
+
+    async def stop(self):
+        import machine
+
+        self.errors.extend(self.task_errors())
+        if len(machine.resets) > 0:
+            self.errors.append("{} resets".format(len(machine.resets)))
+
+        asyncio.get_running_loop().set_task_factory(None)
+        tasks = [t for t in self._tasks if not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks,return_exceptions=True)
+
+        for svc in self.services.values():
+            client = getattr(svc,"_client",None)
+            sock = getattr(client,"sock",None)
+            if sock != None:
+                sock.close()
+
+        if self.broker != None:
+            self.broker.stop()
+            self.broker = None
+
+        if self._out != None:
+            self._out.__exit__(None,None,None)
+            self._out = None
+
+        if self._cwd != None:
+            os.chdir(self._cwd)
+            shutil.rmtree(self._dir,ignore_errors=True)
+            self._cwd = None
+
+async def _main(fn,secs):
+    sim = Sim(fn,quiet=False)
+    boot_ms = await sim.boot()
+    if boot_ms != None:
+        print("sim: booted in {:.0f} ms, {} services".format(boot_ms,len(sim.services)))
+        await sim.run(secs)
+    broker = sim.broker
+    await sim.stop()
+    if broker != None:
+        print("sim: broker {} messages in, {} out".format(broker.msgs_in,broker.msgs_out))
+    for e in sim.errors:
+        print("sim: error",e)
+
+if __name__ == "__main__":
+    secs = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(_main(sys.argv[1],secs))
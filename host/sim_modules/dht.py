@@ -0,0 +1,26 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for the MicroPython dht module, used by
+    host/psos_sim.py. Every sensor reads 21.5C and 40%.
+'''
+
+class DHTBase:
+    def __init__(self,pin):
+        self.pin = pin
+        self.measures = 0
+
+    def measure(self):
+        self.measures += 1
+
+    def temperature(self):
+        return 21.5
+
+    def humidity(self):
+        return 40
+
+class DHT11(DHTBase):
+    pass
+
+class DHT22(DHTBase):
+    pass
@@ -0,0 +1,123 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Pure Python stand-in for the MicroPython framebuf module,
+    used by host/psos_sim.py. Pixels are stored in the buffer
+    in the MONO_VLSB, MONO_HLSB and RGB565 formats so the display
+    drivers write the same bytes as on a device.
+
+    text() only clears the character cells, there is no font.
+    On a device framebuf is native code, so drawing times
+    measured with this module are not representative.
+'''
+
+MONO_VLSB = 0
+RGB565    = 1
+GS4_HMSB  = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB  = 5
+GS8       = 6
+MVLSB     = MONO_VLSB
+
+class FrameBuffer:
+
+    def __init__(self,buf,width,height,format,stride=None):
+        self.buf    = buf
+        self.width  = width
+        self.height = height
+        self.format = format
+        self.stride = width if stride == None else stride
+
+    def pixel(self,x,y,c=None):
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return None
+        buf = self.buf
+        if self.format == RGB565:
+            i = (y*self.stride + x)*2
+            if c == None:
+                return buf[i] | buf[i+1] << 8
+            buf[i]   = c & 0xFF
+            buf[i+1] = (c >> 8) & 0xFF
+            return None
+        if self.format == MONO_HLSB:
+            i = (y*self.stride + x) >> 3
+            bit = 0x80 >> (x & 7)
+        elif self.format == MONO_HMSB:
+            i = (y*self.stride + x) >> 3
+            bit = 1 << (x & 7)
+        else:
+            i = (y >> 3)*self.stride + x
+            bit = 1 << (y & 7)
+        if c == None:
+            return 1 if buf[i] & bit else 0
+        if c:
+            buf[i] |= bit
+        else:
+            buf[i] &= ~bit & 0xFF
+
+    def fill(self,c):
+        if self.format == RGB565:
+            lo = c & 0xFF
+            hi = (c >> 8) & 0xFF
+            for i in range(0,len(self.buf)-1,2):
+                self.buf[i]   = lo
+                self.buf[i+1] = hi
+        else:
+            v = 0xFF if c else 0
+            for i in range(len(self.buf)):
+                self.buf[i] = v
+
+    def fill_rect(self,x,y,w,h,c):
+        for yy in range(max(y,0),min(y+h,self.height)):
+            for xx in range(max(x,0),min(x+w,self.width)):
+                self.pixel(xx,yy,c)
+
+    def hline(self,x,y,w,c):
+        self.fill_rect(x,y,w,1,c)
+
+    def vline(self,x,y,h,c):
+        self.fill_rect(x,y,1,h,c)
+
+    def rect(self,x,y,w,h,c,f=False):
+        if f:
+            self.fill_rect(x,y,w,h,c)
+            return
+        self.hline(x,y,w,c)
+        self.hline(x,y+h-1,w,c)
+        self.vline(x,y,h,c)
+        self.vline(x+w-1,y,h,c)
+
+    def line(self,x0,y0,x1,y1,c):
+        dx = abs(x1-x0)
+        dy = -abs(y1-y0)
+        sx = 1 if x0 < x1 else -1
+        sy = 1 if y0 < y1 else -1
+        err = dx + dy
+        while True:
+            self.pixel(x0,y0,c)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2*err
+            if e2 >= dy:
+                err += dy
+                x0  += sx
+            if e2 <= dx:
+                err += dx
+                y0  += sy
+
+    def ellipse(self,x,y,xr,yr,c,f=False,m=0xF):
+        self.rect(x-xr,y-yr,2*xr+1,2*yr+1,c,f)
+
+    def text(self,s,x,y,c=1):
+        self.fill_rect(x,y,8*len(s),8,0)
+
+    def scroll(self,xstep,ystep):
+        pass
+
+    def blit(self,fbuf,x,y,key=-1,palette=None):
+        for yy in range(fbuf.height):
+            for xx in range(fbuf.width):
+                c = fbuf.pixel(xx,yy)
+                if c != key:
+                    self.pixel(x+xx,y+yy,c)
@@ -0,0 +1,208 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for the MicroPython machine module, used by
+    host/psos_sim.py to boot PSOS on a host PC.
+
+    Reads return fixed values that look like an idle device:
+      - I2C answers at 0x27 (LCD1602), 0x3C (SSD1306) and
+        0x68 (MPU6050, lying flat)
+      - ADC reads mid scale, TouchPad reads as not touched
+    Writes are counted in i2c_writes, i2c_bytes and spi_bytes.
+
+    reset() records the time and raises SimReset, which ends
+    the task of the service that called it.
+'''
+
+import time
+
+resets     = []
+i2c_writes = 0
+i2c_bytes  = 0
+spi_bytes  = 0
+
+class SimReset(Exception):
+    pass
+
+def reset():
+    resets.append(time.ticks_ms())
+    raise SimReset("machine.reset()")
+
+soft_reset = reset
+
+def unique_id():
+    return b"\x50\x53\x4f\x53\x00\x01"
+
+def freq(f=None):
+    return 240000000
+
+class Pin:
+    IN  = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP   = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING  = 8
+
+    def __init__(self,id,mode=-1,pull=-1,value=None,**kw):
+        self.id = id
+        self._value = 0 if value == None else value
+
+    def init(self,mode=-1,pull=-1,value=None,**kw):
+        if value != None:
+            self._value = value
+
+    def value(self,v=None):
+        if v == None:
+            return self._value
+        self._value = v
+
+    def __call__(self,v=None):
+        return self.value(v)
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self,handler=None,trigger=0,**kw):
+        return None
+
+class ADC:
+    ATTN_0DB   = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB   = 2
+    ATTN_11DB  = 3
+    WIDTH_12BIT = 3
+
+    def __init__(self,pin,*args,**kw):
+        self.pin = pin
+
+    def atten(self,a):
+        pass
+
+    def width(self,w):
+        pass
+
+    def read(self):
+        return 2048
+
+    def read_u16(self):
+        return 32768
+
+class TouchPad:
+    def __init__(self,pin):
+        self.pin = pin
+
+    def config(self,v):
+        pass
+
+    def read(self):
+        return 1000
+
+class PWM:
+    def __init__(self,pin,freq=0,duty=0,**kw):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self,f=None):
+        if f == None:
+            return self._freq
+        self._freq = f
+
+    def duty(self,d=None):
+        if d == None:
+            return self._duty
+        self._duty = d
+
+    def duty_u16(self,d=None):
+        if d == None:
+            return self._duty
+        self._duty = d
+
+    def deinit(self):
+        pass
+
+# MPU6050 registers read by lib/imu.py
+_WHO_AM_I = 0x75
+_ACCEL    = 0x3B
+
+class I2C:
+    devices = [0x27,0x3C,0x68]
+
+    def __init__(self,id=0,*args,**kw):
+        self.id = id
+
+    def scan(self):
+        return list(self.devices)
+
+    def _count(self,n):
+        global i2c_writes, i2c_bytes
+        i2c_writes += 1
+        i2c_bytes  += n
+        return n
+
+    def writeto(self,addr,buf,stop=True):
+        return self._count(len(buf))
+
+    def writevto(self,addr,bufs,stop=True):
+        return self._count(sum(len(b) for b in bufs))
+
+    def writeto_mem(self,addr,memaddr,buf,**kw):
+        self._count(len(buf))
+
+    def readfrom(self,addr,n,stop=True):
+        return bytes(n)
+
+    def readfrom_into(self,addr,buf,stop=True):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def readfrom_mem(self,addr,memaddr,n,**kw):
+        buf = bytearray(n)
+        self.readfrom_mem_into(addr,memaddr,buf)
+        return bytes(buf)
+
+    def readfrom_mem_into(self,addr,memaddr,buf,**kw):
+        for i in range(len(buf)):
+            buf[i] = 0
+        if memaddr == _WHO_AM_I:
+            buf[0] = 0x68
+        elif memaddr == _ACCEL and len(buf) >= 6:
+            # 1g on the z axis
+            buf[4] = 0x40
+
+SoftI2C = I2C
+
+class SPI:
+    MSB = 0
+    LSB = 1
+
+    def __init__(self,id=0,*args,**kw):
+        self.id = id
+
+    def init(self,*args,**kw):
+        pass
+
+    def deinit(self):
+        pass
+
+    def write(self,buf):
+        global spi_bytes
+        spi_bytes += len(buf)
+
+    def read(self,n,write=0):
+        return bytes([0xFF]*n)
+
+    def readinto(self,buf,write=0):
+        for i in range(len(buf)):
+            buf[i] = 0xFF
+
+    def write_readinto(self,wbuf,rbuf):
+        self.write(wbuf)
+        self.readinto(rbuf)
+
+SoftSPI = SPI
@@ -0,0 +1,46 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for the MicroPython network module, used by
+    host/psos_sim.py. A WLAN connects as soon as connect()
+    is called and scans find a single network, "sim".
+'''
+
+STA_IF = 0
+AP_IF  = 1
+
+STAT_GOT_IP = 3
+
+class WLAN:
+    def __init__(self,iface=STA_IF):
+        self.iface = iface
+        self._active = False
+        self._connected = False
+
+    def active(self,v=None):
+        if v == None:
+            return self._active
+        self._active = v
+
+    def connect(self,ssid=None,password=None,**kw):
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._connected
+
+    def status(self,param=None):
+        return STAT_GOT_IP if self._connected else 0
+
+    def ifconfig(self,cfg=None):
+        return ("10.0.0.2","255.255.255.0","10.0.0.1","10.0.0.1")
+
+    def config(self,*args,**kw):
+        if "mac" in args:
+            return b"\x50\x53\x4f\x53\x00\x01"
+        return None
+
+    def scan(self):
+        return [(b"sim",b"\x00"*6,1,-40,3,False)]
@@ -0,0 +1,11 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for ntptime, used by host/psos_sim.py.
+    The host clock is already set.
+'''
+
+host = "pool.ntp.org"
+
+def settime():
+    pass
@@ -0,0 +1,30 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for lib/sdcard.py, used by host/psos_sim.py.
+    Every card is present and blank. os.mount() of a card
+    (see psos_sim.py) makes the mount point a directory in
+    the device's file system, so the blocks are never used.
+'''
+
+SECTORS = 2*1024*1024   # 1GB of 512 byte blocks
+
+class SDCard:
+    def __init__(self,spi,cs,baudrate=1320000):
+        self.spi = spi
+        self.cs  = cs
+        self.sectors = SECTORS
+
+    def readblocks(self,block_num,buf,offset=0):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def writeblocks(self,block_num,buf,offset=0):
+        pass
+
+    def ioctl(self,op,arg):
+        if op == 4:  # number of blocks
+            return self.sectors
+        if op == 5:  # block size
+            return 512
+        return 0
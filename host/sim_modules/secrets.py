@@ -0,0 +1,32 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    secrets.py for host/psos_sim.py. Every wifi network
+    and MQTT broker name in a parms file resolves to the
+    simulated network and the in-process fake broker.
+    psos_sim sets broker to the fake broker's address.
+    A proxy client (svc_mqtt_proxy_client) connects to proxy.
+'''
+
+broker = ["127.0.0.1",1883]
+proxy  = ["127.0.0.1"]
+
+class _Any(dict):
+    def __init__(self,make):
+        super().__init__()
+        self._make = make
+
+    # made on each use, so a new fake broker's port is seen
+    def __missing__(self,key):
+        return self._make()
+
+    def __contains__(self,key):
+        return True
+
+wifi_priority = ["sim"]
+
+wifi = _Any(lambda: {"ssid":"sim", "password":"", "mqtt_priority":["sim"],
+                     "mqtt_proxy":proxy[0]})
+mqtt = _Any(lambda: {"server":broker[0], "port":broker[1]})
+
+git_token = ""
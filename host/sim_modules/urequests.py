@@ -0,0 +1,58 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    Stand-in for urequests, used by host/psos_sim.py.
+    The sim has no network. Files on GitHub
+    (https://raw.githubusercontent.com/{repo}/{sha}/{fn})
+    are read from this repo's working tree, whatever the sha,
+    so svc_git_upd sees the local files. Anything else is
+    answered with a 404. Requests are counted in requests.
+'''
+
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GITHUB = "https://raw.githubusercontent.com/"
+
+requests = []
+
+class Response:
+    def __init__(self,status_code,content=b""):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        import json
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+def request(method,url,data=None,json=None,headers={},**kw):
+    requests.append((method,url))
+    if method == "GET" and url.startswith(GITHUB):
+        # repo owner, repo name and sha come before the file name
+        fn = url[len(GITHUB):].split("/",3)
+        if len(fn) == 4:
+            fn = os.path.join(ROOT,*fn[3].split("/"))
+            if os.path.isfile(fn):
+                with open(fn,"rb") as f:
+                    return Response(200,f.read())
+    return Response(404)
+
+def get(url,**kw):
+    return request("GET",url,**kw)
+
+def post(url,**kw):
+    return request("POST",url,**kw)
+
+def put(url,**kw):
+    return request("PUT",url,**kw)
+
+def delete(url,**kw):
+    return request("DELETE",url,**kw)
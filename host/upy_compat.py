@@ -0,0 +1,271 @@
+'''
+    Intended to be run on non-microcontroller device.
+
+    MicroPython compatibility for running PSOS modules under CPython.
+
+    Call install() before importing any PSOS module. It will:
+      - add the lib and base directories to sys.path
+      - alias ujson, ubinascii, ustruct, utime and uasyncio to their CPython equivalents
+      - add uasyncio StreamReader and StreamWriter that wrap a socket,
+        and an open_connection and start_server whose streams behave
+        as on MicroPython
+      - provide a usocket module whose sockets have read, write and readline
+      - add ticks_ms, ticks_diff, sleep_ms and sleep_us to the time module
+      - add sys.print_exception
+      - load lib/queue.py as "queue" instead of the CPython queue module
+
+    Only what is needed by the host side tools is provided here.
+'''
+
+import sys
+import os
+import time
+import json
+import types
+import socket
+import struct
+import binascii
+import asyncio
+import traceback
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_installed = False
+
+def _ticks_ms():
+    return int(time.perf_counter() * 1000)
+
+def _ticks_us():
+    return int(time.perf_counter() * 1000000)
+
+def _ticks_diff(t1,t2):
+    return t1 - t2
+
+def _ticks_add(t,delta):
+    return t + delta
+
+def _sleep_ms(ms):
+    time.sleep(ms/1000)
+
+def _sleep_us(us):
+    time.sleep(us/1000000)
+
+async def _async_sleep_ms(ms):
+    await asyncio.sleep(ms/1000)
+
+def _print_exception(e,file=None):
+    traceback.print_exception(type(e),e,e.__traceback__,file=file or sys.stdout)
+
+def _const(v):
+    return v
+
+# MicroPython style socket: read, write and readline
+# in addition to the CPython socket methods
+class _Socket(socket.socket):
+
+    def read(self,n=-1):
+        if n < 0:
+            return self.makefile("rb").read()
+        if self.gettimeout() == 0.0:
+            # non-blocking, return whatever is available
+            try:
+                return self.recv(n)
+            except BlockingIOError:
+                return None
+        b = b""
+        while len(b) < n:
+            r = self.recv(n-len(b))
+            if not r:
+                break
+            b += r
+        return b
+
+    def readline(self):
+        b = b""
+        while not b.endswith(b"\n"):
+            r = self.recv(1)
+            if not r:
+                break
+            b += r
+        return b
+
+    def write(self,buf,n=None):
+        if n is not None:
+            buf = buf[:n]
+        if self.gettimeout() == 0.0:
+            try:
+                return self.send(buf)
+            except BlockingIOError:
+                return None
+        self.sendall(buf)
+        return len(buf)
+
+def _usocket():
+    m = types.ModuleType("usocket")
+    m.__dict__.update(socket.__dict__)
+    m.socket = _Socket
+    return m
+
+# uasyncio style stream wrapping a socket.
+# Used for both StreamReader and StreamWriter.
+class _Stream:
+
+    def __init__(self,s,e={}):
+        self.s = s
+        self.e = e
+        self.out_buf = b""
+        self._in_buf = b""
+        s.setblocking(False)
+
+    def get_extra_info(self,v):
+        return self.e[v]
+
+    async def read(self,n=-1):
+        if self._in_buf:
+            if n < 0:
+                n = len(self._in_buf)
+            b = self._in_buf[:n]
+            self._in_buf = self._in_buf[n:]
+            return b
+        if n < 0:
+            n = 4096
+        return await asyncio.get_running_loop().sock_recv(self.s,n)
+
+    async def readexactly(self,n):
+        b = b""
+        while len(b) < n:
+            r = await self.read(n-len(b))
+            if not r:
+                raise EOFError
+            b += r
+        return b
+
+    async def readline(self):
+        while not b"\n" in self._in_buf:
+            r = await asyncio.get_running_loop().sock_recv(self.s,4096)
+            if not r:
+                b = self._in_buf
+                self._in_buf = b""
+                return b
+            self._in_buf += r
+        i = self._in_buf.index(b"\n") + 1
+        b = self._in_buf[:i]
+        self._in_buf = self._in_buf[i:]
+        return b
+
+    def write(self,buf):
+        if type(buf) == str:
+            buf = buf.encode()
+        self.out_buf += bytes(buf)
+
+    async def drain(self):
+        if self.out_buf:
+            b = self.out_buf
+            self.out_buf = b""
+            await asyncio.get_running_loop().sock_sendall(self.s,b)
+
+    def close(self):
+        self.s.close()
+
+    async def wait_closed(self):
+        self.s.close()
+
+# as on MicroPython, the reader and writer are one stream
+# and the socket is stream.s
+async def _open_connection(host,port):
+    ai = socket.getaddrinfo(host,port,0,socket.SOCK_STREAM)[0]
+    s = _Socket(ai[0],ai[1],ai[2])
+    s.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(s,ai[-1])
+    except BaseException:
+        s.close()
+        raise
+    ss = _Stream(s)
+    return ss,ss
+
+# the server side streams: the writer takes str as well as
+# bytes and the reader has wait_closed, as on MicroPython
+class _ServerWriter:
+
+    def __init__(self,w):
+        self._w = w
+
+    def write(self,buf):
+        if type(buf) == str:
+            buf = buf.encode()
+        self._w.write(buf)
+
+    def __getattr__(self,name):
+        return getattr(self._w,name)
+
+# a client task cancelled when the loop stops ends quietly.
+# wait_closed() closes the stream first, as on MicroPython
+async def _start_server(cb,host,port,backlog=5):
+    async def client(r,w):
+        w = _ServerWriter(w)
+        async def wait_closed():
+            w.close()
+            await w.wait_closed()
+        r.wait_closed = wait_closed
+        try:
+            await cb(r,w)
+        except asyncio.CancelledError:
+            w.close()
+    return await asyncio.start_server(client,host,port,backlog=backlog)
+
+def _uasyncio():
+    m = types.ModuleType("uasyncio")
+    m.__dict__.update(asyncio.__dict__)
+    m.sleep_ms = _async_sleep_ms
+    m.start_server = _start_server
+    m.open_connection = _open_connection
+    m.StreamReader = _Stream
+    m.StreamWriter = _Stream
+    return m
+
+def _micropython():
+    m = types.ModuleType("micropython")
+    m.const = _const
+    m.mem_info = lambda *args: None
+    return m
+
+def _load_module(name,fn):
+    spec = importlib.util.spec_from_file_location(name,fn)
+    m = importlib.util.module_from_spec(spec)
+    sys.modules[name] = m
+    spec.loader.exec_module(m)
+    return m
+
+def install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    for d in ("base","lib"):
+        p = os.path.join(ROOT,d)
+        if not p in sys.path:
+            sys.path.insert(0,p)
+
+    time.ticks_ms   = _ticks_ms
+    time.ticks_us   = _ticks_us
+    time.ticks_diff = _ticks_diff
+    time.ticks_add  = _ticks_add
+    time.sleep_ms   = _sleep_ms
+    time.sleep_us   = _sleep_us
+
+    sys.print_exception = _print_exception
+
+    sys.modules["ujson"]       = json
+    sys.modules["ubinascii"]   = binascii
+    sys.modules["ustruct"]     = struct
+    sys.modules["utime"]       = time
+    sys.modules["usocket"]     = _usocket()
+    sys.modules["uasyncio"]    = _uasyncio()
+    sys.modules["micropython"] = _micropython()
+
+    # CPython already has a queue module (used by asyncio)
+    # replace it with the PSOS lib/queue.py
+    _load_module("queue",os.path.join(ROOT,"lib","queue.py"))
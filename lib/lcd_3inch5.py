@@ -34,6 +34,12 @@ from gfx import GFX
 
 from sys import byteorder
 
+# use the PSOS garbage collection policy if available
+try:
+    from psos_gc import maybe_collect
+except ImportError:
+    maybe_collect = gc.collect
+
 _VER  = const("0.3")
 print('running 3.5" LCD v{}'.format(_VER))
 
@@ -163,7 +169,7 @@ class LCD(framebuf.FrameBuffer):
         
         self.write_bytearray(self.buffer) # write the entire buffer to LCD
         
-        gc.collect()
+        maybe_collect()
         
     def bl_ctrl(self,duty):
         pwm = PWM(Pin(LCD_BL))
@@ -18,21 +18,38 @@ class QueueEmpty(Exception):
 class QueueFull(Exception):
     pass
 
+# Items are kept in a list used as a ring buffer, so get() doesn't
+# shift the whole backlog as list.pop(0) does. A queue with a
+# maxsize preallocates that many slots, an unlimited queue starts
+# small and doubles its buffer when full. The buffer doesn't shrink.
+# Tasks waiting on get() are only woken when the queue goes from
+# empty to non-empty and tasks waiting on put() when it goes from
+# full to not full.
 class Queue:
 
     def __init__(self, maxsize=0):
         self.maxsize = maxsize
-        self._queue = []
-        self._evput = asyncio.Event()  # Triggered by put, tested by get
-        self._evget = asyncio.Event()  # Triggered by get, tested by put
+        self._queue = [None] * (maxsize if maxsize > 0 else 4)
+        self._head = 0  # next item to get
+        self._cnt = 0   # number of items in queue
+        self._evput = asyncio.Event()  # Triggered by put to empty queue
+        self._evget = asyncio.Event()  # Triggered by get from full queue
 
     def _get(self):
-        self._evget.set()  # Schedule all tasks waiting on get
-        self._evget.clear()
-        return self._queue.pop(0)
+        if self._cnt == self.maxsize:
+            self._evget.set()  # Schedule tasks waiting for space
+            self._evget.clear()
+        q = self._queue
+        h = self._head
+        val = q[h]
+        q[h] = None  # release reference
+        h += 1
+        self._head = 0 if h == len(q) else h
+        self._cnt -= 1
+        return val
 
     async def get(self):  #  Usage: item = await queue.get()
-        while self.empty():  # May be multiple tasks waiting on get()
+        while self._cnt == 0:  # May be multiple tasks waiting on get()
             # Queue is empty, suspend task until a put occurs
             # 1st of N tasks gets, the rest loop again
             await self._evput.wait()
@@ -44,10 +61,29 @@ class Queue:
             raise QueueEmpty()
         return self._get()
 
+    def peek(self):  # Return the next item without removing it.
+        if self._cnt == 0:
+            raise QueueEmpty()
+        return self._queue[self._head]
+
     def _put(self, val):
-        self._evput.set()  # Schedule tasks waiting on put
-        self._evput.clear()
-        self._queue.append(val)
+        if self._cnt == 0:
+            self._evput.set()  # Schedule tasks waiting on empty queue
+            self._evput.clear()
+        q = self._queue
+        n = len(q)
+        if self._cnt == n:
+            # unlimited queue is full, double the buffer
+            h = self._head
+            q = q[h:] + q[:h] + [None] * n
+            self._queue = q
+            self._head = 0
+            n += n
+        t = self._head + self._cnt
+        if t >= n:
+            t -= n
+        q[t] = val
+        self._cnt += 1
 
     async def put(self, val):  # Usage: await queue.put(item)
         while self.full():
@@ -61,13 +97,25 @@ class Queue:
             raise QueueFull()
         self._put(val)
 
+    def replace(self, match, val):  # Replace first item where match(item) is True
+        q = self._queue
+        i = self._head
+        for n in range(self._cnt):
+            if match(q[i]):
+                q[i] = val
+                return True
+            i += 1
+            if i == len(q):
+                i = 0
+        return False
+
     def qsize(self):  # Number of items in the queue.
-        return len(self._queue)
+        return self._cnt
 
     def empty(self):  # Return True if the queue is empty, False otherwise.
-        return len(self._queue) == 0
+        return self._cnt == 0
 
     def full(self):  # Return True if there are maxsize items in the queue.
         # Note: if the Queue was initialized with maxsize=0 (the default) or
         # any negative number, then full() is never True.
-        return self.maxsize > 0 and self.qsize() >= self.maxsize
\ No newline at end of file
+        return self.maxsize > 0 and self._cnt >= self.maxsize
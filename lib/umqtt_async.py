@@ -0,0 +1,317 @@
+# umqtt_async.py: uasyncio receive path for umqtt_simple.MQTTClient
+#
+# Connects using the blocking umqtt_simple handshake, then switches the
+# socket to non-blocking and reads it through a uasyncio StreamReader.
+# Incoming packets are parsed from a single reusable buffer which grows
+# only when a packet larger than the buffer arrives.
+#
+# Keepalive pings are sent from a timer task when nothing has been sent
+# for half of the keepalive period. If no PINGRESP arrives within the
+# keepalive period the connection is considered lost.
+#
+# publish(), publish_many(), subscribe() and ping() are coroutines
+# in this class.
+#
+# QoS 1 publishes do not wait for the PUBACK. Up to "window" messages
+# may be in flight; publish() only waits when the window is full.
+# PUBACKs are matched by wait_msgs() and unacknowledged messages are
+# resent with the DUP flag every retry_ms. publish() returns a PubAck
+# for QoS 1 messages:
+#
+#     ack = await client.publish(topic, msg, qos=1)
+#     ok  = await ack.wait()   # True when PUBACK received,
+#                              # False if the connection was lost
+
+import uasyncio
+import time
+from umqtt_simple import MQTTClient, MQTTException
+
+
+# Completion of a QoS 1 publish
+class PubAck:
+    def __init__(self, pkt):
+        self.pkt = pkt  # packet to resend
+        self.sent = time.ticks_ms()
+        self.acked = False
+        self._ev = uasyncio.Event()
+
+    def done(self, acked):
+        self.acked = acked
+        self.pkt = None
+        self._ev.set()
+
+    async def wait(self):
+        await self._ev.wait()
+        return self.acked
+
+
+class MQTTAsyncClient(MQTTClient):
+    def __init__(self, client_id, server, buf_sz=256, window=4, retry_ms=5000, **kw):
+        super().__init__(client_id, server, **kw)
+        self.window = window
+        self.retry_ms = retry_ms
+        self._inflight = {}  # pid -> PubAck
+        self._ev_window = uasyncio.Event()  # set when a PUBACK frees the window
+        self._buf = bytearray(buf_sz)
+        self._mv = memoryview(self._buf)
+        self._len = 0
+        self._sreader = None
+        self._swriter = None
+        self._last_tx = 0
+        self._ping_sent = 0  # ticks of unanswered PINGREQ, 0 if none
+        self._rd_task = None
+        self._timed_out = False
+        self._wlock = uasyncio.Lock()  # one drain at a time
+
+    def connect(self, clean_session=True):
+        r = super().connect(clean_session)
+        self.sock.setblocking(False)
+        self._sreader = uasyncio.StreamReader(self.sock)
+        self._swriter = uasyncio.StreamWriter(self.sock, {})
+        self._len = 0
+        self._last_tx = time.ticks_ms()
+        self._ping_sent = 0
+        return r
+
+    async def _send(self, pkt):
+        self._swriter.write(pkt)
+        await self._drain()
+
+    async def _drain(self):
+        async with self._wlock:
+            await self._swriter.drain()
+        self._last_tx = time.ticks_ms()
+
+    async def ping(self):
+        if self._ping_sent == 0:
+            self._ping_sent = time.ticks_ms()
+        await self._send(b"\xc0\0")
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        pid = 0
+        if qos > 0:
+            await self._wait_window(1)
+            pid = self._next_pid()
+        n = self._encode_publish(0, topic, msg, retain, qos, pid)
+        ack = None
+        if qos > 0:
+            ack = self._track(pid, 0, n)
+        await self._send(memoryview(self._sbuf)[:n])
+        return ack
+
+    # Publish several messages with one write.
+    # msgs is a list of (topic, msg) or (topic, msg, retain, qos) tuples.
+    # Returns a list of PubAck, one for each QoS 1 message.
+    async def publish_many(self, msgs):
+        acks = []
+        await self._wait_window(sum(1 for m in msgs if len(m) > 2 and m[3] > 0))
+        p = 0
+        for m in msgs:
+            retain = False
+            qos = 0
+            if len(m) > 2:
+                retain = m[2]
+                qos = m[3]
+            pid = 0
+            if qos > 0:
+                pid = self._next_pid()
+            start = p
+            p = self._encode_publish(p, m[0], m[1], retain, qos, pid)
+            if qos > 0:
+                acks.append(self._track(pid, start, p))
+        if p > 0:
+            await self._send(memoryview(self._sbuf)[:p])
+        return acks
+
+    # wait for room for n more messages in the in-flight window
+    async def _wait_window(self, n):
+        n = min(n, self.window)
+        while len(self._inflight) + n > self.window:
+            await self._ev_window.wait()
+
+    # keep a copy of the packet in the send buffer for resending
+    def _track(self, pid, start, end):
+        ack = PubAck(bytearray(memoryview(self._sbuf)[start:end]))
+        self._inflight[pid] = ack
+        return ack
+
+    def _puback(self, pid):
+        ack = self._inflight.pop(pid, None)
+        if ack is not None:
+            ack.done(True)
+            self._ev_window.set()
+            self._ev_window.clear()
+
+    # resend messages not acknowledged within retry_ms
+    async def _resend(self, t):
+        for ack in self._inflight.values():
+            if time.ticks_diff(t, ack.sent) >= self.retry_ms:
+                ack.pkt[0] |= 0x08  # DUP
+                ack.sent = t
+                self._swriter.write(ack.pkt)
+        await self._drain()
+
+    # connection lost, fail any messages in flight
+    def _fail_inflight(self):
+        for ack in self._inflight.values():
+            ack.done(False)
+        self._inflight = {}
+        self._ev_window.set()
+        self._ev_window.clear()
+
+    # Send SUBSCRIBE. The SUBACK is handled by wait_msgs().
+    async def subscribe(self, topic, qos=0):
+        assert self.cb is not None, "Subscribe callback is not set"
+        pid = self._next_pid()
+        pkt = bytearray(b"\x82\0\0\0")
+        pkt[1] = 2 + 2 + len(topic) + 1
+        pkt[2] = pid >> 8
+        pkt[3] = pid & 0xFF
+        self._swriter.write(pkt)
+        self._swriter.write(len(topic).to_bytes(2, "big"))
+        self._swriter.write(topic)
+        await self._send(qos.to_bytes(1, "little"))
+
+    # Send UNSUBSCRIBE. The UNSUBACK is ignored by wait_msgs().
+    async def unsubscribe(self, topic):
+        pid = self._next_pid()
+        pkt = bytearray(b"\xa2\0\0\0")
+        pkt[1] = 2 + 2 + len(topic)
+        pkt[2] = pid >> 8
+        pkt[3] = pid & 0xFF
+        self._swriter.write(pkt)
+        self._swriter.write(len(topic).to_bytes(2, "big"))
+        await self._send(topic)
+
+    # keepalive pings and QoS 1 resends
+    async def _timer(self):
+        period = self.keepalive * 1000
+        tick = self.retry_ms // 2
+        if period and period // 4 < tick:
+            tick = period // 4
+        while True:
+            await uasyncio.sleep_ms(tick)
+            t = time.ticks_ms()
+            if self._inflight:
+                await self._resend(t)
+            if not period:
+                continue
+            if self._ping_sent != 0 and time.ticks_diff(t, self._ping_sent) > period:
+                # no PINGRESP, stop wait_msgs()
+                self._timed_out = True
+                self._rd_task.cancel()
+                return
+            if time.ticks_diff(t, self._last_tx) >= period // 2:
+                await self.ping()
+
+    # Receive and process incoming messages until the
+    # connection is lost, then raise OSError.
+    # Subscribed messages are delivered to a callback previously
+    # set by .set_callback() method.
+    async def wait_msgs(self):
+        self._timed_out = False
+        self._rd_task = uasyncio.current_task()
+        tmr = uasyncio.create_task(self._timer())
+        try:
+            while True:
+                if not await self._fill():
+                    raise OSError(-1)
+                if self._parse():
+                    await self._drain()
+        except uasyncio.CancelledError:
+            if self._timed_out:
+                raise OSError("MQTT keepalive timeout")
+            raise
+        finally:
+            tmr.cancel()
+            self._fail_inflight()
+
+    # read whatever is available into the buffer.
+    # returns False if the connection was closed.
+    async def _fill(self):
+        if self._len == len(self._buf):
+            # packet larger than buffer, double the buffer
+            b = bytearray(len(self._buf) * 2)
+            b[: self._len] = self._buf
+            self._buf = b
+            self._mv = memoryview(b)
+
+        try:
+            data = await self._sreader.read(len(self._buf) - self._len)
+        except OSError:
+            return False
+        if data is None:
+            # TLS socket with only part of a record available
+            return True
+        if not data:
+            return False
+        n = len(data)
+        self._mv[self._len : self._len + n] = data
+        self._len += n
+        return True
+
+    # process all complete packets in the buffer.
+    # returns True if a response was written.
+    def _parse(self):
+        buf = self._buf
+        i = 0
+        wrote = False
+        while self._len - i >= 2:
+            # decode remaining length
+            sz = 0
+            sh = 0
+            j = i + 1
+            while True:
+                if j >= self._len:
+                    sz = -1
+                    break
+                b = buf[j]
+                j += 1
+                sz |= (b & 0x7F) << sh
+                if not b & 0x80:
+                    break
+                sh += 7
+            if sz < 0 or j + sz > self._len:
+                break  # incomplete packet
+            if self._packet(buf[i], j, sz):
+                wrote = True
+            i = j + sz
+
+        # move any partial packet to the start of the buffer
+        if i > 0:
+            n = self._len - i
+            if n > 0:
+                self._mv[:n] = self._mv[i : self._len]
+            self._len = n
+        return wrote
+
+    # process one packet with variable header and
+    # payload in buf[p:p+sz]. returns True if a response was written.
+    def _packet(self, op, p, sz):
+        buf = self._buf
+        t = op & 0xF0
+        if t == 0x30:  # PUBLISH
+            end = p + sz
+            topic_len = buf[p] << 8 | buf[p + 1]
+            p += 2
+            topic = bytes(self._mv[p : p + topic_len])
+            p += topic_len
+            pid = 0
+            if op & 6:
+                pid = buf[p] << 8 | buf[p + 1]
+                p += 2
+            msg = bytes(self._mv[p:end])
+            self.cb(topic, msg)
+            if op & 6 == 2:
+                self._swriter.write(bytes((0x40, 0x02, pid >> 8, pid & 0xFF)))
+                return True
+            elif op & 6 == 4:
+                raise MQTTException("QoS 2 not supported")
+        elif t == 0x40:  # PUBACK
+            self._puback(buf[p] << 8 | buf[p + 1])
+        elif t == 0xD0:  # PINGRESP
+            self._ping_sent = 0
+        elif t == 0x90:  # SUBACK
+            if buf[p + 2] == 0x80:
+                print("MQTT subscribe rejected, pid", buf[p] << 8 | buf[p + 1])
+        return False
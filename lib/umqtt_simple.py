@@ -36,6 +36,51 @@ class MQTTClient:
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
+        # send buffer reused by publish(), grown as needed
+        self._sbuf = bytearray(64)
+
+    # Make sure the send buffer can hold sz bytes.
+    def _sbuf_size(self, sz):
+        if len(self._sbuf) < sz:
+            b = bytearray(max(sz, len(self._sbuf) * 2))
+            b[: len(self._sbuf)] = self._sbuf
+            self._sbuf = b
+        return self._sbuf
+
+    # Encode a complete PUBLISH packet into the send buffer at
+    # position p. Returns the position following the packet.
+    def _encode_publish(self, p, topic, msg, retain, qos, pid):
+        sz = 2 + len(topic) + len(msg)
+        if qos > 0:
+            sz += 2
+        assert sz < 2097152
+        buf = self._sbuf_size(p + 4 + sz)
+        buf[p] = 0x30 | qos << 1 | retain
+        p += 1
+        while sz > 0x7F:
+            buf[p] = (sz & 0x7F) | 0x80
+            sz >>= 7
+            p += 1
+        buf[p] = sz
+        n = len(topic)
+        buf[p + 1] = n >> 8
+        buf[p + 2] = n & 0xFF
+        p += 3
+        buf[p : p + n] = topic
+        p += n
+        if qos > 0:
+            buf[p] = pid >> 8
+            buf[p + 1] = pid & 0xFF
+            p += 2
+        n = len(msg)
+        buf[p : p + n] = msg
+        return p + n
+
+    def _next_pid(self):
+        self.pid += 1
+        if self.pid > 0xFFFF:
+            self.pid = 1
+        return self.pid
 
     def _send_str(self, s):
         self.sock.write(struct.pack("!H", len(s)))
@@ -117,41 +162,55 @@ class MQTTClient:
     def ping(self):
         self.sock.write(b"\xc0\0")
 
+    # Publish a message using a single socket write of
+    # a packet encoded into the reusable send buffer.
     def publish(self, topic, msg, retain=False, qos=0):
-        pkt = bytearray(b"\x30\0\0\0")
-        pkt[0] |= qos << 1 | retain
-        sz = 2 + len(topic) + len(msg)
-        if qos > 0:
-            sz += 2
-        assert sz < 2097152
-        i = 1
-        while sz > 0x7F:
-            pkt[i] = (sz & 0x7F) | 0x80
-            sz >>= 7
-            i += 1
-        pkt[i] = sz
-        # print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt, i + 1)
-        self._send_str(topic)
+        pid = 0
         if qos > 0:
-            self.pid += 1
-            pid = self.pid
-            struct.pack_into("!H", pkt, 0, pid)
-            self.sock.write(pkt, 2)
-        self.sock.write(msg)
+            pid = self._next_pid()
+        n = self._encode_publish(0, topic, msg, retain, qos, pid)
+        self.sock.write(self._sbuf, n)
         if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
+            self._wait_puback((pid,))
         elif qos == 2:
             assert 0
 
+    # Publish several messages with one socket write
+    # (one TLS record when the packets fit).
+    # msgs is a list of (topic, msg) or (topic, msg, retain, qos) tuples.
+    def publish_many(self, msgs):
+        p = 0
+        pids = []
+        for m in msgs:
+            retain = False
+            qos = 0
+            if len(m) > 2:
+                retain = m[2]
+                qos = m[3]
+            assert qos < 2
+            pid = 0
+            if qos > 0:
+                pid = self._next_pid()
+                pids.append(pid)
+            p = self._encode_publish(p, m[0], m[1], retain, qos, pid)
+        if p > 0:
+            self.sock.write(self._sbuf, p)
+        if pids:
+            self._wait_puback(pids)
+
+    # wait until a PUBACK has been received for each pid,
+    # a duplicate PUBACK is ignored
+    def _wait_puback(self, pids):
+        pids = set(pids)
+        while pids:
+            op = self.wait_msg()
+            if op == 0x40:
+                sz = self.sock.read(1)
+                assert sz == b"\x02"
+                rcv_pid = self.sock.read(2)
+                rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
+                pids.discard(rcv_pid)
+
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
         pkt = bytearray(b"\x82\0\0\0")
@@ -171,6 +230,18 @@ class MQTTClient:
                     raise MQTTException(resp[3])
                 return
 
+    def unsubscribe(self, topic):
+        pkt = bytearray(b"\xa2\0\0\0")
+        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic), self._next_pid())
+        self.sock.write(pkt)
+        self._send_str(topic)
+        while 1:
+            op = self.wait_msg()
+            if op == 0xB0:
+                resp = self.sock.read(3)
+                assert resp[1] == pkt[2] and resp[2] == pkt[3]
+                return
+
     # Wait for a single incoming MQTT message and process it.
     # Subscribed messages are delivered to a callback previously
     # set by .set_callback() method. Other (internal) MQTT
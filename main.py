@@ -8,6 +8,7 @@ import ujson
 import uasyncio
 import gc
 import sys
+import os
 
 # load a json file
 # here because we can't use the psos_util
@@ -29,6 +30,21 @@ print("boot: config",config)
 if "path" in config:
     sys.path.extend(config["path"]) 
 
+# load precompiled .mpy modules in place of the .py source
+# if config.json has "mpy": true (or the mpy directory) and the
+# directory exists (see build_manifest.py). Off by default, so
+# a stale .mpy can't shadow a .py updated on its own.
+mpy = config.get("mpy",False)
+if mpy == True:
+    mpy = "/mpy"
+if mpy:
+    try:
+        os.stat(mpy)
+        sys.path.insert(0,mpy)
+        print("boot: loading modules from",mpy)
+    except OSError:
+        pass
+
 # now that we have path configured
 # we can import psos_util
 import psos_util